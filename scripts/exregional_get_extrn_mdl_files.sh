@@ -31,6 +31,8 @@
 #    USHdir
 #
 #  platform:
+#    EXTRN_MDL_CACHE_DIR
+#    EXTRN_MDL_CACHE_SIZE_GB
 #    EXTRN_MDL_DATA_STORES
 #
 #  workflow:
@@ -216,6 +218,12 @@ if [ $(boolify $SYMLINK_FIX_FILES) = "TRUE" ]; then
   --symlink"
 fi
 
+if [ -n "${EXTRN_MDL_CACHE_DIR:-}" ] ; then
+  additional_flags="$additional_flags \
+  --cache_dir ${EXTRN_MDL_CACHE_DIR} \
+  --cache_size_gb ${EXTRN_MDL_CACHE_SIZE_GB}"
+fi
+
 if [ $(boolify $DO_ENSEMBLE) = "TRUE" ] ; then
   mem_dir="/mem{mem:03d}"
   member_list=(1 ${NUM_ENS_MEMBERS})
@@ -485,6 +485,17 @@ echo "workflow: {CRES: ${CRES}}" | uw config realize \
   --update-format yaml \
   --output-file $GLOBAL_VAR_DEFNS_FP \
   --verbose
+#
+# Regenerate the precompiled exports of the variable definitions file so
+# that source_yaml in later tasks can keep using them instead of falling
+# back to uw now that the file has changed.
+#
+python3 ${USHdir}/create_var_defns_exports.py -p ${GLOBAL_VAR_DEFNS_FP}
+err=$?
+if [ $err -ne 0 ]; then
+  print_err_msg_exit "\
+Call to create_var_defns_exports.py failed with a non-zero exit status."
+fi
 
 #
 #-----------------------------------------------------------------------
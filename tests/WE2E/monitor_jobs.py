@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import os
+import re
 import sys
+import copy
 import argparse
 import logging
 import time
 from textwrap import dedent
+from statistics import median
 from datetime import datetime
 
 sys.path.append("../../ush")
@@ -14,10 +18,203 @@ from python_utils import load_config_file
 from check_python_version import check_python_version
 
 from utils import calculate_core_hours, write_monitor_file, update_expt_status,\
-                  update_expt_status_parallel, print_WE2E_summary
+                  update_expt_status_parallel, print_WE2E_summary, load_test_history
+
+# Seconds to wait between checks of an experiment, by experiment status: the first
+# interval applies after a check that changed the experiment, and the wait then
+# doubles after each check that didn't, up to the second interval
+CHECK_INTERVALS = {
+    "CREATED": (5, 5),
+    "SUBMITTING": (5, 60),
+    "QUEUED": (15, 300),
+    "RUNNING": (15, 300),
+    "DYING": (15, 120),
+    "SUCCEEDED": (5, 5),
+    "STALLED": (5, 30),
+    "STUCK": (30, 300),
+}
+
+# Seconds between looks at the experiment directories for signs of finished jobs
+WATCH_INTERVAL = 5
+
+
+class MonitorSchedule:
+    """Decides when each monitored experiment is checked next
+
+    Checking an experiment (running ``rocotorun`` and reading its database) is
+    expensive, so experiments whose status isn't changing are checked less and
+    less often. In between, the schedule watches the modification times of each
+    experiment's rocoto database and of the files in its ``log`` directory, which
+    are cheap to read, and makes an experiment due right away when
+
+    * a new log file appears (a job started),
+    * a log file that was being written stops changing (a job most likely ended), or
+    * the database was changed by something else (e.g. ``rocotorun`` from cron).
+
+    Args:
+        expts_dict (dict): A dictionary containing information for all experiments
+        names      (list): The names of the experiments to schedule; all are due at once
+    """
+
+    def __init__(self, expts_dict: dict, names: list):
+        self.expt_dirs = {name: expts_dict[name]["expt_dir"] for name in names}
+        self.next_check = {name: 0.0 for name in names}
+        self.interval = {}
+        self.mtimes = {name: self._scan(expt_dir) for name, expt_dir in self.expt_dirs.items()}
+        self.writing = {name: set() for name in names}
+        self.last_watch = time.monotonic()
+
+    @staticmethod
+    def _scan(expt_dir: str) -> dict:
+        """Returns the modification times of the rocoto database and the log files"""
+        mtimes = {}
+        try:
+            mtimes["FV3LAM_wflow.db"] = os.stat(os.path.join(expt_dir, "FV3LAM_wflow.db")).st_mtime_ns
+        except OSError:
+            pass
+        try:
+            with os.scandir(os.path.join(expt_dir, "log")) as entries:
+                for entry in entries:
+                    try:
+                        mtimes[entry.name] = entry.stat().st_mtime_ns
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return mtimes
+
+    def watch(self, now: float) -> None:
+        """Looks for changes in the experiment directories, making the experiments
+        with signs of started or finished jobs due at ``now``. The directories are
+        looked at no more than once every ``WATCH_INTERVAL`` seconds."""
+        if now - self.last_watch < WATCH_INTERVAL:
+            return
+        self.last_watch = now
+        for name, expt_dir in self.expt_dirs.items():
+            mtimes = self._scan(expt_dir)
+            previous = self.mtimes[name]
+            changed = {f for f, mtime in mtimes.items() if previous.get(f) != mtime}
+            changed.discard("FV3LAM_wflow.db")
+            started = mtimes.keys() - previous.keys()
+            ended = self.writing[name] - changed
+            if started or ended or mtimes.get("FV3LAM_wflow.db") != previous.get("FV3LAM_wflow.db"):
+                logging.debug(f"Experiment {name} changed; checking it now")
+                self.next_check[name] = min(self.next_check[name], now)
+            self.mtimes[name] = mtimes
+            self.writing[name] = changed
+
+    def due(self, now: float) -> list:
+        """Returns the names of the experiments due to be checked at ``now``"""
+        return [name for name, when in self.next_check.items() if when <= now]
+
+    def checked(self, name: str, status: str, changed: bool, now: float) -> None:
+        """Schedules the next check of an experiment that was just checked
+
+        Args:
+            name     (str): Name of the experiment
+            status   (str): The experiment status after the check
+            changed (bool): Whether the check changed the experiment's entry
+            now    (float): The time of the check
+        """
+        first, last = CHECK_INTERVALS.get(status, (WATCH_INTERVAL, WATCH_INTERVAL))
+        if changed or name not in self.interval:
+            self.interval[name] = first
+        else:
+            self.interval[name] = max(first, min(2 * self.interval[name], last))
+        self.next_check[name] = now + self.interval[name]
+        # Don't mistake the changes made by the check itself for new ones
+        self.mtimes[name] = self._scan(self.expt_dirs[name])
+        self.writing[name] = set()
+
+    def add(self, name: str, expt_dir: str, now: float) -> None:
+        """Starts scheduling an experiment, which is due at ``now``"""
+        self.expt_dirs[name] = expt_dir
+        self.next_check[name] = now
+        self.mtimes[name] = self._scan(expt_dir)
+        self.writing[name] = set()
+
+    def remove(self, name: str) -> None:
+        """Stops scheduling an experiment"""
+        for entries in (self.expt_dirs, self.next_check, self.interval, self.mtimes, self.writing):
+            entries.pop(name, None)
+
+    def wait_time(self, now: float) -> float:
+        """Returns the number of seconds until the next experiment is due or the
+        experiment directories should be looked at again"""
+        if not self.next_check:
+            return 0.0
+        return max(0.0, min(WATCH_INTERVAL, min(self.next_check.values()) - now))
+
+
+class ExperimentLauncher:
+    """Decides when each experiment that has not been started is started
+
+    Experiments are started in the order they appear in the experiment dictionary
+    (``run_WE2E_tests.py`` lists the longest-running tests first), for as long as
+    starting the next one keeps the number of active experiments within
+    ``max_active`` and the sum of their estimated core hours within
+    ``max_core_hours``. The rest wait until enough active experiments finish. At
+    least one experiment is always active, whatever its estimated core hours.
+
+    Args:
+        expts_dict      (dict): A dictionary containing information for all experiments
+        max_active       (int): Maximum number of active experiments; 0 for no limit
+        max_core_hours (float): Maximum estimated core hours of the active experiments; 0 for
+                                no limit
+        core_hours      (dict): Estimated core hours of each experiment, by name; experiments
+                                without an estimate count as the median of the known estimates
+    """
+
+    def __init__(self, expts_dict: dict, max_active: int = 0, max_core_hours: float = 0,
+                 core_hours: dict = None):
+        self.max_active = max_active
+        self.max_core_hours = max_core_hours
+        core_hours = {name: ch for name, ch in (core_hours or {}).items() if ch is not None}
+        default = median(core_hours.values()) if core_hours else 0.0
+        if max_core_hours and not core_hours:
+            logging.warning("No core-hour estimates are available for these experiments; "\
+                            "ignoring the limit on core hours")
+        self.core_hours = {name: core_hours.get(name, default) for name in expts_dict}
+        # Experiments that have been created but never updated have no tasks yet
+        self.waiting = [name for name, expt in expts_dict.items()
+                        if expt["status"] == "CREATED"
+                        and set(expt) <= {"expt_dir", "status", "start_time", "walltime"}]
+        self.active = {name for name, expt in expts_dict.items()
+                       if name not in self.waiting
+                       and expt["status"] not in ['DEAD','ERROR','COMPLETE']}
+
+    def release(self) -> list:
+        """Returns the names of the waiting experiments that can be started now, and counts
+        them as active"""
+        released = []
+        while self.waiting:
+            name = self.waiting[0]
+            if self.active:
+                if self.max_active and len(self.active) >= self.max_active:
+                    break
+                if self.max_core_hours and sum(self.core_hours[n] for n in self.active) \
+                        + self.core_hours[name] > self.max_core_hours:
+                    break
+            released.append(self.waiting.pop(0))
+            self.active.add(name)
+        return released
+
+    def finished(self, name: str) -> None:
+        """Stops counting an experiment as active"""
+        self.active.discard(name)
+
+
+def history_core_hours(expts_dict: dict) -> dict:
+    """Returns the core hours used by each experiment's test in previous runs, by experiment
+    name, for experiments named ``TESTNAME_YYYYMMDDHHmmSS`` or ``TESTNAME``"""
+    history = load_test_history()
+    return {expt: history.get(re.sub(r"_\d{14}$", "", expt), {}).get("core_hours")
+            for expt in expts_dict}
+
 
 def monitor_jobs(expts_dict: dict, monitor_file: str = '', procs: int = 1,
-                 mode: str = 'continuous', debug: bool = False) -> str:
+                 mode: str = 'continuous', debug: bool = False, max_active: int = 0,
+                 max_core_hours: float = 0, core_hours: dict = None) -> str:
     """Monitors and runs jobs for the specified experiment using Rocoto
 
     Args:
@@ -26,6 +223,9 @@ def monitor_jobs(expts_dict: dict, monitor_file: str = '', procs: int = 1,
         procs        (int): [optional] The number of parallel processes to run
         mode         (str): [optional] Mode of job monitoring. Options: (1) ``'continuous'`` (default): monitor jobs continuously until complete or (2) ``'advance'``: increment jobs once, then quit.
         debug       (bool): [optional] Enable extra output for debugging
+        max_active   (int): [optional] Maximum number of experiments to run at once; experiments that have not been started wait, in order, until others finish. Default is 0 (no limit).
+        max_core_hours (float): [optional] Maximum estimated core hours of the experiments running at once. Default is 0 (no limit).
+        core_hours  (dict): [optional] Estimated core hours of each experiment. Default is the core hours used by each test in previous runs, from the monitor files in the current directory.
 
     Returns:
         monitor_file: The name of the file used for job monitoring (when script is finished, this contains results/summary)
@@ -52,13 +252,25 @@ def monitor_jobs(expts_dict: dict, monitor_file: str = '', procs: int = 1,
          else:
              dirlist.append(expts_dict[expt]['expt_dir'])
 
+    def start_expts(expts):
+        if procs > 1:
+            expts_dict.update(update_expt_status_parallel({expt: expts_dict[expt] for expt in expts},
+                                                          procs, True, debug))
+        else:
+            for expt in expts:
+                logging.info(f"Starting experiment {expt} running")
+                expts_dict[expt] = update_expt_status(expts_dict[expt], expt, True, debug)
+
+    if max_core_hours and core_hours is None:
+        core_hours = history_core_hours(expts_dict)
+    launcher = ExperimentLauncher(expts_dict, max_active, max_core_hours, core_hours)
+    started = [expt for expt in expts_dict if expt not in launcher.waiting] + launcher.release()
+    if launcher.waiting:
+        logging.info(f'{len(launcher.waiting)} experiments will wait to start until others finish')
+
     if procs > 1:
         print(f'Starting experiments in parallel with {procs} processes')
-        expts_dict = update_expt_status_parallel(expts_dict, procs, True, debug)
-    else:
-        for expt in expts_dict:
-            logging.info(f"Starting experiment {expt} running")
-            expts_dict[expt] = update_expt_status(expts_dict[expt], expt, True, debug)
+    start_expts(started)
 
     write_monitor_file(monitor_file,expts_dict)
 
@@ -72,20 +284,36 @@ def monitor_jobs(expts_dict: dict, monitor_file: str = '', procs: int = 1,
     logging.info('Use ctrl-c to pause job submission/monitoring')
 
     #Make a copy of experiment dictionary; will use this copy to monitor active experiments
-    running_expts = expts_dict.copy()
+    running_expts = {expt: expts_dict[expt] for expt in started}
+
+    # Check each experiment when it is due, rather than all of them on every loop
+    schedule = MonitorSchedule(expts_dict, list(running_expts))
 
     i = 0
-    while running_expts:
+    while running_expts or launcher.waiting:
+        now = time.monotonic()
+        schedule.watch(now)
+        due = schedule.due(now)
+        if not due:
+            time.sleep(schedule.wait_time(now))
+            continue
+
         i += 1
+        before = {expt: copy.deepcopy(expts_dict[expt]) for expt in due}
         if procs > 1:
-            expts_dict = update_expt_status_parallel(expts_dict, procs)
+            expts_dict.update(update_expt_status_parallel(
+                {expt: expts_dict[expt] for expt in due}, procs))
         else:
-            for expt in running_expts.copy():
+            for expt in due:
                 expts_dict[expt] = update_expt_status(expts_dict[expt], expt)
 
-        for expt in running_expts.copy():
+        changed = False
+        for expt in due:
             running_expts[expt] = expts_dict[expt]
+            expt_changed = expts_dict[expt] != before[expt]
+            changed = changed or expt_changed
             if running_expts[expt]["status"] in ['DEAD','ERROR','COMPLETE']:
+                changed = True
                 # If start_time is in dictionary, compute total walltime
                 walltimestr = ''
                 if running_expts[expt].get("start_time",{}) and not running_expts[expt].get("walltime",{}):
@@ -111,17 +339,37 @@ def monitor_jobs(expts_dict: dict, monitor_file: str = '', procs: int = 1,
                         logging.debug(f'{i} of {j} tasks were successful')
                 logging.info(f'{walltimestr}will no longer monitor.')
                 running_expts.pop(expt)
+                schedule.remove(expt)
+                launcher.finished(expt)
                 continue
-            logging.debug(f'Experiment {expt} status is {expts_dict[expt]["status"]}')
-
-        write_monitor_file(monitor_file,expts_dict)
+            schedule.checked(expt, expts_dict[expt]["status"], expt_changed, time.monotonic())
+            logging.debug(f'Experiment {expt} status is {expts_dict[expt]["status"]}; '
+                          f'next check in {schedule.interval[expt]} s')
+
+        # Start waiting experiments in place of the ones that finished
+        released = launcher.release()
+        if released:
+            changed = True
+            for expt in released:
+                # Walltime is counted from when the experiment starts, not when it was created
+                expts_dict[expt]["start_time"] = datetime.now().strftime("%Y%m%d%H%M%S")
+            start_expts(released)
+            for expt in released:
+                running_expts[expt] = expts_dict[expt]
+                schedule.add(expt, expts_dict[expt]["expt_dir"], time.monotonic())
+            logging.info(f'Started {len(released)} more experiments; {len(launcher.waiting)} '\
+                         'still waiting')
+
+        # Only rewrite the monitor file when an experiment changed
+        if changed:
+            write_monitor_file(monitor_file,expts_dict)
         endtime = datetime.now()
         total_walltime = endtime - monitor_start
 
         logging.debug(f"Finished loop {i}")
         logging.debug(f"Walltime so far is {str(total_walltime)}")
         #Slow things down just a tad between loops so experiments behave better
-        time.sleep(5)
+        time.sleep(schedule.wait_time(time.monotonic()))
 
     logging.info(f'All {len(expts_dict)} experiments finished')
     logging.info('Calculating core-hour usage and printing final summary')
@@ -191,6 +439,12 @@ if __name__ == "__main__":
     parser.add_argument('-d', '--debug', action='store_true',
                         help='Script will be run in debug mode with more verbose output. ' +
                              'WARNING: increased verbosity may run very slowly on some platforms')
+    parser.add_argument('--max_active', type=int, default=0,
+                        help='Maximum number of experiments to run at once; the rest are started '\
+                             'in order as others finish (default: no limit)')
+    parser.add_argument('--max_core_hours', type=float, default=0,
+                        help='Maximum core hours, as estimated from previous runs, of the '\
+                             'experiments running at once (default: no limit)')
 
     args = parser.parse_args()
 
@@ -206,7 +460,8 @@ if __name__ == "__main__":
 
     try:
         monitor_jobs(expts_dict=expts_dict,monitor_file=args.yaml_file,procs=args.procs,
-                     mode=args.mode,debug=args.debug)
+                     mode=args.mode,debug=args.debug,max_active=args.max_active,
+                     max_core_hours=args.max_core_hours)
     except KeyboardInterrupt:
         logging.info("\n\nUser interrupted monitor script; to resume monitoring jobs run:\n")
         logging.info(f"{__file__} -y={args.yaml_file} -p={args.procs}\n")
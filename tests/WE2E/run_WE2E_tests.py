@@ -11,7 +11,7 @@ from datetime import datetime
 
 sys.path.insert(1, "../../ush")
 
-from generate_FV3LAM_wflow import generate_FV3LAM_wflow
+from generate_wflow_batch import generate_FV3LAM_wflows
 from python_utils import (
     cfg_to_yaml_str,
     load_config_file,
@@ -20,7 +20,7 @@ from python_utils import (
 from check_python_version import check_python_version
 
 from monitor_jobs import monitor_jobs, write_monitor_file
-from utils import print_test_info
+from utils import print_test_info, calculate_test_cost, estimate_test_runtimes, load_test_history
 
 def run_we2e_tests(homedir, args) -> None:
     """Runs the Workflow End-to-End (WE2E) tests selected by the user
@@ -154,7 +154,10 @@ def run_we2e_tests(homedir, args) -> None:
     # Set up dictionary for job monitoring yaml
     if args.launch != "cron":
         monitor_yaml = dict()
+        core_hours = dict()
 
+    test_cfgs = []
+    costs = dict()
     for test in tests_to_run:
         #Starting with test yaml template, fill in user-specified and machine- and
         # test-specific options, then write resulting complete config.yaml
@@ -220,23 +223,36 @@ def run_we2e_tests(homedir, args) -> None:
                 test_cfg['task_run_fcst'].update({"ITASKS": 1})
                 logging.info(f"ITASKS has been reset to 1 due to issues encountered with GNU compilers")
 
-        logging.debug(f"Writing updated config.yaml for test {test_name}\n"\
+        logging.debug(f"Updated config.yaml for test {test_name}\n"\
                        "based on specified command-line arguments:\n")
         logging.debug(cfg_to_yaml_str(test_cfg))
-        with open(os.path.join(ushdir,"config.yaml"),"w", encoding="utf-8") as f:
-            f.writelines(cfg_to_yaml_str(test_cfg))
-
-        logging.info(f"Calling workflow generation function for test {test_name}\n")
-        if args.quiet:
-            console_handler = logging.getLogger().handlers[1]
-            console_handler.setLevel(logging.WARNING)
-        expt_dir = generate_FV3LAM_wflow(ushdir,logfile=f"{ushdir}/log.generate_FV3LAM_wflow",
-                                         debug=args.debug)
-        if args.quiet:
-            if args.debug:
-                console_handler.setLevel(logging.DEBUG)
-            else:
-                console_handler.setLevel(logging.INFO)
+        test_cfgs.append((test_name, starttime_string, test_cfg))
+        if args.launch != "cron":
+            costs[test_name] = calculate_test_cost(test, test_cfg, config_defaults)
+
+    if args.launch != "cron":
+        # Order the tests longest-running first, so that the experiments started last (when a
+        # limit on active experiments holds some back) are the quickest to finish
+        estimates = estimate_test_runtimes(costs, load_test_history())
+        test_cfgs.sort(key=lambda t: estimates[t[0]][0], reverse=True)
+        logging.debug("Estimated runtime and core hours of each test, in run order:\n" +
+                      "\n".join(f"{t[0]}: {estimates[t[0]]}" for t in test_cfgs))
+
+    # Generate all experiments, --procs at a time, sharing the parsed default
+    # and machine configuration files
+    logging.info(f"Calling workflow generation function for {len(test_cfgs)} tests\n")
+    if args.quiet:
+        console_handler = logging.getLogger().handlers[1]
+        console_handler.setLevel(logging.WARNING)
+    expt_dirs = generate_FV3LAM_wflows(ushdir, [cfg for _, _, cfg in test_cfgs],
+                                       num_workers=args.procs, debug=args.debug)
+    if args.quiet:
+        if args.debug:
+            console_handler.setLevel(logging.DEBUG)
+        else:
+            console_handler.setLevel(logging.INFO)
+
+    for (test_name, starttime_string, test_cfg), expt_dir in zip(test_cfgs, expt_dirs):
         logging.info(f"Workflow for test {test_name} successfully generated in\n{expt_dir}\n")
         # If this job is not using crontab, we need to add an entry to monitor.yaml
         if 'USE_CRON_TO_RELAUNCH' not in test_cfg['workflow']:
@@ -248,11 +264,17 @@ def run_we2e_tests(homedir, args) -> None:
             monitor_yaml[workflow_id].update({"expt_dir": expt_dir})
             monitor_yaml[workflow_id].update({"status": "CREATED"})
             monitor_yaml[workflow_id].update({"start_time": starttime_string})
+            core_hours[workflow_id] = estimates[test_name][1]
             # Make WORKFLOW_ID actually mean something
             test_cfg['workflow'].update({"WORKFLOW_ID": workflow_id})
 
     if args.launch != "cron":
         monitor_file = f'WE2E_tests_{starttime_string}.yaml'
+        limit_args = ""
+        if args.max_active:
+            limit_args += f" --max_active={args.max_active}"
+        if args.max_core_hours:
+            limit_args += f" --max_core_hours={args.max_core_hours}"
         write_monitor_file(monitor_file,monitor_yaml)
         logging.info("All experiments have been generated;")
         logging.info(f"Experiment file {monitor_file} created")
@@ -261,13 +283,16 @@ def run_we2e_tests(homedir, args) -> None:
             logging.debug("calling function that monitors jobs, prints summary")
             try:
                 monitor_file = monitor_jobs(monitor_yaml, monitor_file=monitor_file, procs=args.procs,
-                                            debug=args.debug)
+                                            debug=args.debug, max_active=args.max_active,
+                                            max_core_hours=args.max_core_hours,
+                                            core_hours=core_hours)
             except KeyboardInterrupt:
                 logging.info("\n\nUser interrupted monitor script; to resume monitoring jobs run:\n")
-                logging.info(f"./monitor_jobs.py -y={monitor_file} -p={args.procs}\n")
+                logging.info(f"./monitor_jobs.py -y={monitor_file} -p={args.procs}"\
+                             f"{limit_args}\n")
         else:
             logging.info("To automatically run and monitor experiments, use:\n")
-            logging.info(f"./monitor_jobs.py -y={monitor_file}\n")
+            logging.info(f"./monitor_jobs.py -y={monitor_file}{limit_args}\n")
     else:
         logging.info("All experiments have been generated; using cron to submit workflows")
         logging.info("To view running experiments in cron try `crontab -l`")
@@ -500,8 +525,9 @@ if __name__ == "__main__":
                     help='Suppress console output from workflow generation; this will help '\
                          'keep the screen uncluttered')
     ap.add_argument('-p', '--procs', type=int,
-                    help='Run resource-heavy tasks (such as calls to rocotorun) in parallel, '\
-                         'with provided number of parallel tasks', default=1)
+                    help='Run resource-heavy tasks (such as experiment generation and calls to '\
+                         'rocotorun) in parallel, with provided number of parallel tasks',
+                    default=1)
     ap.add_argument('-l', '--launch', type=str, choices=['python', 'cron', 'none'],
                     help='Method for launching jobs. Valid values are:\n'\
                          ' python: [default] Monitor and launch experiments using monitor_jobs.py\n'
@@ -510,6 +536,13 @@ if __name__ == "__main__":
                          default="python")
 
 
+    ap.add_argument('--max_active', type=int, default=0,
+                    help='Maximum number of experiments to run at once; experiments are started '\
+                         'longest-running first, and the rest as others finish (default: no limit)')
+    ap.add_argument('--max_core_hours', type=float, default=0,
+                    help='Maximum estimated core hours of the experiments running at once; '\
+                         'estimates come from previous runs of the tests (default: no limit)')
+
     ap.add_argument('--modulefile', type=str, help='Modulefile used for building the app')
     ap.add_argument('--run_envir', type=str,
                     help='Overrides RUN_ENVIR variable to a new value ("nco" or "community") '\
@@ -547,6 +580,8 @@ if __name__ == "__main__":
                          'for --procs')
     if not args.tests:
         raise argparse.ArgumentTypeError('The --tests argument can not be empty')
+    if args.max_active < 0 or args.max_core_hours < 0:
+        raise argparse.ArgumentTypeError('--max_active and --max_core_hours can not be negative')
 
     # Print test details (if requested)
     if args.print_test_info:
@@ -9,10 +9,14 @@ import logging
 import subprocess
 import sqlite3
 import glob
+import xml.etree.ElementTree as ET
 from textwrap import dedent
-from datetime import datetime
+from statistics import median
+from collections import Counter
+from datetime import datetime, timedelta
 from contextlib import closing
-from multiprocessing import Pool
+from urllib.request import pathname2url
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append("../../ush")
 
@@ -215,6 +219,82 @@ def write_monitor_file(monitor_file: str, expts_dict: dict):
         raise
 
 
+# Rocoto never changes a job in one of these states again, short of a rewind or boot
+FINAL_JOB_STATES = ("SUCCEEDED", "DEAD")
+# Seconds to wait for rocotorun to release a lock on the database
+DB_BUSY_TIMEOUT = 30
+
+# What has been read from each Rocoto database: the state of each job by row id, the number
+# of jobs in each state, and the last row id
+_JOBS_READ = {}
+
+
+def _connect_read_only(rocoto_db: str) -> sqlite3.Connection:
+    """Opens a Rocoto database read-only, waiting up to ``DB_BUSY_TIMEOUT`` seconds for a
+    lock held by ``rocotorun``"""
+    try:
+        return sqlite3.connect(f"file:{pathname2url(os.path.abspath(rocoto_db))}?mode=ro",
+                               uri=True, timeout=DB_BUSY_TIMEOUT)
+    except sqlite3.OperationalError:
+        # Some filesystems don't support read-only opens; sqlite3.connect would otherwise
+        # create an empty database, so only fall back if the file exists
+        if not os.path.isfile(rocoto_db):
+            raise
+        return sqlite3.connect(rocoto_db, timeout=DB_BUSY_TIMEOUT)
+
+
+def read_rocoto_jobs(rocoto_db: str, full: bool = False) -> tuple:
+    """
+    Reads the jobs in a Rocoto database that may have changed since the last call for the same
+    database, and counts the jobs in each state.
+
+    Rocoto updates the row of a job in place as it moves through the queue, so the last row id
+    read is not enough to find what changed: the rows read are the new ones, plus every row
+    that was not yet SUCCEEDED or DEAD. If the number of rows doesn't match what has been read
+    (e.g. after ``rocotorewind``), the whole table is read again.
+
+    Args:
+        rocoto_db (str): Path to the Rocoto database (``.db``) file
+        full     (bool): Read every job, not just those that may have changed
+    Returns:
+        A list of (taskname, cycle, state, cores, duration) tuples for the jobs read, and a
+        Counter of the number of jobs in each state
+    """
+
+    query = 'SELECT rowid,taskname,cycle,state,cores,duration from jobs'
+    seen = None if full else _JOBS_READ.get(rocoto_db)
+    with closing(_connect_read_only(rocoto_db)) as connection:
+        with closing(connection.cursor()) as cur:
+            # Read the count and rows from one snapshot of the database
+            cur.execute("BEGIN")
+            count = cur.execute("SELECT count(*) from jobs").fetchone()[0]
+            rows = None
+            if seen is not None:
+                open_ids = [rowid for rowid, state in seen["states"].items()
+                            if state not in FINAL_JOB_STATES]
+                first_open = min(open_ids, default=seen["last_id"] + 1)
+                rows = cur.execute(f"{query} WHERE rowid >= ? OR state NOT IN (?,?)",
+                                   (first_open, *FINAL_JOB_STATES)).fetchall()
+                states = seen["states"]
+                counts = seen["counts"]
+                for row in rows:
+                    counts[states.get(row[0])] -= 1
+                    states[row[0]] = row[3]
+                    counts[row[3]] += 1
+                counts.pop(None, None)
+                if len(states) != count:
+                    rows = None
+            if rows is None:
+                rows = cur.execute(query).fetchall()
+                states = {row[0]: row[3] for row in rows}
+                counts = Counter(states.values())
+            cur.execute("COMMIT")
+
+    _JOBS_READ[rocoto_db] = {"states": states, "counts": counts,
+                             "last_id": max(states, default=0)}
+    return [row[1:] for row in rows], +counts
+
+
 def update_expt_status(expt: dict, name: str, refresh: bool = False, debug: bool = False,
                        submit: bool = True) -> dict:
     """
@@ -270,11 +350,10 @@ def update_expt_status(expt: dict, name: str, refresh: bool = False, debug: bool
 
     logging.debug(f"Reading database for experiment {name}, updating experiment dictionary")
     try:
-        # This section of code queries the "job" table of the rocoto database, returning a list
-        # of tuples containing the taskname, cycle, and state of each job respectively
-        with closing(sqlite3.connect(rocoto_db)) as connection:
-            with closing(connection.cursor()) as cur:
-                db = cur.execute('SELECT taskname,cycle,state,cores,duration from jobs').fetchall()
+        # Read the jobs in the "jobs" table of the rocoto database that may have changed since
+        # the last update, as tuples of the taskname, cycle, state, cores, and duration of each
+        # job, along with the number of jobs in each state
+        db, counts = read_rocoto_jobs(rocoto_db, full=refresh)
     except:
         # Some platforms (including Hera) can have a problem with rocoto jobs not submitting
         # properly due to build-ups of background processes. This will resolve over time as
@@ -297,30 +376,23 @@ def update_expt_status(expt: dict, name: str, refresh: bool = False, debug: bool
         expt[f"{task[0]}_{cycle}"]["cores"] = task[3]
         expt[f"{task[0]}_{cycle}"]["walltime"] = task[4]
 
-    statuses = list()
-    for task in expt:
-        # Skip non-task entries
-        if task in ["expt_dir","status","start_time","walltime"]:
-            continue
-        statuses.append(expt[task]["status"])
-
-    if "DEAD" in statuses:
+    if counts["DEAD"]:
         still_live = ["RUNNING", "SUBMITTING", "QUEUED", "FAILED"]
-        if any(status in still_live for status in statuses):
+        if any(counts[status] for status in still_live):
             logging.debug(f'DEAD job in experiment {name}; continuing to track until all jobs are '\
                            'complete')
             expt["status"] = "DYING"
         else:
             expt["status"] = "DEAD"
             return expt
-    elif "RUNNING" in statuses:
+    elif counts["RUNNING"]:
         expt["status"] = "RUNNING"
-    elif "QUEUED" in statuses:
+    elif counts["QUEUED"]:
         expt["status"] = "QUEUED"
-    elif "FAILED" in statuses or "SUBMITTING" in statuses:
+    elif counts["FAILED"] or counts["SUBMITTING"]:
         # Job in "FAILED" status means it will be retried
         expt["status"] = "SUBMITTING"
-    elif "SUCCEEDED" in statuses:
+    elif counts["SUCCEEDED"]:
         # If all task statuses are "SUCCEEDED", set the experiment status to "SUCCEEDED". This
         # will trigger a final check using rocotostat to make sure there are no remaining un-
         # started tests.
@@ -346,7 +418,7 @@ def update_expt_status(expt: dict, name: str, refresh: bool = False, debug: bool
               f"""Some kind of horrible thing has happened to the experiment status
               for experiment {name}
               status is {expt["status"]}
-              all task statuses are {statuses}"""))
+              number of tasks in each status is {dict(counts)}"""))
 
     # Final check for experiments where all tasks are "SUCCEEDED"; since the rocoto database does
     # not include info on jobs that have not been submitted yet, use rocotostat to check that
@@ -356,17 +428,39 @@ def update_expt_status(expt: dict, name: str, refresh: bool = False, debug: bool
 
     return expt
 
+# The threads that update_expt_status_parallel() runs experiment updates in; they
+# are kept for the life of the process rather than started on every call
+_UPDATE_POOL = {"procs": 0, "executor": None}
+
+
+def _update_pool(procs: int) -> ThreadPoolExecutor:
+    """Returns the thread pool for experiment updates, creating it on first use
+    or if the number of threads changed"""
+    if _UPDATE_POOL["procs"] != procs:
+        if _UPDATE_POOL["executor"] is not None:
+            _UPDATE_POOL["executor"].shutdown(wait=False)
+        _UPDATE_POOL.update(procs=procs, executor=ThreadPoolExecutor(
+            max_workers=procs, thread_name_prefix="update_expt_status"))
+    return _UPDATE_POOL["executor"]
+
+
 def update_expt_status_parallel(expts_dict: dict, procs: int, refresh: bool = False,
                                 debug: bool = False) -> dict:
     """
     This function updates an entire set of experiments in parallel, drastically speeding up
     the testing if given enough parallel processes. Given a dictionary of experiments, it will
-    pass each individual experiment dictionary to ``update_expt_status()``, making use
-    of the Python multiprocessing ``starmap()`` functionality to update the experiments in parallel.
+    pass each individual experiment dictionary that is still being tracked to
+    ``update_expt_status()``, running up to ``procs`` updates at a time.
+
+    The updates run in a pool of threads that is reused by later calls: the work is waiting on
+    ``rocotorun`` and reading the Rocoto database, so threads update each experiment dictionary
+    in place, with no copying to and from worker processes. Experiments that are DEAD, ERROR, or
+    COMPLETE are not dispatched unless ``refresh`` is set, so the cost of a call doesn't grow
+    with the number of finished experiments.
 
     Args:
         expts_dict (dict): A dictionary containing information for all experiments
-        procs       (int): The number of parallel processes
+        procs       (int): The number of parallel updates
         refresh    (bool): "Refresh" flag to pass to ``update_expt_status()``. If True, this flag will check an experiment status even if it is listed as DEAD, ERROR, or COMPLETE. Used for initial checks for experiments that may have been restarted.
         debug      (bool): Will capture all output from ``rocotorun``. This will allow information such as job cards and job submit messages to appear in the log files, but can drastically slow down the testing process.
 
@@ -374,25 +468,21 @@ def update_expt_status_parallel(expts_dict: dict, procs: int, refresh: bool = Fa
         expts_dict: The updated dictionary of experiment dictionaries
     """
 
-    args = []
-    # Define a tuple of arguments to pass to starmap
-    for expt in expts_dict:
-        args.append( (expts_dict[expt],expt,refresh,debug) )
+    active = [expt for expt in expts_dict
+              if refresh or expts_dict[expt]["status"] not in ['DEAD','ERROR','COMPLETE']]
 
     # call update_expt_status() in parallel
-    with Pool(processes=procs) as pool:
-        output = pool.starmap(update_expt_status, args)
+    pool = _update_pool(procs)
+    futures = {expt: pool.submit(update_expt_status, expts_dict[expt], expt, refresh, debug)
+               for expt in active}
 
     # Update dictionary with output from all calls to update_expt_status()
-    i = 0
-    for expt in expts_dict:
-        expts_dict[expt] = output[i]
-        i += 1
+    for expt, future in futures.items():
+        expts_dict[expt] = future.result()
 
     return expts_dict
 
 
-
 def print_test_info(txtfile: str = "WE2E_test_info.txt") -> None:
     """Prints a pipe-delimited ( ``|`` ) text file containing summaries of each test with a configuration file in ``test_configs/*``
 
@@ -489,27 +579,238 @@ def print_test_info(txtfile: str = "WE2E_test_info.txt") -> None:
             f.write("\n")
 
 
-def compare_rocotostat(expt_dict,name):
-    """Reads the dictionary showing the location of a given experiment, runs a ``rocotostat`` command
-    to get the full set of tasks for the experiment, and compares the two to see if there are any
-    unsubmitted tasks remaining.
+def _walltime_seconds(walltime: str) -> float:
+    """Converts a walltime written by ``monitor_jobs()`` (e.g. ``1 day, 2:03:04.5``) to seconds"""
+    days, _, hms = str(walltime).rpartition(",")
+    hours, minutes, seconds = hms.split(":")
+    seconds = 3600 * int(hours) + 60 * int(minutes) + float(seconds)
+    if days:
+        seconds += 86400 * int(days.split()[0])
+    return seconds
+
+
+def load_test_history(pattern: str = "WE2E_tests_*.yaml", max_files: int = 50) -> dict:
+    """
+    Reads the walltimes and core-hour usage of completed tests from the monitor files of previous
+    runs. Experiments are named ``TESTNAME_YYYYMMDDHHmmSS`` in monitor files; if a test completed
+    in more than one run, the most recent run is used.
 
     Args:
-        expt_dict (dict): A dictionary containing the information for an individual experiment
-        name       (str): Name of the experiment
+        pattern   (str): Glob pattern for the monitor files (default: ``WE2E_tests_*.yaml``)
+        max_files (int): Only read this many of the most recent monitor files
     Returns:
-        expt_dict: A dictionary containing the information for an individual experiment
+        history: A dictionary with the walltime (in seconds) and, if it was calculated, the
+                 total core hours of each completed test, by test name
+    """
+
+    history = dict()
+    # Monitor file names end in a timestamp, so sorting them sorts the runs by time
+    for monitor_file in sorted(glob.glob(pattern))[-max_files:]:
+        try:
+            expts_dict = load_config_file(monitor_file)
+        except Exception as e:
+            logging.debug(f"Skipping unreadable monitor file {monitor_file}: {e}")
+            continue
+        if not isinstance(expts_dict, dict):
+            continue
+        for expt, expt_dict in expts_dict.items():
+            if not isinstance(expt_dict, dict) or expt_dict.get("status") != "COMPLETE" \
+                    or not expt_dict.get("walltime"):
+                continue
+            test = re.sub(r"_\d{14}$", "", expt)
+            try:
+                history[test] = {"walltime": _walltime_seconds(expt_dict["walltime"])}
+            except ValueError:
+                continue
+            core_hours = [expt_dict[task]["core_hours"] for task in expt_dict
+                          if isinstance(expt_dict[task], dict) and "core_hours" in expt_dict[task]]
+            if core_hours:
+                history[test]["core_hours"] = sum(core_hours)
+    return history
+
+
+def calculate_test_cost(test_file: str, test_cfg: dict, config_defaults: dict) -> float:
+    """
+    Estimates the relative cost of running the forecasts of a test, where 1 corresponds to running
+    a 6-hour forecast on the RRFS_CONUS_25km predefined grid using the default time step. The cost
+    accounts for the grid size and time step (from ``calculate_cost()``), the forecast length, and
+    the number of cycles and ensemble members.
+
+    Args:
+        test_file        (str): Path to the test configuration file
+        test_cfg        (dict): Contents loaded from the test configuration file
+        config_defaults (dict): Contents loaded from the default configuration file
+                                (``config_defaults.yaml``)
+    Returns:
+        cost: The relative cost of the test, or None if it could not be calculated
+    """
+
+    try:
+        dt_atmos, npts, ref_dt_atmos, ref_npts = calculate_cost(test_file)
+        workflow = {**config_defaults["workflow"], **test_cfg.get("workflow", {})}
+        fcst_len = workflow["FCST_LEN_HRS"]
+        if fcst_len < 0:
+            # Forecast lengths vary by cycle
+            fcst_len = max(workflow["FCST_LEN_CYCL"])
+        first = datetime.strptime(str(workflow["DATE_FIRST_CYCL"]), "%Y%m%d%H")
+        last = datetime.strptime(str(workflow["DATE_LAST_CYCL"]), "%Y%m%d%H")
+        num_fcsts = (last - first).total_seconds() // 3600 // workflow["INCR_CYCL_FREQ"] + 1
+        glob_cfg = {**config_defaults["global"], **test_cfg.get("global", {})}
+        num_members = glob_cfg["NUM_ENS_MEMBERS"] if glob_cfg["DO_ENSEMBLE"] else 1
+    except Exception as e:
+        logging.debug(f"Unable to calculate cost of test {test_file}: {e}")
+        return None
+    return npts / ref_npts * ref_dt_atmos / dt_atmos * fcst_len / 6 * num_fcsts \
+           * max(num_members, 1)
+
+
+def estimate_test_runtimes(costs: dict, history: dict) -> dict:
+    """
+    Estimates the walltime and core-hour usage of each test, for deciding the order that tests are
+    run in. Tests that completed before are estimated from their history; other tests from their
+    relative cost, scaled by the median ratio of walltime (or core hours) to relative cost of the
+    tests that have both.
+
+    Args:
+        costs   (dict): The relative cost (from ``calculate_test_cost()``) of each test, by test
+                        name; None if unknown
+        history (dict): Walltimes and core hours of completed tests (from ``load_test_history()``)
+    Returns:
+        estimates: A dictionary of ``(runtime, core_hours)`` tuples by test name. Runtimes are in
+                   seconds if they could be estimated for every test, or otherwise relative costs;
+                   either way they can be compared to each other. Core hours are None if unknown.
+    """
+
+    def scale(key):
+        ratios = [history[test][key] / cost for test, cost in costs.items()
+                  if cost and key in history.get(test, {})]
+        return median(ratios) if ratios else None
+
+    wall_scale = scale("walltime")
+    core_hours_scale = scale("core_hours")
+    in_seconds = wall_scale is not None or all(test in history for test in costs)
+    estimates = dict()
+    for test, cost in costs.items():
+        if in_seconds and test in history:
+            runtime = history[test]["walltime"]
+        elif in_seconds and cost:
+            runtime = cost * wall_scale
+        else:
+            runtime = cost or 0.0
+        core_hours = history.get(test, {}).get("core_hours")
+        if core_hours is None and cost and core_hours_scale is not None:
+            core_hours = cost * core_hours_scale
+        estimates[test] = (runtime, core_hours)
+    return estimates
+
+
+# The tasks of each Rocoto workflow, by the path and stats of the XML file they were read from
+_WORKFLOW_TASKS = {}
+
+
+def _cycledef_cycles(text: str) -> list:
+    """Returns the cycles of a ``<cycledef>`` of the form ``start stop interval``, or None if
+    it is in another form (e.g. crontab-like)"""
+    fields = text.split()
+    if len(fields) != 3:
+        return None
+    start, stop = (datetime.strptime(date, "%Y%m%d%H%M%S" if len(date) == 14 else "%Y%m%d%H%M")
+                   for date in fields[:2])
+    # The interval is [[[dd:]hh:]mm:]ss
+    seconds = 0
+    for unit, value in zip((1, 60, 3600, 86400), reversed(fields[2].split(":"))):
+        seconds += unit * int(value)
+    if seconds <= 0:
+        return None
+    cycles = []
+    while start <= stop:
+        cycles.append(start)
+        start += timedelta(seconds=seconds)
+    return cycles
+
+
+def _expand_tasks(node, variables: dict):
+    """Yields the name and ``cycledefs`` attribute of each task under a ``<workflow>`` or
+    ``<metatask>`` node, replacing ``#var#`` with the values of metatask variables"""
+
+    def substitute(text):
+        for var, value in variables.items():
+            text = text.replace(f"#{var}#", value)
+        return text
+
+    for child in node:
+        if child.tag == "task":
+            yield substitute(child.get("name")), substitute(child.get("cycledefs", ""))
+        elif child.tag == "metatask":
+            values = {var.get("name"): substitute(var.text or "").split()
+                      for var in child.findall("var")}
+            for i in range(min(len(v) for v in values.values()) if values else 0):
+                yield from _expand_tasks(child, {**variables,
+                                                 **{var: v[i] for var, v in values.items()}})
+
+
+def rocoto_workflow_tasks(rocoto_xml: str) -> frozenset:
+    """
+    Expands the cycle definitions, metatasks, and tasks of a Rocoto workflow into the full set
+    of its jobs, named as in the experiment dictionary (``TASKNAME_YYYYMMDDHHMM``). These are
+    the jobs that ``rocotostat`` lists, whether or not they have been submitted.
+
+    The workflow is only read again if the XML file changes.
+
+    Args:
+        rocoto_xml (str): Path to the Rocoto workflow (``.xml``) file
+    Returns:
+        A frozenset of job names, or None if the workflow could not be expanded (e.g. it uses
+        crontab-like cycle definitions)
+    """
+
+    try:
+        stat = os.stat(rocoto_xml)
+    except OSError:
+        return None
+    key = (os.path.realpath(rocoto_xml), stat.st_mtime_ns, stat.st_size)
+    if key not in _WORKFLOW_TASKS:
+        try:
+            workflow = ET.parse(rocoto_xml).getroot()
+            cycles = dict()
+            for cycledef in workflow.findall("cycledef"):
+                group_cycles = _cycledef_cycles(cycledef.text or "")
+                if group_cycles is None:
+                    raise ValueError(f"Can not expand cycledef {cycledef.text}")
+                cycles.setdefault(cycledef.get("group", ""), set()).update(group_cycles)
+            all_cycles = set().union(*cycles.values())
+            tasks = set()
+            for task, cycledefs in _expand_tasks(workflow, dict()):
+                # A task without cycledefs runs for every cycle
+                task_cycles = set().union(*(cycles.get(group.strip(), set())
+                                            for group in cycledefs.split(","))) \
+                              if cycledefs else all_cycles
+                tasks.update(f"{task}_{cycle.strftime('%Y%m%d%H%M')}" for cycle in task_cycles)
+            _WORKFLOW_TASKS[key] = frozenset(tasks)
+        except (ET.ParseError, ValueError) as e:
+            logging.debug(f"Unable to expand workflow {rocoto_xml}: {e}")
+            _WORKFLOW_TASKS[key] = None
+    return _WORKFLOW_TASKS[key]
+
+
+def rocotostat_tasks(rocoto_xml: str, rocoto_db: str) -> list:
+    """Runs a ``rocotostat`` command and returns the names of the jobs it lists, named as in the
+    experiment dictionary (``TASKNAME_YYYYMMDDHHMM``)
+
+    Args:
+        rocoto_xml (str): Path to the Rocoto workflow (``.xml``) file
+        rocoto_db  (str): Path to the Rocoto database (``.db``) file
+    Returns:
+        A list of job names
     """
 
     # Call rocotostat and store output
-    rocoto_db = f"{expt_dict['expt_dir']}/FV3LAM_wflow.db"
-    rocoto_xml = f"{expt_dict['expt_dir']}/FV3LAM_wflow.xml"
     rocotorun_cmd = ["rocotostat", f"-w {rocoto_xml}", f"-d {rocoto_db}", "-v 10"]
     p = subprocess.run(rocotorun_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     rsout = p.stdout
 
     # Parse each line of rocotostat output, extracting relevant information
-    untracked_tasks = []
+    tasks = []
     for line in rsout.split('\n'):
         # Skip blank lines and dividing lines of '=====...'
         if not line:
@@ -525,14 +826,35 @@ def compare_rocotostat(expt_dict,name):
 
         # As defined in update_expt_status(), the "task names" in the dictionary are a combination
         # of the task name and cycle
-        taskname = f'{line_array[1]}_{line_array[0]}'
+        tasks.append(f'{line_array[1]}_{line_array[0]}')
 
-        # If we're already tracking this task, continue
-        if expt_dict.get(taskname):
-            continue
+    return tasks
+
+
+def compare_rocotostat(expt_dict,name):
+    """Reads the dictionary showing the location of a given experiment, gets the full set of tasks
+    for the experiment, and compares the two to see if there are any unsubmitted tasks remaining.
+
+    The full set of tasks is expanded from the workflow XML by ``rocoto_workflow_tasks()``, which
+    is much faster than running ``rocotostat``; ``rocotostat`` is only called for workflows that
+    can not be expanded.
+
+    Args:
+        expt_dict (dict): A dictionary containing the information for an individual experiment
+        name       (str): Name of the experiment
+    Returns:
+        expt_dict: A dictionary containing the information for an individual experiment
+    """
+
+    rocoto_db = f"{expt_dict['expt_dir']}/FV3LAM_wflow.db"
+    rocoto_xml = f"{expt_dict['expt_dir']}/FV3LAM_wflow.xml"
+    tasks = rocoto_workflow_tasks(rocoto_xml)
+    if tasks is None:
+        tasks = rocotostat_tasks(rocoto_xml, rocoto_db)
 
-        # Otherwise, extract information into dictionary of untracked tasks
-        untracked_tasks.append(taskname)
+    # The tasks that are in the rocoto database have an entry in the experiment dictionary (see
+    # update_expt_status()); any others have not been submitted
+    untracked_tasks = sorted(task for task in set(tasks) if not expt_dict.get(task))
 
     if untracked_tasks:
         # We want to give this a couple loops before reporting that it is "stuck"
@@ -0,0 +1,90 @@
+""" Tests for create_var_defns_exports.py """
+
+#pylint: disable=invalid-name
+import contextlib
+import os
+import subprocess
+import tempfile
+import unittest
+
+import yaml
+
+from create_var_defns_exports import create_var_defns_exports, exports_path
+
+class Testing(unittest.TestCase):
+    """ Define the tests """
+    def _source(self, *sections):
+        """ Sources the given sections of var_defns.yaml with source_yaml and
+        returns the printed values of the test variables """
+        script = f"""
+        set -eu
+        . {self.USHdir}/bash_utils/source_yaml.sh
+        for sect in {" ".join(sections)} ; do
+          source_yaml {self.var_defns_fp} $sect
+        done
+        echo "$MACHINE|${{CYCL_HRS[1]}}|${{#CYCL_HRS[@]}}|${{MEMBERS[*]}}|$DEBUG|$EMPTY"
+        """
+        result = subprocess.run(
+            ["bash", "-c", script],
+            env={**os.environ, "PATH": f"{self.tmp_dir}:{os.environ['PATH']}"},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.strip()
+
+    def test_create_var_defns_exports(self):
+        """ Test that source_yaml uses the exports file while it matches
+        var_defns.yaml, and uw once it doesn't """
+        self.assertEqual(
+            create_var_defns_exports(self.var_defns_fp), exports_path(self.var_defns_fp)
+        )
+        self.assertEqual(self._source("user", "workflow"), "hera|12|2|mem001 mem002|True|")
+        self.assertFalse(os.path.exists(self.uw_log))
+
+        with open(self.var_defns_fp, "a", encoding="utf-8") as f:
+            f.write("task_run_fcst:\n  DT_ATMOS: 36\n")
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._source("user", "workflow")
+        self.assertTrue(os.path.exists(self.uw_log))
+
+    def test_regenerated_exports(self):
+        """ Test that source_yaml keeps using the exports file when it is
+        regenerated after var_defns.yaml is updated, as make_grid does """
+        create_var_defns_exports(self.var_defns_fp)
+        with open(self.var_defns_fp, encoding="utf-8") as f:
+            cfg = yaml.safe_load(f)
+        cfg["user"]["MACHINE"] = "jet"
+        cfg["workflow"]["CRES"] = "C403"
+        with open(self.var_defns_fp, "w", encoding="utf-8") as f:
+            yaml.dump(cfg, f)
+
+        create_var_defns_exports(self.var_defns_fp)
+        self.assertEqual(self._source("user", "workflow"), "jet|12|2|mem001 mem002|True|")
+        self.assertFalse(os.path.exists(self.uw_log))
+
+    def setUp(self):
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        self.USHdir = os.path.join(test_dir, "..", "..", "ush")
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        self.var_defns_fp = os.path.join(self.tmp_dir, "var_defns.yaml")
+        with open(self.var_defns_fp, "w", encoding="utf-8") as f:
+            yaml.dump({
+                "user": {"MACHINE": "hera"},
+                "workflow": {
+                    "CYCL_HRS": [0, 12],
+                    "MEMBERS": ["mem001", "mem002"],
+                    "DEBUG": True,
+                    "EMPTY": None,
+                },
+            }, f)
+
+        # A stand-in for uw that records being called and then fails
+        self.uw_log = os.path.join(self.tmp_dir, "uw.log")
+        uw = os.path.join(self.tmp_dir, "uw")
+        with open(uw, "w", encoding="utf-8") as f:
+            f.write(f"#!/bin/bash\necho \"$@\" > {self.uw_log}\nexit 1\n")
+        os.chmod(uw, 0o755)
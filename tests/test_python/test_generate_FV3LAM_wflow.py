@@ -2,6 +2,7 @@
 ush directory """
 
 #pylint: disable=invalid-name
+import copy
 import os
 import sys
 import unittest
@@ -13,9 +14,11 @@ from python_utils import (
     define_macos_utilities,
     set_env_var,
     get_env_var,
+    load_config_file,
 )
 
 from generate_FV3LAM_wflow import generate_FV3LAM_wflow
+from generate_wflow_batch import generate_FV3LAM_wflows
 
 class Testing(unittest.TestCase):
     """ Class to run the tests. """
@@ -46,6 +49,31 @@ class Testing(unittest.TestCase):
         )
         run_workflow(USHdir, logfile)
 
+    def test_generate_FV3LAM_wflows(self):
+
+        """ Test that a batch of configs is generated in parallel, each in
+        its own experiment directory, without writing ush/config.yaml. """
+
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        USHdir = os.path.join(test_dir, "..", "..", "ush")
+        user_config_fp = os.path.join(USHdir, "config.yaml")
+        before = os.stat(user_config_fp).st_mtime_ns if os.path.exists(user_config_fp) else None
+
+        cfg = load_config_file(f"{USHdir}/config.community.yaml")
+        cfg["user"]["MACHINE"] = "linux"
+        cfgs = []
+        for subdir in ("test_batch_1", "test_batch_2"):
+            cfgs.append(copy.deepcopy(cfg))
+            cfgs[-1]["workflow"]["EXPT_SUBDIR"] = subdir
+
+        expt_dirs = generate_FV3LAM_wflows(USHdir, cfgs, num_workers=2)
+        for subdir, expt_dir in zip(("test_batch_1", "test_batch_2"), expt_dirs):
+            self.assertEqual(os.path.basename(expt_dir), subdir)
+            self.assertTrue(os.path.exists(os.path.join(expt_dir, "config.yaml")))
+            self.assertTrue(os.path.exists(os.path.join(expt_dir, "log.generate_FV3LAM_wflow")))
+        after = os.stat(user_config_fp).st_mtime_ns if os.path.exists(user_config_fp) else None
+        self.assertEqual(before, after)
+
     def setUp(self):
         define_macos_utilities()
         set_env_var("DEBUG", False)
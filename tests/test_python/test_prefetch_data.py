@@ -0,0 +1,149 @@
+"""
+Tests for prefetch_data.py against a local HTTP server, so that no
+internet access is needed.
+
+To run the test suite:
+
+    python -m unittest -b test_prefetch_data.py
+"""
+
+import contextlib
+import functools
+import glob
+import http.server
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import yaml
+
+import prefetch_data
+import retrieve_data
+
+
+class RecordingHandler(http.server.SimpleHTTPRequestHandler):
+
+    """Serves files from a directory and records the requested paths."""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def send_head(self):
+        self.requests.append(self.path)
+        return super().send_head()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class PrefetchTesting(unittest.TestCase):
+
+    """Tests prefetching upcoming cycles into the shared cache."""
+
+    def setUp(self):
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        self.serve_dir = os.path.join(self.tmp_dir, "serve")
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        os.makedirs(self.serve_dir)
+
+        RecordingHandler.requests = []
+        handler = functools.partial(RecordingHandler, directory=self.serve_dir)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        self.config = os.path.join(self.tmp_dir, "data_locations.yml")
+        with open(self.config, "w", encoding="utf-8") as fn:
+            yaml.dump({"LOCAL": {"aws": {
+                "protocol": "download",
+                "url": f"{url}/aws/{{yyyymmdd}}{{hh}}",
+                "file_names": {"fcst": ["model.t{hh}z.f{fcst_hr:03d}.grib2"]},
+            }}}, fn)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _publish(self, cycle):
+        cycle_dir = os.path.join(self.serve_dir, "aws", cycle)
+        os.makedirs(cycle_dir)
+        for fcst_hr in range(0, 13, 6):
+            file_name = f"model.t{cycle[-2:]}z.f{fcst_hr:03d}.grib2"
+            with open(os.path.join(cycle_dir, file_name), "wb") as fn:
+                fn.write(os.urandom(1024))
+
+    def _args(self, *extra):
+        # fmt: off
+        return [
+            '--cache_dir', self.cache_dir,
+            '--config', self.config,
+            '--data_stores', 'aws',
+            '--data_type', 'LOCAL',
+            '--date_first_cycl', '2022062500',
+            '--date_last_cycl', '2022062512',
+            '--incr_cycl_freq', '6',
+            '--file_set', 'fcst',
+            '--ics_or_lbcs', 'LBCS',
+            '--fcst_hrs', '0', '12', '6',
+            '--lookahead', '2',
+            *extra,
+        ]
+        # fmt: on
+
+    def test_once(self):
+
+        """A single poll stages the available cycles and reports the
+        missing ones."""
+
+        self._publish("2022062500")
+        with self.assertRaises(SystemExit):
+            prefetch_data.main(self._args('--once'))
+
+        cached = glob.glob(os.path.join(self.cache_dir, "*", "*"))
+        self.assertEqual(len(cached), 3)
+        # Only the first --lookahead cycles are polled
+        self.assertFalse(any("2022062512" in path for path in RecordingHandler.requests))
+
+    def test_poll_and_retrieve(self):
+
+        """Cycles are staged as soon as their files appear upstream, and
+        retrieve_data.py then links them from the cache without any
+        downloads."""
+
+        self._publish("2022062500")
+        prefetcher = threading.Thread(
+            target=prefetch_data.main,
+            args=(self._args('--poll_interval', '0.1'),),
+        )
+        prefetcher.start()
+        time.sleep(0.5)
+        self._publish("2022062506")
+        self._publish("2022062512")
+        prefetcher.join(timeout=30)
+        self.assertFalse(prefetcher.is_alive())
+        self.assertEqual(len(glob.glob(os.path.join(self.cache_dir, "*", "*"))), 9)
+
+        output_path = os.path.join(self.tmp_dir, "out")
+        os.makedirs(output_path)
+        RecordingHandler.requests = []
+        # fmt: off
+        retrieve_data.main([
+            '--file_set', 'fcst',
+            '--config', self.config,
+            '--cycle_date', '2022062512',
+            '--data_stores', 'aws',
+            '--data_type', 'LOCAL',
+            '--fcst_hrs', '0', '12', '6',
+            '--output_path', output_path,
+            '--ics_or_lbcs', 'LBCS',
+            '--cache_dir', self.cache_dir,
+            '--num_workers', '2',
+        ])
+        # fmt: on
+        self.assertEqual(RecordingHandler.requests, [])
+        self.assertEqual(len(glob.glob(os.path.join(output_path, "*.grib2"))), 3)
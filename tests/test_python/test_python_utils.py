@@ -16,12 +16,18 @@ loaded first before executing unit tests.
 import unittest
 import glob
 import tempfile
+import json
 import os
+import configparser
+import shlex
+import subprocess
+import sys
+import time
 
 import python_utils as util
 
 
-class Testing(unittest.TestCase):
+class Testing(unittest.TestCase): #pylint: disable=too-many-public-methods
     """ Define the tests"""
 
     def test_case_handlers(self):
@@ -217,6 +223,283 @@ class Testing(unittest.TestCase):
             "regional_workflow", util.get_ini_value(cfg, "regional_workflow", "repo_url")
         )
 
+    def test_load_shell_config(self):
+        """ Test loading a structured shell config, with arrays, in memory """
+        cfg = {
+            "workflow": {"EXPT": "test", "FCST_LEN_HRS": 6, "DEBUG": False,
+                         "CYCLES": ["00", "06", 12, 18, "00"]},
+            "task_run_fcst": {"FIELDS": ["a b", "c"], "EMPTY": ""},
+        }
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            shell_fp = os.path.join(tmp_dir, "var_defns.sh")
+            with open(shell_fp, "w", encoding="utf-8") as fn:
+                fn.write("# Generated\n" + util.cfg_to_shell_str(cfg))
+            before = os.listdir(".")
+            loaded = util.load_shell_config(shell_fp)
+            self.assertEqual(os.listdir("."), before)
+        self.assertEqual(loaded["workflow"], {
+            "EXPT": "test", "FCST_LEN_HRS": 6, "DEBUG": False,
+            "CYCLES": ["00", "06", 12, 18, "00"],
+        })
+        self.assertEqual(loaded["task_run_fcst"], {"FIELDS": ["a b", "c"], "EMPTY": ""})
+
+    @unittest.skipIf(os.environ.get("RUN_BENCHMARKS") != "true", "Skipping benchmarks")
+    def test_load_shell_config_benchmark(self):
+        """ Compares loading a var_defns-sized structured shell config in memory
+        against the original temp file and configparser round trip. Set
+        RUN_BENCHMARKS=true to run. """
+        cfg = {
+            f"task_{sect}": {
+                f"VAR_{num}": (
+                    [f"item{i}" for i in range(num % 9)] if num % 5 == 0
+                    else f"value {num}" if num % 2 else num
+                )
+                for num in range(60)
+            }
+            for sect in range(30)
+        }
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            shell_fp = os.path.join(tmp_dir, "var_defns.sh")
+            with open(shell_fp, "w", encoding="utf-8") as fn:
+                fn.write(util.cfg_to_shell_str(cfg))
+
+            def load(loader):
+                start = time.perf_counter()
+                for _ in range(20):
+                    loaded = loader(shell_fp, 0)
+                return loaded, (time.perf_counter() - start) / 20
+
+            legacy, legacy_time = load(legacy_load_shell_as_ini_config)
+            loaded, native_time = load(util.load_shell_config)
+        self.assertEqual(loaded, legacy)
+        print(
+            f"\nLoaded {30 * 60} variables: original {legacy_time * 1e3:.2f} ms, "
+            f"in memory {native_time * 1e3:.2f} ms ({legacy_time / native_time:.1f}x)"
+        )
+        self.assertLess(native_time, legacy_time)
+
+    def test_extend_yaml(self):
+        """ Test rendering Jinja2 templates in a config with extend_yaml """
+        cfg = {
+            "user": {"HOMEdir": "/home", "USHdir": "{{ user.HOMEdir }}/ush"},
+            "workflow": {
+                "EXPTDIR": '{{ [user.HOMEdir, "expt"] | path_join }}',
+                "LOGDIR": "{{ EXPTDIR }}/log",
+                "NHRS": "{{ 3 * 2 }}",
+                "CYCLE": "{{ cycle_dependent }}",
+            },
+            "NOT_RENDERED": "{{ user.HOMEdir }}",
+        }
+        util.extend_yaml(cfg)
+        self.assertEqual(cfg["user"]["USHdir"], "/home/ush")
+        self.assertEqual(cfg["workflow"]["EXPTDIR"], "/home/expt")
+        self.assertEqual(cfg["workflow"]["LOGDIR"], "/home/expt/log")
+        self.assertEqual(cfg["workflow"]["NHRS"], 6)
+        self.assertEqual(cfg["workflow"]["CYCLE"], "{{ cycle_dependent }}")
+        self.assertEqual(cfg["NOT_RENDERED"], "{{ user.HOMEdir }}")
+
+        # Templates are compiled only once
+        compile_template = util.config_parser._compile_template #pylint: disable=protected-access
+        hits = compile_template.cache_info().hits
+        util.extend_yaml({"a": {"b": "{{ cycle_dependent }}"}})
+        self.assertEqual(compile_template.cache_info().hits, hits + 1)
+
+    def test_resolve_config(self):
+        """ Test rendering a config in dependency order with resolve_config """
+        cfg = {
+            "a": {"LOGDIR": "{{ b.EXPTDIR }}/log", "CYCLE": "{{ cycle_dependent }}"},
+            "b": {"EXPTDIR": "{{ c.BASEDIR }}/expt", "LOOP": "{{ d.Y }}"},
+            "c": {"BASEDIR": "{{ [\'/home\', \'user\'] | path_join }}"},
+            "d": {"X": "{{ Y }}", "Y": "{{ X }}", "Z": "{{ parent.c.BASEDIR }}"},
+        }
+        unresolved = util.resolve_config(cfg)
+        self.assertEqual(cfg["a"]["LOGDIR"], "/home/user/expt/log")
+        self.assertEqual(cfg["d"]["Z"], "/home/user")
+        self.assertEqual(
+            unresolved,
+            {
+                "a.CYCLE": "undefined: cycle_dependent",
+                "b.LOOP": "depends on unresolved: d.Y",
+                "d.X": "circular reference: d.X -> d.Y -> d.X",
+                "d.Y": "circular reference: d.X -> d.Y -> d.X",
+            },
+        )
+
+        # A single pass of extend_yaml doesn't get there
+        cfg = {
+            "a": {"LOGDIR": "{{ b.EXPTDIR }}/log"},
+            "b": {"EXPTDIR": "{{ c.BASEDIR }}/expt"},
+            "c": {"BASEDIR": "/home"},
+        }
+        util.extend_yaml(cfg)
+        self.assertEqual(cfg["a"]["LOGDIR"], "{{ c.BASEDIR }}/expt/log")
+
+    def test_load_yaml_cache(self):
+        """ Test the parsed-config cache behind load_config_file """
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            os.environ["SRW_CONFIG_CACHE_DIR"] = os.path.join(tmp_dir, "cache")
+            self.addCleanup(os.environ.pop, "SRW_CONFIG_CACHE_DIR")
+
+            static = os.path.join(tmp_dir, "static.yaml")
+            with open(static, "w", encoding="utf-8") as fn:
+                fn.write("a:\n  b: [1, 2]\n")
+            cfg = util.load_config_file(static)
+            cfg["a"]["b"].append(3)
+            # Callers get independent copies
+            self.assertEqual(util.load_config_file(static), {"a": {"b": [1, 2]}})
+            self.assertEqual(len(os.listdir(os.environ["SRW_CONFIG_CACHE_DIR"])), 1)
+
+            # A modified file is parsed again
+            with open(static, "w", encoding="utf-8") as fn:
+                fn.write("a:\n  b: [1, 2, 4]\n")
+            self.assertEqual(util.load_config_file(static), {"a": {"b": [1, 2, 4]}})
+
+            # Dynamic tags are evaluated on every load
+            dynamic = os.path.join(tmp_dir, "dynamic.yaml")
+            with open(dynamic, "w", encoding="utf-8") as fn:
+                fn.write("cycledef: !startstopfreq [SRW_START, SRW_STOP, '6']\n")
+            os.environ["SRW_START"] = "2022062500"
+            os.environ["SRW_STOP"] = "2022062512"
+            self.addCleanup(os.environ.pop, "SRW_START")
+            self.addCleanup(os.environ.pop, "SRW_STOP")
+            cfg = util.load_config_file(dynamic)
+            self.assertEqual(cfg["cycledef"], "202206250000 202206251200 6:00:00")
+            os.environ["SRW_STOP"] = "2022062600"
+            cfg = util.load_config_file(dynamic)
+            self.assertEqual(cfg["cycledef"], "202206250000 202206260000 6:00:00")
+
+    def test_artifact_manifest(self):
+        """ Test that only artifacts with changed inputs are regenerated """
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            template = os.path.join(tmp_dir, "template")
+            output = os.path.join(tmp_dir, "output")
+            for path in (template, output):
+                with open(path, "w", encoding="utf-8") as fn:
+                    fn.write("a")
+
+            manifest = util.ArtifactManifest()
+            manifest.load(tmp_dir)
+            self.assertTrue(manifest.changed("out", {"x": 1}, files=[template], outputs=[output]))
+            manifest.set_result("out", "C96")
+            manifest.save()
+
+            manifest = util.ArtifactManifest(update=True)
+            manifest.load(tmp_dir)
+            self.assertFalse(manifest.changed("out", {"x": 1}, files=[template], outputs=[output]))
+            self.assertEqual(manifest.result("out"), "C96")
+            self.assertTrue(manifest.changed("other", {"x": 1}))
+
+            # Changed settings, template contents or a missing output
+            self.assertTrue(manifest.changed("out", {"x": 2}, files=[template], outputs=[output]))
+            with open(template, "w", encoding="utf-8") as fn:
+                fn.write("b")
+            self.assertTrue(manifest.changed("out", {"x": 1}, files=[template], outputs=[output]))
+            os.remove(output)
+            self.assertTrue(manifest.changed("out", {"x": 1}, outputs=[output]))
+
+    def test_lazy_imports(self):
+        """ Test that importing python_utils only imports the submodules that are used """
+        self.assertIs(util.run_command, util.run_command.__globals__["run_command"])
+        self.assertEqual(util.config_parser.load_yaml_config, util.load_yaml_config)
+        ush_dir = os.path.dirname(os.path.dirname(util.__file__))
+        loaded = subprocess.run(
+            [sys.executable, "-c",
+             "import sys; from python_utils import print_info_msg, import_vars; "
+             "print(' '.join(sorted(sys.modules)))"],
+            cwd=ush_dir, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        self.assertIn("python_utils.print_msg", loaded)
+        for module in ("python_utils.config_parser", "jinja2", "yaml", "xml.dom.minidom"):
+            self.assertNotIn(module, loaded)
+
+    @unittest.skipIf(os.environ.get("RUN_BENCHMARKS") != "true", "Skipping benchmarks")
+    def test_tool_startup_benchmark(self):
+        """ Compares the start-to-exit time of a small tool with the time it
+        takes when jinja2 and xml.dom.minidom are imported up front, as they
+        were before python_utils imported them lazily. Set RUN_BENCHMARKS=true
+        to run. """
+        ush_dir = os.path.dirname(os.path.dirname(util.__file__))
+        tool = os.path.join(ush_dir, "link_fix.py")
+        commands = {
+            "lazy": [sys.executable, tool, "-h"],
+            "eager": [sys.executable, "-c",
+                      "import runpy, sys, jinja2, xml.dom.minidom; "
+                      f"runpy.run_path({tool!r}, run_name='__main__')", "-h"],
+        }
+        times = {}
+        for name, command in commands.items():
+            runs = []
+            for _ in range(9):
+                start = time.perf_counter()
+                subprocess.run(command, cwd=ush_dir, capture_output=True, check=True)
+                runs.append(time.perf_counter() - start)
+            times[name] = sorted(runs)[len(runs) // 2]
+            print(f"\nlink_fix.py -h ({name}): {times[name]:.3f}s")
+        self.assertLess(times["lazy"], times["eager"])
+
+    def test_timing(self):
+        """ Test that spans and phases are recorded under their parents """
+
+        @util.timed
+        def count(n):
+            return count(n - 1) + 1 if n else 0
+
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            util.start_timing("generate", profile=True)
+            util.phase("load")
+            self.assertEqual(count(3), 3)
+            util.phase("write")
+            with util.span("dump"):
+                util.phase("yaml")
+            with util.span("dump"):
+                pass
+            report_fp = util.write_timing_report(tmp_dir)
+            self.assertFalse(util.timing_enabled())
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, util.timing.PROFILE_FN)))
+            with open(report_fp, encoding="utf-8") as fn:
+                report = json.load(fn)
+            calls = {span["path"]: span["calls"] for span in report["spans"]}
+            self.assertEqual(list(calls), [
+                "generate", "generate/load", "generate/load/count", "generate/write",
+                "generate/write/dump", "generate/write/dump/yaml",
+            ])
+            self.assertEqual(calls["generate/load/count"], 1)
+            self.assertEqual(calls["generate/write/dump"], 2)
+
+            # Nothing is recorded or written unless timing is started
+            util.start_timing("generate", enabled=False)
+            with util.span("dump"):
+                util.phase("yaml")
+            self.assertIsNone(util.write_timing_report(tmp_dir))
+
+    def test_check_valid_values(self):
+        """ Test that all invalid values are reported, wherever they are set """
+        with tempfile.TemporaryDirectory(dir=".") as tmp_dir:
+            valid_fp = os.path.join(tmp_dir, "valid_param_vals.yaml")
+            defaults_fp = os.path.join(tmp_dir, "config_defaults.yaml")
+            with open(valid_fp, "w", encoding="utf-8") as fn:
+                fn.write("valid_vals_SCHED: [slurm, pbspro]\n"
+                         "valid_vals_FIELDS: [APCP, REFC]\n"
+                         "valid_vals_STAGED: [True, False]\n")
+            with open(defaults_fp, "w", encoding="utf-8") as fn:
+                fn.write("platform:\n  SCHED: slurm\n"
+                         "ics:\n  STAGED: false\nlbcs:\n  STAGED: false\n"
+                         "vx:\n  FIELDS: [APCP]\n")
+            valid_values = util.load_valid_values(valid_fp, defaults_fp)
+            self.assertIs(valid_values, util.load_valid_values(valid_fp, defaults_fp))
+
+            cfg = {"platform": {"SCHED": "slurm"}, "ics": {"STAGED": True},
+                   "lbcs": {"STAGED": None}, "vx": {"FIELDS": ["APCP", "REFC"]},
+                   "rocoto": {"SCHED": "bogus"}}
+            self.assertEqual(util.check_valid_values(cfg, valid_values), [])
+            cfg["platform"]["SCHED"] = "lsf"
+            cfg["lbcs"]["STAGED"] = "maybe"
+            cfg["vx"]["FIELDS"] = ["APCP", {"REFC": 1}]
+            errors = util.check_valid_values(cfg, valid_values)
+            self.assertEqual(len(errors), 3)
+            self.assertIn("SCHED = lsf", errors[0])
+            self.assertIn("at least one invalid value", errors[2])
+
     def test_print_msg(self):
         """ Test that a bool is returned from print_info_msg"""
         self.assertEqual(util.print_info_msg("Hello World!", verbose=False), False)
@@ -231,5 +514,48 @@ class Testing(unittest.TestCase):
         self.test_dir = os.path.dirname(os.path.abspath(__file__))
         self.ushdir = os.path.join(self.test_dir, "..", "..", "ush")
 
+def legacy_load_shell_as_ini_config(file_name, return_string=1):
+    """ The original load_shell_as_ini_config, which writes the converted file
+    to the current directory to read it with configparser and splits every
+    array with shlex. Used as the reference for the benchmark. """
+    with open(file_name, "r", encoding="utf-8") as file:
+        cfg = file.read()
+        cfg = cfg.replace("# [", "[")
+        cfg = cfg.replace("\\\n", " ")
+    temp_file = os.path.join(os.getcwd(), "_temp." + str(os.getpid()) + ".ini")
+    with open(temp_file, "w", encoding="utf-8") as file:
+        file.write(cfg)
+    try:
+        config = configparser.RawConfigParser()
+        config.optionxform = str
+        config.read(temp_file)
+    finally:
+        os.remove(temp_file)
+    config_dict = {s: dict(config.items(s)) for s in config.sections()}
+    for _, vs in config_dict.items():
+        for k, v in vs.items():
+            vs[k] = legacy_str_to_list(v, return_string)
+    return config_dict
+
+
+def legacy_str_to_list(v, return_string=0):
+    """ str_to_list, splitting every array with shlex """
+    v = v.strip()
+    if not v:
+        return None
+    if (v[0] == "(" and v[-1] == ")") or (v[0] == "[" and v[-1] == "]"):
+        tokens = shlex.split(v[1:-1].replace(",", " "))
+        lst = []
+        for itm in tokens:
+            itm = itm.strip()
+            if itm == "":
+                continue
+            if "=" in itm:
+                itm = itm[itm.find("=") + 1 :]
+            lst.append(util.str_to_type(itm, return_string))
+        return lst
+    return util.str_to_type(v, return_string)
+
+
 if __name__ == "__main__":
     unittest.main()
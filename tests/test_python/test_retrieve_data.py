@@ -18,11 +18,24 @@ To run a single test:
 To ensure all output is printed for debugging or to monitor test progress,
 omit the "-b" flag.
 """
+#pylint: disable=too-many-lines
+import contextlib
 import datetime
+import functools
 import glob
+import http.server
+import io
+import json
 import os
+import shutil
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+
+import yaml
 
 import retrieve_data
 
@@ -493,3 +506,868 @@ class FunctionalTesting(unittest.TestCase):
 
             # Testing that there is no failure
             retrieve_data.main(args)
+
+
+class ThrottlingHandler(http.server.SimpleHTTPRequestHandler):
+
+    """Serves files from a directory, with support for single byte-range
+    requests, but answers the first request for each path listed in
+    ``throttle`` with a 503."""
+
+    protocol_version = "HTTP/1.1"
+    throttle = set()
+    requests = []
+    ranges = []
+
+    def send_head(self):
+        self.requests.append(self.path)
+        if self.path in self.throttle:
+            self.throttle.discard(self.path)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        byte_range = self.headers.get("Range")
+        if byte_range:
+            self.ranges.append((self.path, byte_range))
+        path = self.translate_path(self.path)
+        if not byte_range or not os.path.isfile(path):
+            return super().send_head()
+
+        start, end = byte_range.replace("bytes=", "").split("-")
+        with open(path, "rb") as fn:
+            content = fn.read()
+        if int(start) >= len(content):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(content)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        end = int(end) if end else len(content) - 1
+        body = content[int(start):end + 1]
+        self.send_response(206)
+        self.send_header("Last-Modified", self.date_time_string(os.path.getmtime(path)))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class LocalServerTesting(unittest.TestCase):
+
+    """Tests the concurrent download engine against a local HTTP server,
+    so that no internet access is needed."""
+
+    def setUp(self):
+        self.path = os.path.dirname(__file__)
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(dir=self.path))
+        self.serve_dir = os.path.join(self.tmp_dir, "serve")
+        self.output_path = os.path.join(self.tmp_dir, "out")
+        os.chdir(self.tmp_dir)
+        os.makedirs(os.path.join(self.serve_dir, "aws", "20220625"))
+        os.makedirs(os.path.join(self.serve_dir, "nomads", "20220625"))
+        os.makedirs(self.output_path)
+        for fcst_hr in range(0, 13, 3):
+            file_name = f"model.t09z.f{fcst_hr:03d}.grib2"
+            with open(
+                os.path.join(self.serve_dir, "aws", "20220625", file_name), "wb"
+            ) as fn:
+                fn.write(os.urandom(4096 + fcst_hr))
+
+        ThrottlingHandler.throttle = set()
+        ThrottlingHandler.requests = []
+        ThrottlingHandler.ranges = []
+        handler = functools.partial(ThrottlingHandler, directory=self.serve_dir)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        config = {}
+        config["LOCAL"] = {}
+        for store in ["nomads", "aws"]:
+            config["LOCAL"][store] = {
+                "protocol": "download",
+                "url": f"{url}/{store}/{{yyyymmdd}}",
+                "file_names": {
+                    "anl": ["model.t{hh}z.f000.grib2"],
+                    "fcst": ["model.t{hh}z.f{fcst_hr:03d}.grib2"],
+                },
+            }
+        self.config = os.path.join(self.tmp_dir, "data_locations.yml")
+        with open(self.config, "w", encoding="utf-8") as fn:
+            yaml.dump(config, fn)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.path)
+
+    def _args(self, data_stores, *extra):
+        # fmt: off
+        return [
+            '--file_set', 'fcst',
+            '--config', self.config,
+            '--cycle_date', '2022062509',
+            '--data_stores', *data_stores,
+            '--data_type', 'LOCAL',
+            '--fcst_hrs', '3', '12', '3',
+            '--output_path', self.output_path,
+            '--ics_or_lbcs', 'LBCS',
+            '--debug',
+            *extra,
+        ]
+        # fmt: on
+
+    def test_concurrent_download(self):
+
+        """Download several files concurrently, falling back from a data
+        store that does not have them, and recovering from a throttle."""
+
+        ThrottlingHandler.throttle.add("/aws/20220625/model.t09z.f006.grib2")
+        args = self._args(
+            ["nomads", "aws"],
+            '--num_workers', '4',
+            '--max_per_host', '2',
+            '--summary_file', 'summary.sh',
+        )
+        retrieve_data.main(args)
+
+        for fcst_hr in range(3, 13, 3):
+            file_name = f"model.t09z.f{fcst_hr:03d}.grib2"
+            with open(os.path.join(self.serve_dir, "aws", "20220625", file_name), "rb") as fn:
+                expected = fn.read()
+            with open(os.path.join(self.output_path, file_name), "rb") as fn:
+                self.assertEqual(fn.read(), expected)
+        self.assertFalse(glob.glob(os.path.join(self.output_path, "*.part")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_path, "summary.sh")))
+        self.assertEqual(
+            ThrottlingHandler.requests.count("/aws/20220625/model.t09z.f006.grib2"), 2
+        )
+
+    def test_concurrent_check_file(self):
+
+        """Check file existence with HEAD requests, and report missing
+        files as unavailable."""
+
+        retrieve_data.main(self._args(["aws"], '--num_workers', '4', '--check_file'))
+        self.assertEqual(os.listdir(self.output_path), [])
+
+        with self.assertRaises(SystemExit):
+            retrieve_data.main(
+                self._args(["nomads"], '--num_workers', '4', '--check_file')
+            )
+
+    def test_grib2_subset(self):
+
+        """Retrieve only the selected records of a GRIB2 file, using its
+        .idx inventory and Range requests."""
+
+        records = [
+            ("PRMSL", "mean sea level"),
+            ("TMP", "2 m above ground"),
+            ("UGRD", "10 m above ground"),
+            ("VGRD", "10 m above ground"),
+            ("TMP", "500 mb"),
+            ("UGRD", "500 mb"),
+        ]
+        serve_path = os.path.join(self.serve_dir, "aws", "20220625")
+        grib, index, expected = b"", [], b""
+        for num, (variable, level) in enumerate(records):
+            message = b"GRIB" + os.urandom(100 + num) + b"7777"
+            index.append(f"{num + 1}:{len(grib)}:d=2022062509:{variable}:{level}:anl:")
+            if level in ("10 m above ground", "500 mb") and variable != "TMP":
+                expected += message
+            grib += message
+        with open(os.path.join(serve_path, "model.t09z.f000.grib2"), "wb") as fn:
+            fn.write(grib)
+        index_fp = os.path.join(serve_path, "model.t09z.f000.grib2.idx")
+        with open(index_fp, "w", encoding="utf-8") as fn:
+            fn.write("\n".join(index) + "\n")
+
+        with open(self.config, encoding="utf-8") as fn:
+            config = yaml.safe_load(fn)
+        config["LOCAL"]["aws"]["variables"] = ["UGRD", "VGRD"]
+        config["LOCAL"]["aws"]["levels"] = ["10 m above ground", "500 mb"]
+        with open(self.config, "w", encoding="utf-8") as fn:
+            yaml.dump(config, fn)
+
+        args = self._args(["aws"])
+        args[args.index("fcst")] = "anl"
+        args[args.index("--fcst_hrs") + 1:args.index("--output_path")] = ["0"]
+        retrieve_data.main(args)
+
+        with open(os.path.join(self.output_path, "model.t09z.f000.grib2"), "rb") as fn:
+            self.assertEqual(fn.read(), expected)
+        # UGRD/VGRD at 10 m are adjacent and are fetched with one request
+        ranges = retrieve_data.grib2_byte_ranges(
+            "\n".join(index), ["UGRD", "VGRD"], ["10 m above ground", "500 mb"]
+        )
+        self.assertEqual(len(ranges), 2)
+        self.assertIsNone(ranges[-1][1])
+
+        # Files without an inventory are retrieved whole
+        os.remove(os.path.join(self.output_path, "model.t09z.f000.grib2"))
+        os.remove(os.path.join(serve_path, "model.t09z.f000.grib2.idx"))
+        retrieve_data.main(args)
+        with open(os.path.join(self.output_path, "model.t09z.f000.grib2"), "rb") as fn:
+            self.assertEqual(fn.read(), grib)
+
+    def test_plan(self):
+
+        """The plan lists every file for every data store and cycle, checks
+        them without retrieving anything, and fails for incomplete cycles."""
+
+        manifest = os.path.join(self.tmp_dir, "plan.json")
+        args = self._args(
+            ["nomads", "aws"],
+            '--plan', manifest,
+            '--plan_end_date', '2022062609',
+        )
+        with self.assertRaises(SystemExit):
+            retrieve_data.main(args)
+
+        self.assertEqual(os.listdir(self.output_path), [])
+        # One request per file: 2 data stores x 2 cycles x 4 forecast hours
+        self.assertEqual(len(ThrottlingHandler.requests), 16)
+
+        with open(manifest, encoding="utf-8") as fn:
+            plan = json.load(fn)
+        self.assertEqual(
+            [cycle["cycle_date"] for cycle in plan["cycles"]],
+            ["202206250900", "202206260900"],
+        )
+        first, second = plan["cycles"]
+        self.assertEqual(first["data_store"], "aws")
+        self.assertIsNone(second["data_store"])
+        nomads, aws = first["data_stores"]
+        self.assertEqual(nomads["protocol"], "download")
+        self.assertFalse(nomads["available"])
+        self.assertEqual(len(aws["files"]), 4)
+        self.assertTrue(all(file["exists"] for file in aws["files"]))
+        self.assertEqual(
+            aws["files"][0]["destination"],
+            os.path.join(self.output_path, "model.t09z.f003.grib2"),
+        )
+
+    def test_journal(self):
+
+        """Reruns skip verified files, resume partial files, and fetch
+        corrupt files again."""
+
+        args = self._args(["aws"], '--num_workers', '2')
+        retrieve_data.main(args)
+        journal = retrieve_data.TransferJournal(self.output_path)
+        for fcst_hr in range(3, 13, 3):
+            self.assertTrue(journal.get(f"model.t09z.f{fcst_hr:03d}.grib2")["complete"])
+
+        # Everything is verified, so nothing is requested
+        ThrottlingHandler.requests = []
+        retrieve_data.main(args)
+        self.assertEqual(ThrottlingHandler.requests, [])
+
+        # Corrupt one file, and leave another one partially downloaded as
+        # if the job had been killed
+        corrupt = os.path.join(self.output_path, "model.t09z.f003.grib2")
+        with open(corrupt, "r+b") as fn:
+            fn.write(b"corrupt")
+        partial = os.path.join(self.output_path, "model.t09z.f006.grib2")
+        entry = journal.get("model.t09z.f006.grib2")
+        entry.update(complete=False, sha256=None)
+        journal.record(entry.pop("file"), **entry)
+        with open(partial, "rb") as fn:
+            contents = fn.read()
+        os.remove(partial)
+        with open(f"{partial}.part", "wb") as fn:
+            fn.write(contents[:1000])
+
+        ThrottlingHandler.requests = []
+        retrieve_data.main(args)
+        self.assertEqual(
+            sorted(ThrottlingHandler.requests),
+            ["/aws/20220625/model.t09z.f003.grib2", "/aws/20220625/model.t09z.f006.grib2"],
+        )
+        self.assertEqual(
+            ThrottlingHandler.ranges,
+            [("/aws/20220625/model.t09z.f006.grib2", "bytes=1000-")],
+        )
+        for name in ["model.t09z.f003.grib2", "model.t09z.f006.grib2"]:
+            with open(os.path.join(self.serve_dir, "aws", "20220625", name), "rb") as src, \
+                    open(os.path.join(self.output_path, name), "rb") as dest:
+                self.assertEqual(src.read(), dest.read())
+        self.assertFalse(os.path.exists(f"{partial}.part"))
+
+        # A job killed after the last byte, but before the partial file was
+        # moved into place, leaves a complete partial file. The server answers
+        # the resume request with a 416, and the file is finished as is.
+        # A partial file longer than the journaled size is retrieved again.
+        url = "/aws/20220625/model.t09z.f006.grib2"
+        for extra, expected in [
+            (b"", [url]),
+            (b"extra", [url, url]),
+        ]:
+            journal = retrieve_data.TransferJournal(self.output_path)
+            entry = journal.get("model.t09z.f006.grib2")
+            entry.update(complete=False, sha256=None)
+            journal.record(entry.pop("file"), **entry)
+            os.remove(partial)
+            with open(f"{partial}.part", "wb") as fn:
+                fn.write(contents + extra)
+
+            ThrottlingHandler.requests = []
+            ThrottlingHandler.ranges = []
+            retrieve_data.main(args)
+            self.assertEqual(ThrottlingHandler.requests, expected)
+            self.assertEqual(ThrottlingHandler.ranges, [(url, f"bytes={len(contents + extra)}-")])
+            with open(partial, "rb") as fn:
+                self.assertEqual(fn.read(), contents)
+            self.assertFalse(os.path.exists(f"{partial}.part"))
+            journal = retrieve_data.TransferJournal(self.output_path)
+            self.assertTrue(journal.verified("model.t09z.f006.grib2", entry["url"]))
+
+    def test_cache(self):
+
+        """Files retrieved once are linked from the cache on later runs,
+        for both the sequential and the concurrent retrieval paths."""
+
+        cache_dir = os.path.join(self.tmp_dir, "cache")
+        for extra in [[], ['--num_workers', '4']]:
+            for run in range(2):
+                shutil.rmtree(self.output_path)
+                os.makedirs(self.output_path)
+                ThrottlingHandler.requests = []
+                args = self._args(
+                    ["aws"],
+                    '--cache_dir', cache_dir,
+                    '--summary_file', 'summary.sh',
+                    *extra,
+                )
+                if not extra:
+                    # Avoid the sleep between wget calls; disk uses the same path
+                    args[args.index("aws")] = "disk"
+                    args += ['--input_file_path',
+                             os.path.join(self.serve_dir, "aws", "{yyyymmdd}"),
+                             '--file_templates', 'model.t{hh}z.f{fcst_hr:03d}.grib2']
+                retrieve_data.main(args)
+
+                self.assertEqual(len(glob.glob(os.path.join(self.output_path, "*.grib2"))), 4)
+                with open(os.path.join(self.output_path, "summary.sh"), encoding="utf-8") as fn:
+                    summary = fn.read()
+                if run == 0:
+                    self.assertIn("EXTRN_MDL_CACHE_HITS=0", summary)
+                else:
+                    self.assertIn("EXTRN_MDL_CACHE_HITS=4", summary)
+                    self.assertIn("EXTRN_MDL_CACHE_MISSES=0", summary)
+                    self.assertEqual(ThrottlingHandler.requests, [])
+
+        # A tiny size limit evicts everything but the lock file
+        cache = retrieve_data.FileCache(cache_dir, max_size_gb=0)
+        cache.evict()
+        cached = [f for _, _, files in os.walk(cache_dir) for f in files]
+        self.assertEqual(cached, [".lock"])
+
+
+class DiskTransferTesting(unittest.TestCase):
+
+    """Tests staging files from disk with the in-process copy engine."""
+
+    def setUp(self):
+        self.path = os.path.dirname(__file__)
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.tmp_dir = stack.enter_context(tempfile.TemporaryDirectory(dir=self.path))
+        self.source_dir = os.path.join(self.tmp_dir, "src", "20220625")
+        self.output_path = os.path.join(self.tmp_dir, "out")
+        os.makedirs(self.source_dir)
+        os.makedirs(self.output_path)
+        for fcst_hr in range(0, 13, 3):
+            file_name = f"model.t09z.f{fcst_hr:03d}.grib2"
+            with open(os.path.join(self.source_dir, file_name), "wb") as fn:
+                fn.write(os.urandom(4096 + fcst_hr))
+
+    def test_copy_modes(self):
+
+        """Copies, hard links and symlinks produce the expected files, and
+        replacing a hard-linked destination leaves the source untouched."""
+
+        source = os.path.join(self.source_dir, "model.t09z.f003.grib2")
+        with open(source, "rb") as fn:
+            contents = fn.read()
+
+        for copy_cmd in ["cp", "ln", "ln -sf"]:
+            self.assertTrue(retrieve_data.copy_file(source, self.output_path, copy_cmd))
+            dest = os.path.join(self.output_path, os.path.basename(source))
+            with open(dest, "rb") as fn:
+                self.assertEqual(fn.read(), contents)
+            self.assertEqual(os.path.islink(dest), copy_cmd == "ln -sf")
+            self.assertEqual(os.path.samefile(source, dest), copy_cmd != "cp")
+            os.remove(dest)
+
+        dest = os.path.join(self.output_path, "linked.grib2")
+        os.link(source, dest)
+        other = os.path.join(self.source_dir, "model.t09z.f006.grib2")
+        self.assertTrue(retrieve_data.copy_file(other, dest, "cp"))
+        with open(source, "rb") as fn:
+            self.assertEqual(fn.read(), contents)
+
+        self.assertFalse(
+            retrieve_data.copy_file(source + ".missing", self.output_path, "cp")
+        )
+
+    def test_cache_staging_survives_eviction(self):
+
+        """Cache hits are hard linked or copied, never symlinked, so evicting
+        the entry leaves the staged file intact."""
+
+        source = os.path.join(self.source_dir, "model.t09z.f003.grib2")
+        with open(source, "rb") as fn:
+            contents = fn.read()
+        cache = retrieve_data.FileCache(os.path.join(self.tmp_dir, "cache"))
+        key = cache.key("HRRR", "disk", source)
+        cache.insert(key, source)
+        entry = cache._entry(key)  # pylint: disable=protected-access
+        self.assertTrue(retrieve_data.FileCache.is_entry(entry))
+        self.assertFalse(retrieve_data.FileCache.is_entry(source))
+
+        staged = os.path.join(self.output_path, "staged.grib2")
+        linked = os.path.join(self.output_path, "linked.grib2")
+        # Hard links fail across file systems
+        with mock.patch("retrieve_data.os.link", side_effect=OSError):
+            self.assertTrue(cache.fetch(key, staged))
+            self.assertTrue(retrieve_data.copy_file(entry, linked, "ln -sf"))
+        cache.max_bytes = 0
+        cache.evict()
+
+        self.assertFalse(os.path.exists(entry))
+        for dest in [staged, linked]:
+            self.assertFalse(os.path.islink(dest))
+            with open(dest, "rb") as fn:
+                self.assertEqual(fn.read(), contents)
+
+    def test_disk_cache_leaves_sources_alone(self):
+
+        """Files staged from disk are copied into the cache, so cache hits
+        don't touch the sources, and a regenerated source misses the cache."""
+
+        cache_dir = os.path.join(self.tmp_dir, "cache")
+        source = os.path.join(self.source_dir, "model.t09z.f003.grib2")
+        for workers in ['1', '4']:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            # fmt: off
+            args = [
+                '--file_set', 'fcst',
+                '--config', os.path.join(self.path, "../../parm/data_locations.yml"),
+                '--cycle_date', '2022062509',
+                '--data_stores', 'disk',
+                '--data_type', 'HRRR',
+                '--fcst_hrs', '3', '12', '3',
+                '--output_path', self.output_path,
+                '--ics_or_lbcs', 'LBCS',
+                '--input_file_path', os.path.join(self.tmp_dir, "src", "{yyyymmdd}"),
+                '--file_templates', 'model.t{hh}z.f{fcst_hr:03d}.grib2',
+                '--cache_dir', cache_dir,
+                '--num_workers', workers,
+                '--hardlink',
+                '--debug',
+            ]
+            # fmt: on
+            retrieve_data.main(args)
+            entries = [os.path.join(root, f) for root, _, files in os.walk(cache_dir)
+                       for f in files if f != ".lock"]
+            self.assertEqual(len(entries), 4)
+            for entry in entries:
+                self.assertFalse(os.path.samefile(entry, source))
+
+            os.utime(source, ns=(0, 0))
+            retrieve_data.main(args)
+            self.assertEqual(os.stat(source).st_mtime_ns, 0)
+
+            with open(source, "wb") as fn:
+                fn.write(b"regenerated")
+            retrieve_data.main(args)
+            with open(os.path.join(self.output_path, os.path.basename(source)), "rb") as fn:
+                self.assertEqual(fn.read(), b"regenerated")
+
+    def test_concurrent_disk(self):
+
+        """Files on disk are staged on a pool of worker threads."""
+
+        # fmt: off
+        args = [
+            '--file_set', 'fcst',
+            '--config', os.path.join(self.path, "../../parm/data_locations.yml"),
+            '--cycle_date', '2022062509',
+            '--data_stores', 'disk',
+            '--data_type', 'HRRR',
+            '--fcst_hrs', '3', '12', '3',
+            '--output_path', self.output_path,
+            '--ics_or_lbcs', 'LBCS',
+            '--input_file_path', os.path.join(self.tmp_dir, "src", "{yyyymmdd}"),
+            '--file_templates', 'model.t{hh}z.f{fcst_hr:03d}.grib2',
+            '--num_workers', '4',
+            '--hardlink',
+            '--debug',
+        ]
+        # fmt: on
+        retrieve_data.main(args)
+
+        staged = sorted(glob.glob(os.path.join(self.output_path, "*.grib2")))
+        self.assertEqual(len(staged), 4)
+        for dest in staged:
+            source = os.path.join(self.source_dir, os.path.basename(dest))
+            self.assertTrue(os.path.samefile(source, dest))
+
+    @unittest.skipIf(os.environ.get("RUN_BENCHMARKS") != "true", "Skipping benchmarks")
+    def test_copy_benchmark(self):
+
+        """Compares staging many files with in-process copies against a cp
+        subprocess per file. Set RUN_BENCHMARKS=true to run."""
+
+        sources = []
+        for num in range(200):
+            source = os.path.join(self.source_dir, f"bench.{num:03d}")
+            with open(source, "wb") as fn:
+                fn.write(os.urandom(64 * 1024))
+            sources.append(source)
+
+        def staged(dest_dir, stage):
+            os.makedirs(dest_dir)
+            start = time.perf_counter()
+            for source in sources:
+                stage(source, dest_dir)
+            return time.perf_counter() - start
+
+        subprocess_time = staged(
+            os.path.join(self.tmp_dir, "subprocess"),
+            lambda source, dest: subprocess.run(["cp", source, dest], check=True),
+        )
+        native_time = staged(
+            os.path.join(self.tmp_dir, "native"),
+            lambda source, dest: retrieve_data.copy_file(source, dest, "cp"),
+        )
+        threaded_dir = os.path.join(self.tmp_dir, "threaded")
+        os.makedirs(threaded_dir)
+        start = time.perf_counter()
+        retrieve_data.copy_files(
+            [(source, threaded_dir) for source in sources], "cp", num_workers=8
+        )
+        threaded_time = time.perf_counter() - start
+
+        print(
+            f"\nStaged {len(sources)} files: cp subprocess {subprocess_time:.3f}s, "
+            f"in-process {native_time:.3f}s, in-process x8 threads {threaded_time:.3f}s"
+        )
+        self.assertLess(native_time, subprocess_time)
+
+
+def legacy_fill_template(template_str, cycle_date, **kwargs):
+
+    """The original fill_template implementation, which formats every date
+    field on every call. Used as the reference for FillTemplateTesting."""
+
+    cycle_hour = cycle_date.strftime("%H")
+    low_end = int(cycle_hour) // 6 * 6
+    format_values = {
+        "bin6": f"{low_end:02d}-{low_end+5:02d}",
+        "ens_group": kwargs.get("ens_group"),
+        "fcst_hr": kwargs.get("fcst_hr", 0),
+        "dd": cycle_date.strftime("%d"),
+        "hh": cycle_hour,
+        "hh_even": f"{int(cycle_hour) // 2 * 2:02d}",
+        "jjj": cycle_date.strftime("%j"),
+        "mem": kwargs.get("mem", ""),
+        "min": cycle_date.strftime("%M"),
+        "mm": cycle_date.strftime("%m"),
+        "yy": cycle_date.strftime("%y"),
+        "yyyy": cycle_date.strftime("%Y"),
+        "yyyymm": cycle_date.strftime("%Y%m"),
+        "yyyymmdd": cycle_date.strftime("%Y%m%d"),
+        "yyyymmddhh": cycle_date.strftime("%Y%m%d%H"),
+    }
+    return template_str.format(**format_values)
+
+
+class FillTemplateTesting(unittest.TestCase):
+
+    """Tests the compiled template engine against the original
+    implementation."""
+
+    templates = [
+        "/NCEPPROD/hpssprod/runhistory/rh{yyyy}/{yyyymm}/{yyyymmdd}",
+        "com_gfs_prod_gfs.{yyyymmdd}_{hh}.gfs_pgrb2.tar",
+        "gfs.t{hh}z.pgrb2.0p25.f{fcst_hr:03d}",
+        "gdas.{yyyymmdd}/{hh}/atmos/mem{mem:03d}/gdas.t{hh}z.atmf{fcst_hr:03d}.nc",
+        "rap.{yyyymmdd}{hh_even}.{bin6}.grp{ens_group}.{jjj}.{yy}{mm}{dd}.{min}",
+        "{yyyymmddhh}_{fcst_hr:0{width}d}",
+        "no templates here",
+    ]
+
+    def test_matches_legacy(self):
+
+        """Filled templates match the original implementation for all
+        fields, cycles, members and forecast hours."""
+
+        for cycle_date in [
+            datetime.datetime(2022, 6, 25, 9),
+            datetime.datetime(2023, 1, 1, 0, 30),
+            datetime.datetime(2024, 12, 31, 23),
+        ]:
+            for template in self.templates[:-2] + self.templates[-1:]:
+                for mem, fcst_hr, ens_group in [(1, 0, 1), (12, 84, 2)]:
+                    kwargs = {"mem": mem, "fcst_hr": fcst_hr, "ens_group": ens_group}
+                    self.assertEqual(
+                        retrieve_data.fill_template(template, cycle_date, **kwargs),
+                        legacy_fill_template(template, cycle_date, **kwargs),
+                    )
+
+        self.assertEqual(
+            retrieve_data.compile_template(self.templates[-2]), ("yyyymmddhh",)
+        )
+        with self.assertRaises(KeyError):
+            retrieve_data.fill_template("{unknown}", datetime.datetime(2022, 6, 25))
+        self.assertEqual(
+            retrieve_data.fill_template("null", datetime.datetime.now(), templates_only=True),
+            "bin6,ens_group,fcst_hr,dd,hh,hh_even,jjj,mem,min,mm,yy,yyyy,yyyymm,yyyymmdd,"
+            "yyyymmddhh",
+        )
+
+    @unittest.skipIf(os.environ.get("RUN_BENCHMARKS") != "true", "Skipping benchmarks")
+    def test_fill_template_benchmark(self):
+
+        """Compares expanding 2 templates for 100 members and 84 forecast
+        hours against the original implementation. Set RUN_BENCHMARKS=true
+        to run."""
+
+        cycle_date = datetime.datetime(2022, 6, 25, 9)
+        templates = self.templates[2:4]
+
+        def expand(fill):
+            start = time.perf_counter()
+            for mem in range(1, 101):
+                for fcst_hr in range(84):
+                    for template in templates:
+                        fill(template, cycle_date, fcst_hr=fcst_hr, mem=mem)
+            return time.perf_counter() - start
+
+        legacy_time = expand(legacy_fill_template)
+        compiled_time = expand(retrieve_data.fill_template)
+        print(
+            f"\nExpanded {100 * 84 * len(templates)} templates: original "
+            f"{legacy_time:.3f}s, compiled {compiled_time:.3f}s "
+            f"({legacy_time / compiled_time:.1f}x)"
+        )
+        self.assertLess(compiled_time, legacy_time)
+
+
+class HPSSTesting(unittest.TestCase):
+
+    """Tests HPSS retrieval with stand-in hsi and htar commands that log
+    each invocation."""
+
+    def setUp(self):
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        self.log = os.path.join(self.tmp_dir, "hsi.log")
+        self.htar_log = os.path.join(self.tmp_dir, "htar.log")
+        self.existing = os.path.join(self.tmp_dir, "existing")
+        hsi = os.path.join(self.tmp_dir, "hsi")
+        with open(hsi, "w", encoding="utf-8") as fn:
+            fn.write(
+                "#!/bin/bash\n"
+                f'echo "$@" >> {self.log}\n'
+                "status=0\n"
+                "for path in ${@: -1}; do\n"
+                '  [[ "$path" = ls || "$path" = -1 ]] && continue\n'
+                f'  if grep -qxF "$path" {self.existing}; then\n'
+                '    echo "$path" >&2\n'
+                "  else\n"
+                '    echo "*** hsi: $path: No such file or directory" >&2\n'
+                "    status=72\n"
+                "  fi\n"
+                "done\n"
+                "exit $status\n"
+            )
+        os.chmod(hsi, 0o755)
+
+        # Extracts the requested paths that are listed in existing
+        htar = os.path.join(self.tmp_dir, "htar")
+        with open(htar, "w", encoding="utf-8") as fn:
+            fn.write(
+                "#!/bin/bash\n"
+                f'echo "$@" >> {self.htar_log}\n'
+                'for path in "${@:3}"; do\n'
+                f'  if grep -qxF "$path" {self.existing}; then\n'
+                '    mkdir -p $(dirname $path)\n'
+                '    echo "$2:$path" > $path\n'
+                "  fi\n"
+                "done\n"
+            )
+        os.chmod(htar, 0o755)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = f"{self.tmp_dir}:{self.path}"
+        retrieve_data.HPSS_LISTING.clear()
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        retrieve_data.HPSS_LISTING.clear()
+
+    def test_find_archive_files(self):
+
+        """All candidate archives for all ensemble groups are checked in a
+        single hsi session, and later lookups are memoized."""
+
+        paths = ["/hpss/{yyyymmdd}", "/hpss/{yyyymmdd}"]
+        file_names = [
+            "old_{yyyymmdd}{hh}_grp{ens_group}.tar",
+            ["new_{yyyymmdd}{hh}_grp{ens_group}a.tar",
+             "new_{yyyymmdd}{hh}_grp{ens_group}b.tar"],
+        ]
+        cycle_date = datetime.datetime(2022, 6, 25, 6)
+        with open(self.existing, "w", encoding="utf-8") as fn:
+            for ens_group in [1, 2]:
+                fn.write(f"/hpss/20220625/new_2022062506_grp{ens_group}a.tar\n")
+                fn.write(f"/hpss/20220625/new_2022062506_grp{ens_group}b.tar\n")
+
+        retrieve_data.hsi_probe([
+            file_path
+            for ens_group in [1, 2]
+            for item in retrieve_data.archive_candidates(
+                paths, file_names, cycle_date, ens_group
+            )
+            for file_path in item
+        ])
+
+        for ens_group in [1, 2]:
+            existing_archives, which_archive = retrieve_data.find_archive_files(
+                paths, file_names, cycle_date, ens_group
+            )
+            self.assertEqual(which_archive, 1)
+            self.assertEqual(
+                existing_archives,
+                {
+                    0: f"/hpss/20220625/new_2022062506_grp{ens_group}a.tar",
+                    1: f"/hpss/20220625/new_2022062506_grp{ens_group}b.tar",
+                },
+            )
+
+        with open(self.log, encoding="utf-8") as fn:
+            self.assertEqual(len(fn.readlines()), 1)
+
+        # Nothing found for a different cycle
+        self.assertEqual(
+            retrieve_data.find_archive_files(
+                paths, file_names, datetime.datetime(2022, 6, 26), 1
+            ),
+            ("", 0),
+        )
+
+    def test_single_pass_extraction(self):
+
+        """Each archive is extracted once for all members and forecast
+        hours, and the files are fanned out to each member's output path."""
+
+        work_dir = os.path.join(self.tmp_dir, "work")
+        os.makedirs(work_dir)
+        # Archives are extracted into the working directory. Return to the test
+        # directory afterwards, since the previous working directory may have
+        # been a temporary directory that no longer exists.
+        os.chdir(work_dir)
+        self.addCleanup(os.chdir, os.path.dirname(os.path.abspath(__file__)))
+
+        with open(self.existing, "w", encoding="utf-8") as fn:
+            fn.write("/hpss/20220625/ens_2022062506_grp1.tar\n")
+            for mem in [1, 2]:
+                for fcst_hr in [3, 6]:
+                    fn.write(f"./mem{mem:03d}/atm.f{fcst_hr:03d}.nc\n")
+                    fn.write(f"./mem{mem:03d}/sfc.f{fcst_hr:03d}.nc\n")
+
+        cla = retrieve_data.parse_args([
+            '--file_set', 'fcst',
+            '--cycle_date', '2022062506',
+            '--data_stores', 'hpss',
+            '--data_type', 'ENS',
+            '--fcst_hrs', '3', '6', '3',
+            '--output_path', os.path.join(work_dir, "out", "mem{mem:03d}"),
+            '--ics_or_lbcs', 'LBCS',
+            '--members', '1', '2',
+        ])
+        store_specs = {
+            "protocol": "htar",
+            "archive_path": ["/hpss/{yyyymmdd}"],
+            "archive_file_names": {"fcst": ["ens_{yyyymmdd}{hh}_grp{ens_group}.tar"]},
+            "archive_internal_dir": ["./mem{mem:03d}"],
+        }
+        unavailable = retrieve_data.hpss_requested_files(
+            cla,
+            ["atm.f{fcst_hr:03d}.nc", "sfc.f{fcst_hr:03d}.nc"],
+            store_specs,
+            members=[1, 2],
+            ens_group=1,
+        )
+
+        self.assertFalse(unavailable)
+        with open(self.htar_log, encoding="utf-8") as fn:
+            self.assertEqual(len(fn.readlines()), 1)
+        for mem in [1, 2]:
+            files = sorted(os.listdir(os.path.join(work_dir, "out", f"mem{mem:03d}")))
+            self.assertEqual(
+                files, ["atm.f003.nc", "atm.f006.nc", "sfc.f003.nc", "sfc.f006.nc"]
+            )
+            self.assertFalse(os.path.exists(os.path.join(work_dir, f"mem{mem:03d}")))
+
+    def test_plan_archives(self):
+
+        """The plan lists the files expected in each ensemble group's archive
+        and checks all archives of all cycles in one hsi session."""
+
+        with open(self.existing, "w", encoding="utf-8") as fn:
+            fn.write("/hpss/20220625/ens_2022062506_grp1.tar\n")
+            fn.write("/hpss/20220626/ens_2022062606_grp1.tar\n")
+
+        config = os.path.join(self.tmp_dir, "data_locations.yml")
+        with open(config, "w", encoding="utf-8") as fn:
+            yaml.dump({"ENS": {"hpss": {
+                "protocol": "htar",
+                "archive_path": ["/hpss/{yyyymmdd}"],
+                "archive_file_names": {"fcst": ["ens_{yyyymmdd}{hh}_grp{ens_group}.tar"]},
+                "archive_internal_dir": ["./mem{mem:03d}"],
+                "file_names": {"fcst": ["atm.f{fcst_hr:03d}.nc"]},
+            }}}, fn)
+
+        manifest = os.path.join(self.tmp_dir, "plan.json")
+        retrieve_data.main([
+            '--file_set', 'fcst',
+            '--config', config,
+            '--cycle_date', '2022062506',
+            '--data_stores', 'hpss',
+            '--data_type', 'ENS',
+            '--fcst_hrs', '3', '6', '3',
+            '--output_path', os.path.join(self.tmp_dir, "mem{mem:03d}"),
+            '--ics_or_lbcs', 'LBCS',
+            '--members', '1', '2',
+            '--plan', manifest,
+            '--plan_end_date', '2022062606',
+        ])
+
+        with open(self.log, encoding="utf-8") as fn:
+            self.assertEqual(len(fn.readlines()), 1)
+        with open(manifest, encoding="utf-8") as fn:
+            plan = json.load(fn)
+        for cycle, yyyymmdd in zip(plan["cycles"], ["20220625", "20220626"]):
+            self.assertEqual(cycle["data_store"], "hpss")
+            archive, = cycle["data_stores"][0]["archives"]
+            self.assertEqual(
+                archive["archive"], [f"/hpss/{yyyymmdd}/ens_{yyyymmdd}06_grp1.tar"]
+            )
+            self.assertEqual(
+                [file["source"] for file in archive["members"]],
+                ["./mem001/atm.f003.nc", "./mem001/atm.f006.nc",
+                 "./mem002/atm.f003.nc", "./mem002/atm.f006.nc"],
+            )
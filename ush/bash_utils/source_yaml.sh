@@ -23,6 +23,25 @@ Usage:
   yaml_file=$1
   section=$2
 
+  # Use the precompiled section from the exports file written at
+  # experiment generation time while it still matches the YAML file.
+  local exports_file yaml_hash
+  exports_file="${yaml_file%.*}_exports.sh"
+  if [ -n "${section}" ] && [ -f "${exports_file}" ] ; then
+    yaml_hash=$(sha256sum "${yaml_file}" 2>/dev/null) || yaml_hash=""
+    yaml_hash=${yaml_hash%% *}
+    if [ -n "${yaml_hash}" ] && \
+       [ "${__source_yaml_sha256:-}" != "${yaml_hash}" ] ; then
+      source "${exports_file}"
+    fi
+    if [ -n "${yaml_hash}" ] && \
+       [ "${__source_yaml_sha256:-}" = "${yaml_hash}" ] && \
+       declare -F "__source_yaml_${section}" > /dev/null ; then
+      "__source_yaml_${section}"
+      return
+    fi
+  fi
+
   while read -r line ; do
 
 
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Precompiles the sections of an experiment's ``var_defns.yaml`` into a shell file
+that ``source_yaml`` sources instead of running ``uw config realize`` once per
+section in every task.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from uwtools.api.config import get_yaml_config
+
+# Section and variable names that can become part of a shell identifier
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# The list rewrite applied by source_yaml to each line of uw output
+_LIST_VALUE = re.compile(r"='\[(.*)\]'")
+
+
+def exports_path(yaml_file):
+    """Returns the path of the shell exports file for a YAML file
+
+    Args:
+        yaml_file (str): Path to the YAML file
+    Returns:
+        Path to the exports file, which must match the one used in
+        ``ush/bash_utils/source_yaml.sh``
+    """
+    return f"{os.path.splitext(yaml_file)[0]}_exports.sh"
+
+
+def section_lines(section_cfg):
+    """Returns the shell lines that ``source_yaml`` would source for a section
+
+    This is the output of ``uw config realize --output-format sh`` for the
+    section, rewritten line by line the same way ``source_yaml`` rewrites it.
+
+    Args:
+        section_cfg (dict): A flat dictionary of variable names and values
+    Returns:
+        A list of shell lines
+    """
+    text = "\n".join(
+        f"{key}={shlex.quote(str(value))}" for key, value in section_cfg.items()
+    )
+    lines = []
+    for line in text.split("\n"):
+        line = _LIST_VALUE.sub(r"=(\1)", line.strip(" \t"), count=1)
+        line = line.replace(",", "").replace('"', "").replace("None", "", 1)
+        lines.append(line)
+    return lines
+
+
+def _exportable(section, section_cfg):
+    """Only flat sections with shell-safe names are precompiled; anything
+    else is left to uw, so that it fails or succeeds just as before."""
+    if not _IDENTIFIER.match(str(section)) or not isinstance(section_cfg, dict):
+        return False
+    return all(
+        _IDENTIFIER.match(str(key)) and not isinstance(value, dict)
+        for key, value in section_cfg.items()
+    )
+
+
+def _parses(script):
+    """Checks the syntax of a shell script with ``bash -n``"""
+    bash = shutil.which("bash")
+    if bash is None:
+        return True
+    check = subprocess.run(
+        [bash, "-n"], input=script, text=True, capture_output=True, check=False
+    )
+    return check.returncode == 0
+
+
+def create_var_defns_exports(var_defns_fp):
+    """Writes the shell exports file for a ``var_defns.yaml`` file
+
+    The exports file defines one shell function per section, named
+    ``__source_yaml_<section>``, and records the SHA-256 hash of the YAML
+    file it was generated from. ``source_yaml`` only uses it while that
+    hash still matches.
+
+    Args:
+        var_defns_fp (str): Path to the experiment's ``var_defns.yaml``
+    Returns:
+        Path to the exports file
+    """
+
+    with open(var_defns_fp, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    cfg = get_yaml_config(var_defns_fp)
+    cfg.dereference()
+
+    exports_fp = exports_path(var_defns_fp)
+    if os.path.exists(exports_fp):
+        os.remove(exports_fp)
+
+    lines = [
+        f"# Generated from {os.path.basename(var_defns_fp)} by {os.path.basename(__file__)}.",
+        "# Do not edit; source_yaml ignores this file once the hash below no",
+        "# longer matches the YAML file.",
+        f"__source_yaml_sha256={digest}",
+    ]
+    for section, section_cfg in cfg.items():
+        if not _exportable(section, section_cfg):
+            logging.debug(f"Section {section} of {var_defns_fp} will be sourced with uw")
+            continue
+        function = "\n".join(
+            [f"__source_yaml_{section}() {{", ":", *section_lines(section_cfg), "}"]
+        )
+        # A line that doesn't parse would break the whole function, where
+        # source_yaml would only have failed on that one line.
+        if not _parses(function):
+            logging.debug(f"Section {section} of {var_defns_fp} will be sourced with uw")
+            continue
+        lines.append(function)
+    contents = "\n".join(lines) + "\n"
+
+    fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(exports_fp)))
+    with os.fdopen(fd, "w") as f:
+        f.write(contents)
+    os.chmod(tmp_fp, 0o644)
+    os.replace(tmp_fp, exports_fp)
+    return exports_fp
+
+
+def _parse_args(argv):
+    """Parses command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Creates the shell exports file for a var_defns.yaml file."
+    )
+
+    parser.add_argument(
+        "-p",
+        "--path-to-defns",
+        dest="path_to_defns",
+        required=True,
+        help="Path to var_defns file.",
+    )
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _parse_args(sys.argv[1:])
+    create_var_defns_exports(args.path_to_defns)
@@ -19,6 +19,7 @@ from uwtools.api.config import get_nml_config, get_yaml_config, realize
 from uwtools.api.template import render
 
 from python_utils import (
+    ArtifactManifest,
     list_to_str,
     log_info,
     import_vars,
@@ -31,10 +32,17 @@ from python_utils import (
     cfg_to_yaml_str,
     find_pattern_in_str,
     flatten_dict,
+    phase,
+    start_timing,
+    write_timing_report,
 )
 
 from setup import setup
-from set_fv3nml_sfc_climo_filenames import set_fv3nml_sfc_climo_filenames
+from create_var_defns_exports import create_var_defns_exports, exports_path
+from set_fv3nml_sfc_climo_filenames import (
+    set_fv3nml_sfc_climo_filenames,
+    NEEDED_VARS as SFC_CLIMO_NEEDED_VARS,
+)
 from get_crontab_contents import add_crontab_line
 from check_python_version import check_python_version
 
@@ -42,15 +50,20 @@ from check_python_version import check_python_version
 def generate_FV3LAM_wflow(
         ushdir,
         logfile: str = "log.generate_FV3LAM_wflow",
-        debug: bool = False) -> str:
+        debug: bool = False,
+        user_config_fn: str = "config.yaml",
+        update: bool = False) -> str:
     """
     Sets up a forecast experiment and creates a workflow (according to the parameters specified 
     in the configuration file)
 
     Args:
-        ushdir  (str) : The full path of the ``ush/`` directory where this script is located
-        logfile (str) : The name of the file where logging is written
-        debug   (bool): Enable extra output for debugging
+        ushdir         (str) : The full path of the ``ush/`` directory where this script is located
+        logfile        (str) : The name of the file where logging is written
+        debug          (bool): Enable extra output for debugging
+        user_config_fn (str) : The user configuration file, relative to ``ushdir`` or absolute
+        update         (bool): Update an existing experiment in place, regenerating only the
+                               files whose inputs have changed since it was last generated
     Returns:
         EXPTDIR (str) : The full path of the directory where this experiment has been generated
     """
@@ -58,6 +71,15 @@ def generate_FV3LAM_wflow(
     # Set up logging to write to screen and logfile
     setup_logging(logfile, debug)
 
+    # Time the phases of generation when debugging or when SRW_TIMING is set;
+    # SRW_TIMING=profile also writes a cProfile dump to the experiment directory
+    srw_timing = os.environ.get("SRW_TIMING", "").lower()
+    start_timing(
+        "generate_FV3LAM_wflow",
+        enabled=debug or srw_timing not in ("", "0", "false", "no"),
+        profile=srw_timing == "profile",
+    )
+
     # Check python version and presence of some non-standard packages
     check_python_version()
 
@@ -71,8 +93,25 @@ def generate_FV3LAM_wflow(
 
     # The setup function reads the user configuration file and fills in
     # non-user-specified values from config_defaults.yaml
-    expt_config = setup(ushdir,debug=debug)
+    manifest = ArtifactManifest(update=update)
+    expt_config = setup(ushdir,user_config_fn=user_config_fn,debug=debug,manifest=manifest)
+
+    phase("var_defns_exports")
+    #
+    # -----------------------------------------------------------------------
+    #
+    # Precompile the sections of the variable definitions file into shell
+    # functions, so that source_yaml doesn't need to run uw for each section
+    # in each task.
+    #
+    # -----------------------------------------------------------------------
+    #
+    var_defns_fp = expt_config["workflow"]["GLOBAL_VAR_DEFNS_FP"]
+    if manifest.changed("var_defns_exports", files=[var_defns_fp],
+                        outputs=[exports_path(var_defns_fp)]):
+        create_var_defns_exports(var_defns_fp)
 
+    phase("wflow_xml")
     #
     # -----------------------------------------------------------------------
     #
@@ -115,11 +154,14 @@ def generate_FV3LAM_wflow(
         # Call the python script to generate the experiment's XML file
         #
         rocoto_yaml_fp = expt_config["workflow"]["ROCOTO_YAML_FP"]
-        render(
-            input_file = template_xml_fp,
-            output_file = wflow_xml_fp,
-            values_src = rocoto_yaml_fp,
-            )
+        if manifest.changed("wflow_xml", files=[template_xml_fp, rocoto_yaml_fp],
+                            outputs=[wflow_xml_fp]):
+            render(
+                input_file = template_xml_fp,
+                output_file = wflow_xml_fp,
+                values_src = rocoto_yaml_fp,
+                )
+    phase("launch_script")
     #
     # -----------------------------------------------------------------------
     #
@@ -152,11 +194,13 @@ def generate_FV3LAM_wflow(
     launch_content =  template.safe_substitute(template_variables)
 
     launch_fp = os.path.join(exptdir, wflow_launch_script_fn)
-    with open(launch_fp, "w", encoding='utf-8') as expt_launch_fn:
-        expt_launch_fn.write(launch_content)
+    if manifest.changed("launch_script", inputs=launch_content, outputs=[launch_fp]):
+        with open(launch_fp, "w", encoding='utf-8') as expt_launch_fn:
+            expt_launch_fn.write(launch_content)
 
-    os.chmod(launch_fp, os.stat(launch_fp).st_mode|S_IXUSR)
+        os.chmod(launch_fp, os.stat(launch_fp).st_mode|S_IXUSR)
 
+    phase("crontab")
     #
     # -----------------------------------------------------------------------
     #
@@ -179,37 +223,40 @@ def generate_FV3LAM_wflow(
                          crontab_line=expt_config["workflow"]["CRONTAB_LINE"],
                          exptdir=exptdir,debug=debug)
 
+    phase("fix_files")
     #
     # Copy or symlink fix files
     #
-    if SYMLINK_FIX_FILES:
-        log_info(
-            f"""
-            Symlinking fixed files from system directory (FIXgsm) to a subdirectory (FIXam):
-              FIXgsm = '{FIXgsm}'
-              FIXam = '{FIXam}'""",
-            verbose=debug,
-        )
+    if manifest.changed("fixam", outputs=[FIXam], inputs=[
+            FIXgsm, FIXam, SYMLINK_FIX_FILES, FIXgsm_FILES_TO_COPY_TO_FIXam]):
+        if SYMLINK_FIX_FILES:
+            log_info(
+                f"""
+                Symlinking fixed files from system directory (FIXgsm) to a subdirectory (FIXam):
+                  FIXgsm = '{FIXgsm}'
+                  FIXam = '{FIXam}'""",
+                verbose=debug,
+            )
 
-        ln_vrfy(f"""-fsn '{FIXgsm}' '{FIXam}'""")
-    else:
+            ln_vrfy(f"""-fsn '{FIXgsm}' '{FIXam}'""")
+        else:
 
-        log_info(
-            f"""
-            Copying fixed files from system directory (FIXgsm) to a subdirectory (FIXam):
-              FIXgsm = '{FIXgsm}'
-              FIXam = '{FIXam}'""",
-            verbose=debug,
-        )
+            log_info(
+                f"""
+                Copying fixed files from system directory (FIXgsm) to a subdirectory (FIXam):
+                  FIXgsm = '{FIXgsm}'
+                  FIXam = '{FIXam}'""",
+                verbose=debug,
+            )
 
-        check_for_preexist_dir_file(FIXam, "delete")
-        mkdir_vrfy("-p", FIXam)
-        mkdir_vrfy("-p", os.path.join(FIXam, "fix_co2_proj"))
+            check_for_preexist_dir_file(FIXam, "delete")
+            mkdir_vrfy("-p", FIXam)
+            mkdir_vrfy("-p", os.path.join(FIXam, "fix_co2_proj"))
 
-        num_files = len(FIXgsm_FILES_TO_COPY_TO_FIXam)
-        for i in range(num_files):
-            fn = f"{FIXgsm_FILES_TO_COPY_TO_FIXam[i]}"
-            cp_vrfy(os.path.join(FIXgsm, fn), os.path.join(FIXam, fn))
+            num_files = len(FIXgsm_FILES_TO_COPY_TO_FIXam)
+            for i in range(num_files):
+                fn = f"{FIXgsm_FILES_TO_COPY_TO_FIXam[i]}"
+                cp_vrfy(os.path.join(FIXgsm, fn), os.path.join(FIXam, fn))
     #
     # -----------------------------------------------------------------------
     #
@@ -217,7 +264,8 @@ def generate_FV3LAM_wflow(
     #
     # -----------------------------------------------------------------------
     #
-    if USE_MERRA_CLIMO:
+    if USE_MERRA_CLIMO and manifest.changed("fixclim", outputs=[FIXclim], inputs=[
+            FIXaer, FIXlut, FIXclim, SYMLINK_FIX_FILES]):
         log_info(
             f"""
             Copying MERRA2 aerosol climatology data files from system directory
@@ -237,6 +285,7 @@ def generate_FV3LAM_wflow(
         else:
             cp_vrfy(os.path.join(FIXaer, "merra2.aerclim*.nc"), FIXclim)
             cp_vrfy(os.path.join(FIXlut, "optics*.dat"), FIXclim)
+    phase("templates")
     #
     # -----------------------------------------------------------------------
     #
@@ -255,14 +304,16 @@ def generate_FV3LAM_wflow(
         Copying the template data table file to the experiment directory...""",
         verbose=debug,
     )
-    cp_vrfy(DATA_TABLE_TMPL_FP, DATA_TABLE_FP)
+    if manifest.changed("data_table", files=[DATA_TABLE_TMPL_FP], outputs=[DATA_TABLE_FP]):
+        cp_vrfy(DATA_TABLE_TMPL_FP, DATA_TABLE_FP)
 
     log_info(
         """
         Copying the template field table file to the experiment directory...""",
         verbose=debug,
     )
-    cp_vrfy(FIELD_TABLE_TMPL_FP, FIELD_TABLE_FP)
+    if manifest.changed("field_table", files=[FIELD_TABLE_TMPL_FP], outputs=[FIELD_TABLE_FP]):
+        cp_vrfy(FIELD_TABLE_TMPL_FP, FIELD_TABLE_FP)
 
     #
     # Copy the CCPP physics suite definition file from its location in the
@@ -275,7 +326,9 @@ def generate_FV3LAM_wflow(
         the forecast model directory structure to the experiment directory...""",
         verbose=debug,
     )
-    cp_vrfy(CCPP_PHYS_SUITE_IN_CCPP_FP, CCPP_PHYS_SUITE_FP)
+    if manifest.changed("ccpp_phys_suite", files=[CCPP_PHYS_SUITE_IN_CCPP_FP],
+                        outputs=[CCPP_PHYS_SUITE_FP]):
+        cp_vrfy(CCPP_PHYS_SUITE_IN_CCPP_FP, CCPP_PHYS_SUITE_FP)
     #
     # Copy the field dictionary file from its location in the
     # clone of the FV3 code repository to the experiment directory (EXPT-
@@ -288,7 +341,9 @@ def generate_FV3LAM_wflow(
         directory...""",
         verbose=debug,
     )
-    cp_vrfy(FIELD_DICT_IN_UWM_FP, FIELD_DICT_FP)
+    if manifest.changed("field_dict", files=[FIELD_DICT_IN_UWM_FP], outputs=[FIELD_DICT_FP]):
+        cp_vrfy(FIELD_DICT_IN_UWM_FP, FIELD_DICT_FP)
+    phase("fv3_nml")
     #
     # -----------------------------------------------------------------------
     #
@@ -511,33 +566,45 @@ def generate_FV3LAM_wflow(
     # -----------------------------------------------------------------------
     #
 
-    physics_cfg = get_yaml_config(FV3_NML_YAML_CONFIG_FP)
-    base_namelist = get_nml_config(FV3_NML_BASE_SUITE_FP)
-    base_namelist.update_values(physics_cfg[CCPP_PHYS_SUITE])
-    base_namelist.update_values(settings)
-    for sect, values in base_namelist.copy().items():
-        if not values:
-            del base_namelist[sect]
-            continue
-        for k, v in values.copy().items():
-            if v is None:
-                del base_namelist[sect][k]
-    base_namelist.dump(FV3_NML_FP)
-    #
-    # If not running the TN_MAKE_GRID task (which implies the workflow will
-    # use pregenerated grid files), set the namelist variables specifying
-    # the paths to surface climatology files.  These files are located in
-    # (or have symlinks that point to them) in the FIXlam directory.
-    #
-    # Note that if running the TN_MAKE_GRID task, this action usually cannot
-    # be performed here but must be performed in that task because the names
-    # of the surface climatology files depend on the CRES parameter (which is
-    # the C-resolution of the grid), and this parameter is in most workflow
-    # configurations is not known until the grid is created.
-    #
-    if not expt_config['rocoto']['tasks'].get('task_make_grid'):
+    # The surface climatology file names set below are part of the namelist's
+    # inputs when they are set here
+    run_make_grid = bool(expt_config['rocoto']['tasks'].get('task_make_grid'))
+    sfc_climo_inputs = None
+    if not run_make_grid:
+        flat_config = flatten_dict(expt_config)
+        sfc_climo_inputs = {k: flat_config.get(k) for k in SFC_CLIMO_NEEDED_VARS}
+    fixed_files_mapping_fp = os.path.join(PARMdir, "fixed_files_mapping.yaml")
+    if manifest.changed("fv3_nml", outputs=[FV3_NML_FP],
+                        inputs=[settings, CCPP_PHYS_SUITE, sfc_climo_inputs],
+                        files=[FV3_NML_YAML_CONFIG_FP, FV3_NML_BASE_SUITE_FP,
+                               fixed_files_mapping_fp]):
+        physics_cfg = get_yaml_config(FV3_NML_YAML_CONFIG_FP)
+        base_namelist = get_nml_config(FV3_NML_BASE_SUITE_FP)
+        base_namelist.update_values(physics_cfg[CCPP_PHYS_SUITE])
+        base_namelist.update_values(settings)
+        for sect, values in base_namelist.copy().items():
+            if not values:
+                del base_namelist[sect]
+                continue
+            for k, v in values.copy().items():
+                if v is None:
+                    del base_namelist[sect][k]
+        base_namelist.dump(FV3_NML_FP)
+        #
+        # If not running the TN_MAKE_GRID task (which implies the workflow will
+        # use pregenerated grid files), set the namelist variables specifying
+        # the paths to surface climatology files.  These files are located in
+        # (or have symlinks that point to them) in the FIXlam directory.
+        #
+        # Note that if running the TN_MAKE_GRID task, this action usually cannot
+        # be performed here but must be performed in that task because the names
+        # of the surface climatology files depend on the CRES parameter (which is
+        # the C-resolution of the grid), and this parameter is in most workflow
+        # configurations is not known until the grid is created.
+        #
+        if not run_make_grid:
 
-        set_fv3nml_sfc_climo_filenames(flatten_dict(expt_config), debug)
+            set_fv3nml_sfc_climo_filenames(flat_config, debug)
 
     #
     # -----------------------------------------------------------------------
@@ -644,13 +711,16 @@ def generate_FV3LAM_wflow(
 
     settings_str = cfg_to_yaml_str(settings)
     #
+    phase("fv3_nml_stoch")
     #-----------------------------------------------------------------------
     #
     # Generate namelist files with stochastic physics if needed
     #
     #-----------------------------------------------------------------------
     #
-    if any((DO_SPP, DO_SPPT, DO_SHUM, DO_SKEB, DO_LSM_SPP)):
+    if any((DO_SPP, DO_SPPT, DO_SHUM, DO_SKEB, DO_LSM_SPP)) and manifest.changed(
+            "fv3_nml_stoch", inputs=settings, files=[FV3_NML_FP],
+            outputs=[FV3_NML_STOCH_FP]):
         realize(
             input_config=FV3_NML_FP,
             input_format="nml",
@@ -659,6 +729,7 @@ def generate_FV3LAM_wflow(
             update_config=get_nml_config(settings),
             )
 
+    phase("expt_config")
     #
     # -----------------------------------------------------------------------
     #
@@ -668,7 +739,10 @@ def generate_FV3LAM_wflow(
     #
     # -----------------------------------------------------------------------
     #
-    cp_vrfy(os.path.join(ushdir, EXPT_CONFIG_FN), EXPTDIR)
+    user_config_fp = os.path.join(ushdir, user_config_fn)
+    if manifest.changed("expt_config", files=[user_config_fp],
+                        outputs=[os.path.join(EXPTDIR, EXPT_CONFIG_FN)]):
+        cp_vrfy(user_config_fp, os.path.join(EXPTDIR, EXPT_CONFIG_FN))
 
     #
     # -----------------------------------------------------------------------
@@ -718,6 +792,11 @@ def generate_FV3LAM_wflow(
         )
         # pylint: enable=line-too-long
 
+    # Record the inputs of everything generated, for later updates
+    manifest.save()
+
+    write_timing_report(EXPTDIR)
+
     # If we got to this point everything was successful: move the log
     # file to the experiment directory.
     mv_vrfy(logfile, EXPTDIR)
@@ -772,6 +851,9 @@ if __name__ == "__main__":
 
     parser.add_argument('-d', '--debug', action='store_true',
                         help='Script will be run in debug mode with more verbose output')
+    parser.add_argument('-u', '--update', action='store_true',
+                        help='Update an existing experiment directory in place, regenerating '\
+                             'only the files whose inputs have changed')
     pargs = parser.parse_args()
 
     USHdir = os.path.dirname(os.path.abspath(__file__))
@@ -780,7 +862,8 @@ if __name__ == "__main__":
     # Call the generate_FV3LAM_wflow function defined above to generate the
     # experiment/workflow.
     try:
-        expt_dir = generate_FV3LAM_wflow(USHdir, wflow_logfile, pargs.debug)
+        expt_dir = generate_FV3LAM_wflow(USHdir, wflow_logfile, pargs.debug,
+                                         update=pargs.update)
     except: # pylint: disable=bare-except
         logging.exception(
             dedent(
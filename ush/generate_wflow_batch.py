@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Generates a batch of experiments, one for each of a list of user configurations, with
+``generate_FV3LAM_wflow``.
+"""
+
+# pylint: disable=invalid-name
+
+import glob
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from textwrap import dedent
+
+from python_utils import (
+    cfg_to_yaml_str,
+    load_config_file,
+    lowercase,
+)
+
+from generate_FV3LAM_wflow import generate_FV3LAM_wflow
+
+
+def load_shared_configs(ushdir, machines=()) -> None:
+    """
+    Parses the configuration files that every experiment reads. They are then
+    shared by all experiments generated in this process (or forked from it)
+    through the ``load_config_file`` cache.
+
+    Args:
+        ushdir   (str) : The full path of the ``ush/`` directory
+        machines (list): Names of the machines whose machine files to load
+    Returns:
+        None
+    """
+    parmdir = os.path.join(ushdir, os.pardir, "parm")
+    config_fps = [
+        os.path.join(ushdir, "config_defaults.yaml"),
+        os.path.join(ushdir, "constants.yaml"),
+        os.path.join(ushdir, "predef_grid_params.yaml"),
+        os.path.join(ushdir, "valid_param_vals.yaml"),
+        os.path.join(parmdir, "fixed_files_mapping.yaml"),
+        *glob.glob(os.path.join(parmdir, "wflow", "*.yaml")),
+        *[os.path.join(ushdir, "machine", f"{lowercase(m)}.yaml") for m in machines],
+    ]
+    for config_fp in config_fps:
+        if os.path.exists(config_fp):
+            load_config_file(config_fp)
+
+
+def _generate_from_config(ushdir, name, user_config, debug):
+    """
+    Generates one experiment of a batch from its user configuration dictionary.
+    The configuration and the generation log are kept in a private directory
+    until the log is moved into the experiment directory.
+
+    Returns:
+        A tuple of the experiment directory (or None) and an error message
+        (or None)
+    """
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    with tempfile.TemporaryDirectory(prefix=f"generate_{name}_") as tmp_dir:
+        user_config_fp = os.path.join(tmp_dir, "config.yaml")
+        with open(user_config_fp, "w", encoding="utf-8") as config_file:
+            config_file.write(cfg_to_yaml_str(user_config))
+        logfile = os.path.join(tmp_dir, "log.generate_FV3LAM_wflow")
+        try:
+            return generate_FV3LAM_wflow(ushdir, logfile=logfile, debug=debug,
+                                         user_config_fn=user_config_fp), None
+        except Exception as e: # pylint: disable=broad-except
+            logging.exception(f"Experiment generation failed for {name}")
+            failed_logfile = os.path.join(ushdir, f"log.generate_FV3LAM_wflow.{name}")
+            if os.path.exists(logfile):
+                shutil.move(logfile, failed_logfile)
+            return None, f"{e!r} (see {failed_logfile})"
+        finally:
+            # Each generation adds its own log file handler
+            for handler in root.handlers[len(handlers):]:
+                root.removeHandler(handler)
+                handler.close()
+
+
+def _generate_from_config_star(args):
+    return _generate_from_config(*args)
+
+
+def generate_FV3LAM_wflows(
+        ushdir,
+        user_configs: list,
+        num_workers: int = 1,
+        debug: bool = False) -> list:
+    """
+    Generates a batch of experiments, one for each of the given user configurations, without
+    writing them to ``config.yaml`` in the ``ush/`` directory. The experiments are generated in
+    parallel worker processes. Only the parsed default, machine and workflow configuration files
+    are shared between them, through the ``load_config_file`` cache; each experiment still
+    renders its own workflow XML and other templated files.
+
+    Args:
+        ushdir       (str) : The full path of the ``ush/`` directory where this script is located
+        user_configs (list): User configuration dictionaries, as would be read from ``config.yaml``
+        num_workers  (int) : The number of experiments to generate at the same time
+        debug        (bool): Enable extra output for debugging
+    Returns:
+        expt_dirs    (list): The experiment directory of each configuration, in the same order
+    Raises:
+        RuntimeError: If any of the experiments failed to generate; the others are still generated
+    """
+    names = [cfg.get("workflow", {}).get("EXPT_SUBDIR") or f"expt{i}"
+             for i, cfg in enumerate(user_configs)]
+    machines = {cfg.get("user", {}).get("MACHINE", "") for cfg in user_configs} - {""}
+    load_shared_configs(ushdir, machines)
+
+    tasks = [(ushdir, name, cfg, debug) for name, cfg in zip(names, user_configs)]
+    if num_workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(num_workers, len(tasks)),
+                                  initializer=load_shared_configs,
+                                  initargs=(ushdir, machines)) as pool:
+            results = pool.map(_generate_from_config_star, tasks, chunksize=1)
+    else:
+        results = [_generate_from_config(*task) for task in tasks]
+
+    failures = [f"  {name}: {error}" for name, (_, error) in zip(names, results) if error]
+    if failures:
+        raise RuntimeError(dedent(
+            f"""
+            Experiment generation failed for {len(failures)} of {len(tasks)} experiment(s):
+            """) + "\n".join(failures))
+    return [expt_dir for expt_dir, _ in results]
@@ -3,6 +3,9 @@
 import os
 import sys
 import argparse
+import fcntl
+import functools
+import tempfile
 from datetime import datetime
 from python_utils import (
     log_info,
@@ -58,6 +61,26 @@ def get_crontab_contents(called_from_cron, machine, debug):
     return crontab_cmd, crontab_contents
 
 
+def _with_crontab_lock(func):
+    """
+    Serializes read-modify-write updates of the user's cron table, e.g. when several
+    experiments are generated at the same time.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        lock_fp = os.path.join(tempfile.gettempdir(), f"srw_crontab.{os.getuid()}.lock")
+        with open(lock_fp, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return wrapper
+
+
+@_with_crontab_lock
 def add_crontab_line(called_from_cron, machine, crontab_line, exptdir, debug) -> None:
     """Adds crontab line to cron table
 
@@ -133,6 +156,7 @@ def add_crontab_line(called_from_cron, machine, crontab_line, exptdir, debug) ->
         )
 
 
+@_with_crontab_lock
 def delete_crontab_line(called_from_cron, machine, crontab_line, debug) -> None:
     """Deletes crontab line after job is complete i.e., either SUCCESS/FAILURE
     but not IN PROGRESS status
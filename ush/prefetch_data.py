@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+This script runs alongside a real-time experiment and prefetches external model files for its 
+upcoming cycles into the shared cache used by ``retrieve_data.py`` (``--cache_dir``, or 
+``EXTRN_MDL_CACHE_DIR`` in the workflow). When the ``get_extrn_ics`` and ``get_extrn_lbcs`` 
+tasks run, the files they need are already in the cache, so staging them is a local link 
+operation instead of a download.
+
+The cycles are those produced by ``set_cycle_dates()`` for ``--date_first_cycl``, 
+``--date_last_cycl`` and ``--incr_cycl_freq``. The script polls the ``download`` data stores for 
+the next ``--lookahead`` cycles at once, and stages each file as soon as it appears upstream. 
+Files are located with the same ``--config`` file and command line arguments as 
+``retrieve_data.py``, so the cache keys match those the tasks will look up.
+
+This script never evicts entries from the cache: doing so could remove files it has just 
+prefetched, before the tasks that need them run. The cache is kept to its size limit by 
+``retrieve_data.py`` (``--cache_size_gb``).
+
+To see usage for this script:
+
+  .. code-block::
+  
+    python prefetch_data.py -h
+
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import retrieve_data
+from set_cycle_dates import set_cycle_dates
+
+
+class Prefetcher:
+
+    """
+    Polls the data stores for the files of upcoming cycles, and stages them into the shared cache.
+
+    Polling is driven by an ``asyncio`` event loop, so that many cycles can wait on upstream data 
+    at once. The transfers themselves run on a pool of worker threads with ``HTTPTransfer``.
+
+    Args:
+        cla (str): Command line arguments (Namespace object)
+    """
+
+    def __init__(self, cla):
+        self.cla = cla
+        self.known_data_info = cla.config.get(cla.data_type, {})
+        self.cache = retrieve_data.FileCache(cla.cache_dir)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, cla.num_workers))
+        self.transfers = {}
+        self.staged = 0
+
+    def candidates(self, cycle_date):
+
+        """
+        Renders the files needed for a cycle, using the ``download`` data stores only.
+
+        Args:
+            cycle_date (datetime.datetime): Cycle date used to fill in the templates
+
+        Returns:
+            A dict mapping each (member, forecast hour) pair to a list of options in priority 
+            order. Each option is a tuple (data_store, urls) of files that, together, satisfy 
+            the pair.
+        """
+
+        cycle_cla = argparse.Namespace(**{**vars(self.cla), "cycle_date": cycle_date})
+        pairs = {}
+        for data_store in self.cla.data_stores:
+            store_specs = self.known_data_info.get(data_store, {})
+            if store_specs.get("protocol") != "download":
+                logging.debug(f"Not prefetching from {data_store}")
+                continue
+            plan = retrieve_data.plan_data_store(cycle_cla, self.known_data_info, data_store)
+            options = {}
+            for file in plan["files"]:
+                option = options.setdefault(
+                    (file["member"], file["fcst_hr"], file["priority"]), []
+                )
+                option.append(file["source"])
+            for (mem, fcst_hr, _), urls in options.items():
+                pairs.setdefault((mem, fcst_hr), []).append((data_store, urls))
+        return pairs
+
+    def _transfer(self, data_store):
+        if data_store not in self.transfers:
+            store_specs = self.known_data_info.get(data_store, {})
+            self.transfers[data_store] = retrieve_data.HTTPTransfer(
+                num_workers=1,
+                max_per_host=self.cla.max_per_host,
+                subset=retrieve_data.get_grib2_subset(self.cla, store_specs),
+            )
+        return self.transfers[data_store]
+
+    def _key(self, data_store, url):
+        return self.cache.key(
+            self.cla.data_type,
+            data_store,
+            url,
+            self._transfer(data_store).subset,
+        )
+
+    def stage_file(self, data_store, url):
+
+        """
+        Downloads a single file into the cache, unless it is already there.
+
+        Returns:
+            Boolean value reflecting whether the file is in the cache
+        """
+
+        key = self._key(data_store, url)
+        if key in self.cache:
+            return True
+        with tempfile.TemporaryDirectory(dir=self.cla.cache_dir) as staging_dir:
+            if not self._transfer(data_store).fetch(url, staging_dir):
+                return False
+            self.cache.insert(
+                key, os.path.join(staging_dir, os.path.basename(url)), link=True
+            )
+        logging.info(f"Prefetched {url}")
+        self.staged += 1
+        return True
+
+    async def stage_pair(self, options):
+
+        """
+        Stages the files for one member and forecast hour, trying the options in priority order.
+
+        Returns:
+            Boolean value reflecting whether all files of one of the options are in the cache
+        """
+
+        loop = asyncio.get_running_loop()
+        for data_store, urls in options:
+            staged = await asyncio.gather(
+                *(
+                    loop.run_in_executor(self.executor, self.stage_file, data_store, url)
+                    for url in urls
+                )
+            )
+            if all(staged):
+                return True
+        return False
+
+    async def prefetch_cycle(self, cycle_date):
+
+        """
+        Polls the data stores until all files of a cycle are in the cache. With ``--once``, or 
+        when the cycle is older than ``--max_age_hrs``, it gives up instead of polling again.
+
+        Returns:
+            Boolean value reflecting whether all files of the cycle are in the cache
+        """
+
+        pending = self.candidates(cycle_date)
+        while True:
+            staged = await asyncio.gather(
+                *(self.stage_pair(options) for options in pending.values())
+            )
+            pending = {
+                pair: options
+                for (pair, options), done in zip(pending.items(), staged)
+                if not done
+            }
+            if not pending:
+                logging.info(f"All files for {cycle_date:%Y%m%d%H} are in the cache")
+                return True
+            if self.cla.once or self.expired(cycle_date):
+                logging.warning(
+                    f"Files for {len(pending)} member/forecast hour pairs of "
+                    f"{cycle_date:%Y%m%d%H} are not available yet"
+                )
+                return False
+            logging.debug(f"Waiting for {len(pending)} pairs of {cycle_date:%Y%m%d%H}")
+            await asyncio.sleep(self.cla.poll_interval)
+
+    def expired(self, cycle_date):
+
+        """Returns whether a cycle is older than ``--max_age_hrs``, if it is set."""
+
+        if self.cla.max_age_hrs is None:
+            return False
+        age = dt.datetime.utcnow() - cycle_date
+        return age > dt.timedelta(hours=self.cla.max_age_hrs)
+
+    async def run(self, cycle_dates):
+
+        """
+        Prefetches the given cycles in order, working on up to ``--lookahead`` cycles at once.
+
+        Returns:
+            A list of the cycles that could not be prefetched completely
+        """
+
+        queue = [cycle_date for cycle_date in cycle_dates if not self.expired(cycle_date)]
+        if self.cla.once:
+            queue = queue[: self.cla.lookahead]
+
+        incomplete = []
+        active = {}
+        while queue or active:
+            while queue and len(active) < self.cla.lookahead:
+                cycle_date = queue.pop(0)
+                active[asyncio.create_task(self.prefetch_cycle(cycle_date))] = cycle_date
+            done, _ = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                cycle_date = active.pop(task)
+                if not task.result():
+                    incomplete.append(cycle_date)
+        self.executor.shutdown()
+        return sorted(incomplete)
+
+
+def main(argv):
+
+    """
+    Prefetches the files for all requested cycles into the cache.
+
+    Args:
+        argv (list): List of command line arguments
+    """
+
+    cla = parse_args(argv)
+    retrieve_data._setup_logging(cla.debug)  # pylint: disable=protected-access
+
+    cycle_dates = [
+        dt.datetime.strptime(cdate, "%Y%m%d%H")
+        - dt.timedelta(hours=cla.offset_hrs)
+        for cdate in set_cycle_dates(
+            cla.date_first_cycl, cla.date_last_cycl, cla.incr_cycl_freq
+        )
+    ]
+
+    prefetcher = Prefetcher(cla)
+    incomplete = asyncio.run(prefetcher.run(cycle_dates))
+    logging.info(f"Prefetched {prefetcher.staged} files into {cla.cache_dir}")
+
+    if incomplete:
+        logging.error(
+            "Files are missing for cycles: "
+            f"{[f'{cycle_date:%Y%m%d%H}' for cycle_date in incomplete]}"
+        )
+        sys.exit(1)
+
+
+def parse_args(argv):
+
+    """
+    Maintains the arguments accepted by this script. Arguments that are shared with 
+    ``retrieve_data.py`` have the same meaning.
+
+    Args:
+        argv (list): Command line arguments to parse
+
+    Returns:
+        args: An argparse.Namespace object (``parser.parse_args(argv)``)
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Prefetch external model files for upcoming cycles into a shared cache.",
+    )
+
+    # Required
+    parser.add_argument(
+        "--cache_dir",
+        help="Path to the shared cache of retrieved files, as used by \
+        retrieve_data.py",
+        required=True,
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--config",
+        help="Full path to a configuration file containing paths and \
+        naming conventions for known data streams.",
+        required=True,
+        type=retrieve_data.config_exists,
+    )
+    parser.add_argument(
+        "--data_stores",
+        help="List of priority data_stores. Only data stores that use \
+        the download protocol are polled.",
+        nargs="*",
+        required=True,
+        type=retrieve_data.to_lower,
+    )
+    parser.add_argument(
+        "--data_type",
+        help="External model label. This input is case-sensitive",
+        required=True,
+    )
+    parser.add_argument(
+        "--date_first_cycl",
+        help="First cycle date of the experiment in YYYYMMDDHH format.",
+        required=True,
+        type=retrieve_data.to_datetime,
+    )
+    parser.add_argument(
+        "--date_last_cycl",
+        help="Last cycle date of the experiment in YYYYMMDDHH format.",
+        required=True,
+        type=retrieve_data.to_datetime,
+    )
+    parser.add_argument(
+        "--file_set",
+        choices=("anl", "fcst"),
+        help="Flag for whether analysis or forecast files should be gathered",
+        required=True,
+    )
+    parser.add_argument(
+        "--ics_or_lbcs",
+        choices=("ICS", "LBCS"),
+        help="Flag for whether ICS or LBCS.",
+        required=True,
+    )
+
+    # Optional
+    parser.add_argument(
+        "--incr_cycl_freq",
+        help="Increment in hours between cycles. default=24",
+        default=24,
+        type=int,
+    )
+    parser.add_argument(
+        "--offset_hrs",
+        help="Number of hours by which the external model cycle precedes \
+        the experiment cycle, e.g., EXTRN_MDL_LBCS_OFFSET_HRS. default=0",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--fcst_hrs",
+        help="A list describing forecast hours, as for retrieve_data.py. \
+        default=[0]",
+        nargs="+",
+        default=[0],
+        type=int,
+    )
+    parser.add_argument(
+        "--members",
+        help="A list describing ensemble members, as for retrieve_data.py.",
+        nargs="*",
+        type=int,
+    )
+    parser.add_argument(
+        "--file_fmt",
+        choices=("grib2", "nemsio", "netcdf", "prepbufr", "tcvitals"),
+        help="External model file format",
+    )
+    parser.add_argument(
+        "--lookahead",
+        help="Number of upcoming cycles to poll for at once. default=2",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--poll_interval",
+        help="Seconds to wait between polls of a data store for files \
+        that are not available yet. default=300",
+        default=300,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_age_hrs",
+        help="Stop polling for a cycle once it is this many hours in the \
+        past (UTC). By default, poll until all files are available.",
+        type=float,
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Poll once for the next --lookahead cycles and exit, e.g., \
+        when run from cron.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        help="Number of files to download concurrently. default=4",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--max_per_host",
+        help="Maximum number of simultaneous downloads from any one host. \
+        default=4",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Print debug messages",
+    )
+
+    args = parser.parse_args(argv)
+
+    # Fill in the attributes that retrieve_data.py uses to locate files
+    args.fcst_hrs = retrieve_data.arg_list_to_range(args.fcst_hrs)
+    if args.members:
+        args.members = retrieve_data.arg_list_to_range(args.members)
+    args.output_path = args.cache_dir
+    args.input_file_path = None
+    args.file_templates = None
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
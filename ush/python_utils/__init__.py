@@ -1,4 +1,15 @@
+"""
+Utilities shared by the workflow scripts. The submodules that import heavy
+dependencies (yaml, jinja2, xml) are only imported when one of their names
+is first used (PEP 562), so that short-lived tools don't pay for them.
+"""
+
+import importlib
+import sys
+from typing import TYPE_CHECKING
+
 from .misc import uppercase, lowercase, find_pattern_in_str, find_pattern_in_file
+from .artifact_manifest import ArtifactManifest
 from .check_for_preexist_dir_file import check_for_preexist_dir_file
 from .check_var_valid_value import check_var_valid_value
 from .create_symlink_to_file import create_symlink_to_file
@@ -27,25 +38,82 @@ from .filesys_cmds_vrfy import (
 from .print_input_args import print_input_args
 from .print_msg import print_info_msg, print_err_msg_exit, log_info
 from .run_command import run_command
-from .xml_parser import load_xml_file, has_tag_with_value
-from .config_parser import (
-    load_json_config,
-    cfg_to_json_str,
-    load_ini_config,
-    cfg_to_ini_str,
-    get_ini_value,
-    load_config_file,
-    load_shell_config,
-    cfg_to_shell_str,
-    load_xml_config,
-    cfg_to_xml_str,
-    flatten_dict,
-    structure_dict,
-    check_structure_dict,
-    update_dict,
-    cfg_main,
-    load_config_file,
-    load_yaml_config,
-    cfg_to_yaml_str,
-    extend_yaml,
-)
+from .timing import start_timing, timing_enabled, span, timed, phase, write_timing_report
+
+if TYPE_CHECKING:
+    from .check_valid_values import load_valid_values, check_valid_values
+    from .xml_parser import load_xml_file, has_tag_with_value
+    from .config_parser import (
+        load_json_config,
+        cfg_to_json_str,
+        load_ini_config,
+        cfg_to_ini_str,
+        get_ini_value,
+        load_config_file,
+        load_shell_config,
+        cfg_to_shell_str,
+        load_xml_config,
+        cfg_to_xml_str,
+        flatten_dict,
+        structure_dict,
+        check_structure_dict,
+        update_dict,
+        cfg_main,
+        load_yaml_config,
+        cfg_to_yaml_str,
+        extend_yaml,
+        resolve_config,
+    )
+
+# Names imported on first use, by submodule; keep in step with the
+# TYPE_CHECKING imports above
+_LAZY_EXPORTS = {
+    "check_valid_values": ["load_valid_values", "check_valid_values"],
+    "xml_parser": ["load_xml_file", "has_tag_with_value"],
+    "config_parser": [
+        "load_json_config",
+        "cfg_to_json_str",
+        "load_ini_config",
+        "cfg_to_ini_str",
+        "get_ini_value",
+        "load_config_file",
+        "load_shell_config",
+        "cfg_to_shell_str",
+        "load_xml_config",
+        "cfg_to_xml_str",
+        "flatten_dict",
+        "structure_dict",
+        "check_structure_dict",
+        "update_dict",
+        "cfg_main",
+        "load_yaml_config",
+        "cfg_to_yaml_str",
+        "extend_yaml",
+        "resolve_config",
+    ],
+}
+
+_MODULE_OF = {name: module for module, names in _LAZY_EXPORTS.items() for name in names}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        module = importlib.import_module(f".{name}", __name__)
+    elif name in _MODULE_OF:
+        module = importlib.import_module(f".{_MODULE_OF[name]}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    # Importing a submodule binds it as an attribute of this package, which
+    # hides functions of the same name (e.g. check_valid_values); bind the
+    # functions of every loaded submodule instead.
+    for submodule, names in _LAZY_EXPORTS.items():
+        loaded = sys.modules.get(f"{__name__}.{submodule}")
+        if loaded is not None:
+            for export in names:
+                globals()[export] = getattr(loaded, export)
+    return globals().get(name, module)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULE_OF))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Keeps track of the inputs that each file generated in an experiment directory
+was created from, so that regenerating an experiment can skip the files whose
+inputs have not changed.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+
+from .print_msg import log_info
+
+
+class ArtifactManifest:
+    """A record of the inputs of each artifact generated in an experiment directory
+
+    Each artifact is identified by a name and a digest of its inputs: a JSON-
+    serializable description (usually a subset of the experiment configuration)
+    and the contents of any input files. The digests are saved to
+    ``.generate_manifest.json`` in the experiment directory once generation
+    completes.
+
+    Args:
+        update (bool): If ``True``, artifacts whose inputs match the saved manifest
+                       are reported as unchanged; otherwise every artifact is
+                       regenerated and the manifest is rewritten
+    """
+
+    FN = ".generate_manifest.json"
+
+    def __init__(self, update=False):
+        self.update = update
+        self.exptdir = None
+        self.previous = {}
+        self.current = {}
+        self.regenerated = []
+        self.unchanged = []
+
+    def load(self, exptdir):
+        """Reads the manifest saved in an experiment directory, if any
+
+        Args:
+            exptdir (str): Path to the experiment directory
+        Returns:
+            None
+        """
+        self.exptdir = exptdir
+        manifest_fp = os.path.join(exptdir, self.FN)
+        if self.update and os.path.exists(manifest_fp):
+            with open(manifest_fp, "r", encoding="utf-8") as manifest_file:
+                self.previous = json.load(manifest_file)
+
+    @staticmethod
+    def digest(inputs=None, files=()):
+        """Returns a digest of an artifact's inputs
+
+        Args:
+            inputs:       A JSON-serializable description of the inputs
+            files (list): Paths to input files, whose contents are hashed
+        Returns:
+            A hex digest string
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+        for path in files:
+            sha.update(path.encode())
+            if os.path.isfile(path):
+                with open(path, "rb") as input_file:
+                    for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                        sha.update(chunk)
+        return sha.hexdigest()
+
+    def changed(self, name, inputs=None, files=(), outputs=()):
+        """Checks whether an artifact needs to be (re)generated
+
+        An artifact needs to be generated unless running in update mode, its
+        inputs match those it was last generated from, and all of its outputs
+        still exist.
+
+        Args:
+            name    (str) : Name of the artifact
+            inputs        : A JSON-serializable description of the inputs
+            files   (list): Paths to input files
+            outputs (list): Paths to the files or directories the artifact creates
+        Returns:
+            ``True`` if the artifact needs to be generated
+        """
+        entry = {"digest": self.digest(inputs, files)}
+        previous = self.previous.get(name, {})
+        if (self.update and previous.get("digest") == entry["digest"]
+                and all(os.path.lexists(path) for path in outputs)):
+            self.current[name] = previous
+            self.unchanged.append(name)
+            return False
+        self.current[name] = entry
+        self.regenerated.append(name)
+        return True
+
+    def set_result(self, name, result):
+        """Saves a JSON-serializable value computed while generating an artifact, for
+        use by later updates that skip it"""
+        self.current[name]["result"] = result
+
+    def result(self, name):
+        """Returns the value saved with ``set_result`` for an artifact"""
+        return self.current[name].get("result")
+
+    def save(self):
+        """Writes the manifest to the experiment directory and reports what was regenerated
+
+        Returns:
+            None
+        """
+        manifest_fp = os.path.join(self.exptdir, self.FN)
+        manifest = {
+            name: {**entry, "updated": entry.get("updated") or
+                   datetime.datetime.now().isoformat(timespec="seconds")}
+            for name, entry in self.current.items()
+        }
+        with open(manifest_fp, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+        if self.update:
+            log_info(
+                f"""
+                Regenerated {len(self.regenerated)} artifact(s) with changed inputs:
+                  {", ".join(self.regenerated) or "none"}
+                Left {len(self.unchanged)} unchanged artifact(s) in place:
+                  {", ".join(self.unchanged) or "none"}"""
+            )
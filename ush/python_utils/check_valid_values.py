@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Checks an experiment configuration against the valid values listed in
+``valid_param_vals.yaml``.
+"""
+
+import collections
+import os
+from textwrap import dedent
+
+from .config_parser import load_config_file
+
+ValidValues = collections.namedtuple("ValidValues", ["allowed", "listed", "paths"])
+ValidValues.__doc__ = """The valid values of the variables in an experiment configuration
+
+    allowed (dict): The set of valid values of each variable, by variable name
+    listed  (dict): The valid values of each variable as listed in the file, for messages
+    paths  (tuple): The key paths, e.g. ``("workflow", "PREDEF_GRID_NAME")``, of the
+                    variables in the default configuration files that have valid values
+"""
+
+_PREFIX = "valid_vals_"
+
+# Valid values by the paths and stats of the files they were built from
+_VALID_VALUES = {}
+
+
+def _key_paths(cfg, parent=()):
+    for key, value in cfg.items():
+        if isinstance(value, dict):
+            yield from _key_paths(value, parent + (key,))
+        else:
+            yield parent + (key,)
+
+
+def load_valid_values(valid_vals_fp, *config_fps):
+    """Builds the valid values of the variables in an experiment configuration
+
+    The result is kept for as long as none of the files change, so
+    experiments generated in the same process share it.
+
+    Args:
+        valid_vals_fp (str): Path to ``valid_param_vals.yaml``
+        config_fps    (str): Paths to the default configuration files (e.g.
+                             ``config_defaults.yaml``), which define where in the
+                             configuration each variable is set
+    Returns:
+        A ``ValidValues`` tuple
+    """
+    key = tuple(
+        (os.path.realpath(fp), os.stat(fp).st_mtime_ns, os.stat(fp).st_size)
+        for fp in (valid_vals_fp, *config_fps)
+    )
+    if key not in _VALID_VALUES:
+        listed = {
+            name[len(_PREFIX):]: values
+            for name, values in load_config_file(valid_vals_fp).items()
+            if name.startswith(_PREFIX)
+        }
+        allowed = {name: frozenset(values) for name, values in listed.items()}
+        paths = tuple(
+            path
+            for config_fp in config_fps
+            for path in _key_paths(load_config_file(config_fp))
+            if path[-1] in allowed
+        )
+        _VALID_VALUES[key] = ValidValues(allowed, listed, paths)
+    return _VALID_VALUES[key]
+
+
+def _is_valid(value, allowed):
+    try:
+        return value in allowed
+    except TypeError:
+        # Unhashable values (e.g. dicts) can't be among the valid values
+        return False
+
+
+def check_valid_values(cfg, valid_values):
+    """Checks the variables of a configuration against their valid values
+
+    Only the variables at the paths in ``valid_values`` are checked; unset
+    (``None`` or empty) variables are skipped. Every element of a list must
+    be valid.
+
+    Args:
+        cfg                (dict): The experiment configuration
+        valid_values (ValidValues): The valid values, from ``load_valid_values``
+    Returns:
+        A list of messages, one per variable with an invalid value; empty if all
+        values are valid
+    """
+    errors = []
+    for path in valid_values.paths:
+        value = cfg
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            if value is None or value == "":
+                continue
+            name = path[-1]
+            allowed = valid_values.allowed[name]
+            if isinstance(value, list):
+                if all(_is_valid(ele, allowed) for ele in value):
+                    continue
+                problem = "has at least one invalid value"
+            elif _is_valid(value, allowed):
+                continue
+            else:
+                problem = "does not have a valid value"
+            errors.append(
+                dedent(f"""
+                The variable
+                    {name} = {value}
+                in the user's configuration {problem}.  Possible values are:
+                    {name} = {valid_values.listed[name]}"""
+                )
+            )
+    return errors
@@ -16,17 +16,23 @@ returned by ``load_config`` to make queries.
 """
 
 import argparse
+import collections
 import configparser
+import copy
 import datetime
+import functools
+import hashlib
 import json
 import os
 import pathlib
+import pickle
 import re
+import tempfile
 from textwrap import dedent
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 
-import jinja2
+# Note: jinja2 and xml.dom.minidom are imported where they are used, so
+# that tools that only load configs don't pay for importing them.
 #
 # Note: yaml may not be available in which case we suppress
 # the exception, so that we can have other functionality
@@ -39,24 +45,140 @@ except ModuleNotFoundError:
 
 from .environment import list_to_str, str_to_list, str_to_type
 from .run_command import run_command
+from .timing import timed
 
 ##########
 # YAML
 ##########
+# Tags whose constructed value depends on the clock, the environment or
+# other files. Files using them are cached as a composed node graph and
+# constructed anew on every load.
+_DYNAMIC_TAGS = ("!include", "!nowtimestamp", "!startstopfreq")
+
+# Bump whenever a custom constructor changes, so that stale pickles in the
+# on-disk cache are ignored.
+_YAML_CACHE_VERSION = 1
+
+# Parsed YAML files keyed by real path; values are ((mtime_ns, size), entry)
+_YAML_CACHE = {}
+
+
+def _yaml_cache_dir():
+    """
+    Returns the directory of the on-disk parsed-config cache, or None if it
+    has been disabled by setting ``SRW_CONFIG_CACHE_DIR`` to an empty string.
+    """
+
+    cache_dir = os.environ.get("SRW_CONFIG_CACHE_DIR")
+    if cache_dir is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        cache_dir = os.path.join(cache_home, "srw_app", "configs")
+    return cache_dir or None
+
+
+def _yaml_cache_path(digest):
+    cache_dir = _yaml_cache_dir()
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, f"{digest}.v{_YAML_CACHE_VERSION}.pickle")
+
+
+def _read_yaml_cache(digest):
+    """
+    Returns the pickled parse of the file with the given content hash, or
+    None on a cache miss.
+    """
+
+    cache_path = _yaml_cache_path(digest)
+    if cache_path is None:
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _write_yaml_cache(digest, cfg):
+    """
+    Pickles a parsed config into the on-disk cache. The cache is only an
+    optimization, so any failure (e.g. a read-only home directory) is ignored.
+    """
+
+    cache_path = _yaml_cache_path(digest)
+    if cache_path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(cfg, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+
+def _parse_yaml(contents):
+    """
+    Parses the raw contents of a YAML file into a cache entry: either
+    ("node", composed node) for files using dynamic tags, or
+    ("data", constructed object) for everything else.
+    """
+
+    text = contents.decode("utf-8")
+    if any(tag in text for tag in _DYNAMIC_TAGS):
+        loader = _YamlLoader(text)
+        try:
+            return "node", loader.get_single_node()
+        finally:
+            loader.dispose()
+
+    digest = hashlib.sha256(contents).hexdigest()
+    cfg = _read_yaml_cache(digest)
+    if cfg is None:
+        cfg = yaml.load(text, Loader=_YamlLoader)
+        _write_yaml_cache(digest, cfg)
+    return "data", cfg
+
+
 def load_yaml_config(config_file):
     """
     Safe loads a YAML file
 
+    Parsed files are cached in-process, keyed by path, modification time and
+    size, and on disk, keyed by a hash of their contents (see
+    ``SRW_CONFIG_CACHE_DIR``). Every call returns a fresh object that the
+    caller is free to modify.
+
     Args:
         config_file: Configuration file to parse
     Returns:
         cfg: A Python object containing the config file data
     """
 
-    with open(config_file, "r") as f:
-        cfg = yaml.safe_load(f)
-
-    return cfg
+    path = os.path.realpath(config_file)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _YAML_CACHE.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, "rb") as f:
+            contents = f.read()
+        cached = (stamp, _parse_yaml(contents))
+        _YAML_CACHE[path] = cached
+
+    kind, value = cached[1]
+    if kind == "data":
+        return copy.deepcopy(value)
+    if value is None:
+        return None
+    loader = _YamlLoader("")
+    try:
+        return loader.construct_document(value)
+    finally:
+        loader.dispose()
 
 
 try:
@@ -118,8 +240,7 @@ def include(filepaths):
         abs_path = filepath
         if not os.path.isabs(filepath):
             abs_path = os.path.join(os.path.dirname(srw_path), filepath)
-        with open(abs_path, 'r') as fp:
-            contents = yaml.load(fp, Loader=yaml.SafeLoader)
+        contents = load_yaml_config(abs_path)
         for key, value in contents.items():
             cfg[key] = value
     return yaml.dump(cfg, sort_keys=False)
@@ -150,11 +271,16 @@ def _nowtimestamp(loader, node):
     return "id_" + str(int(datetime.datetime.now().timestamp()))
 
 try:
-    yaml.add_constructor("!cycstr", cycstr, Loader=yaml.SafeLoader)
-    yaml.add_constructor("!include", include, Loader=yaml.SafeLoader)
-    yaml.add_constructor("!join_str", join_str, Loader=yaml.SafeLoader)
-    yaml.add_constructor("!startstopfreq", startstopfreq, Loader=yaml.SafeLoader)
-    yaml.add_constructor("!nowtimestamp", _nowtimestamp ,Loader=yaml.SafeLoader)
+    # Use the libyaml-backed loader where available; it is an order of
+    # magnitude faster than the pure Python one.
+    _YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+    for _loader in {yaml.SafeLoader, _YamlLoader}:
+        yaml.add_constructor("!cycstr", cycstr, Loader=_loader)
+        yaml.add_constructor("!include", include, Loader=_loader)
+        yaml.add_constructor("!join_str", join_str, Loader=_loader)
+        yaml.add_constructor("!startstopfreq", startstopfreq, Loader=_loader)
+        yaml.add_constructor("!nowtimestamp", _nowtimestamp, Loader=_loader)
 except NameError:
     pass
 
@@ -176,10 +302,152 @@ def days_ago(arg):
     return (datetime.date.today() -
             datetime.timedelta(days=arg)).strftime("%Y%m%d00")
 
+# Separates out all the double curly bracket pairs in a string
+_TEMPLATE_RE = re.compile(r"{{[^}]*}}")
+
+
+@functools.lru_cache(maxsize=None)
+def _jinja_env():
+    """
+    Returns the Jinja2 environment used to render config templates. It is
+    created, and its filters registered, only once.
+    """
+
+    import jinja2  # pylint: disable=import-outside-toplevel
+
+    j2env = jinja2.Environment(
+        loader=jinja2.BaseLoader, undefined=jinja2.StrictUndefined
+    )
+    j2env.filters["path_join"] = path_join
+    j2env.filters["days_ago"] = days_ago
+    j2env.filters["include"] = include
+    return j2env
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_template(template):
+    """
+    Returns the compiled Jinja2 template for a template string. Compiled
+    templates are cached by their source, since the same fragments appear
+    in many values and across repeated passes of ``extend_yaml``.
+    """
+
+    return _jinja_env().from_string(template)
+
+
+def _render_template(j2tmpl, context):
+    """
+    Renders a compiled template with a prebuilt context mapping, without
+    the copy that ``Template.render(**kwargs)`` makes for each call.
+    """
+
+    j2ctx = j2tmpl.new_context(context, shared=True)
+    return j2tmpl.environment.concat(j2tmpl.root_render_func(j2ctx))
+
+
+def _render_context(yaml_dict, full_dict, parent):
+    """
+    Returns the render context for the values of ``yaml_dict``: a live view
+    of the dict itself, the full config, and ``parent``, so that values
+    filled earlier are seen by later ones.
+
+    Names in both the dict and the full config (always the case at the top
+    level) can't be passed to a template unambiguously, so ``None`` is
+    returned for such a dict, and its templates are left as-is.
+    """
+
+    if (
+        yaml_dict.keys() & full_dict.keys()
+        or "parent" in yaml_dict
+        or "parent" in full_dict
+    ):
+        return None
+    return collections.ChainMap(
+        {"parent": parent}, yaml_dict, full_dict, _jinja_env().globals
+    )
+
+
+def _render_value(k, v, context):
+    """
+    Renders the Jinja2 templates in a single value with the given context,
+    and returns the result. Templates that can't be filled are left as-is.
+    ``ET.Element`` values have their text replaced in place.
+    """
+
+    # Save a bit of compute and only do this part for strings that
+    # contain the jinja double brackets.
+    v_str = str(v.text) if isinstance(v, ET.Element) else str(v)
+    if isinstance(v, ET.Element):
+        print('ELEMENT VSTR', v_str, v.text)
+    is_a_template = any((ele for ele in ["{{", "{%"] if ele in v_str))
+    if not is_a_template:
+        return v
+
+    from jinja2.exceptions import UndefinedError  # pylint: disable=import-outside-toplevel
+
+    # Find expressions first, and process them as a single template
+    # if they exist
+    # Find individual double curly brace template in the string
+    # otherwise. We need one substitution template at a time so that
+    # we can opt to leave some un-filled when they are not yet set.
+    # For example, we can save cycle-dependent templates to fill in
+    # at run time.
+    if "{%" in v_str:
+        templates = [v_str]
+    else:
+        templates = _TEMPLATE_RE.findall(v_str)
+    data = []
+    for template in templates:
+        try:
+            j2tmpl = _compile_template(template)
+        except:
+            print(f"ERROR filling template: {template}, {v_str}")
+            raise
+        if context is not None:
+            try:
+                # Fill in a template that has the appropriate variables
+                # set.
+                template = _render_template(j2tmpl, context)
+            except UndefinedError:
+                # Leave a templated field as-is in the resulting dict
+                pass
+            except ValueError:
+                pass
+            except TypeError:
+                pass
+            except ZeroDivisionError:
+                pass
+            except:
+                print(f"{k}: {template}")
+                raise
+
+        data.append(template)
+
+    convert_type = True
+    for tmpl, rendered in zip(templates, data):
+        v_str = v_str.replace(tmpl, rendered)
+        if "string" in tmpl:
+            convert_type = False
+
+    if convert_type:
+        v_str = str_to_type(v_str, return_string=2)
+
+    if isinstance(v, ET.Element):
+        print('Replacing ET text with', v_str)
+        v.text = v_str
+        return v
+    return v_str
+
+
+@timed
 def extend_yaml(yaml_dict, full_dict=None, parent=None):
     """
     Updates ``yaml_dict`` in place by rendering any existing Jinja2 templates
     that exist in a value.
+
+    This makes a single pass over the config, so values that reference other
+    templated values may need more than one pass. ``resolve_config`` renders
+    everything in dependency order instead.
     """
 
     if full_dict is None:
@@ -191,6 +459,8 @@ def extend_yaml(yaml_dict, full_dict=None, parent=None):
     if not isinstance(yaml_dict, dict):
         return
 
+    context = _render_context(yaml_dict, full_dict, parent)
+
     for k, val in yaml_dict.items():
 
         if isinstance(val, dict):
@@ -201,77 +471,271 @@ def extend_yaml(yaml_dict, full_dict=None, parent=None):
                 val = [val]
 
             for v_idx, v in enumerate(val):
-                # Save a bit of compute and only do this part for strings that
-                # contain the jinja double brackets.
-                v_str = str(v.text) if isinstance(v, ET.Element) else str(v)
-                if isinstance(v, ET.Element):
-                    print('ELEMENT VSTR', v_str, v.text, yaml_dict)
-                is_a_template = any((ele for ele in ["{{", "{%"] if ele in v_str))
-                if is_a_template:
-                    # Find expressions first, and process them as a single template
-                    # if they exist
-                    # Find individual double curly brace template in the string
-                    # otherwise. We need one substitution template at a time so that
-                    # we can opt to leave some un-filled when they are not yet set.
-                    # For example, we can save cycle-dependent templates to fill in
-                    # at run time.
-                    if "{%" in v_str:
-                        templates = [v_str]
-                    else:
-                        # Separates out all the double curly bracket pairs
-                        templates = [m.group() for m in
-                                re.finditer(r"{{[^}]*}}|\S", v_str)  if '{{'
-                                in m.group()]
-                    data = []
-                    for template in templates:
-                        j2env = jinja2.Environment(
-                            loader=jinja2.BaseLoader, undefined=jinja2.StrictUndefined
-                        )
-                        j2env.filters["path_join"] = path_join
-                        j2env.filters["days_ago"] = days_ago
-                        j2env.filters["include"] = include
-                        try:
-                            j2tmpl = j2env.from_string(template)
-                        except:
-                            print(f"ERROR filling template: {template}, {v_str}")
-                            raise
-                        try:
-                            # Fill in a template that has the appropriate variables
-                            # set.
-                            template = j2tmpl.render(parent=parent, **yaml_dict, **full_dict)
-                        except jinja2.exceptions.UndefinedError as e:
-                            # Leave a templated field as-is in the resulting dict
-                            pass
-                        except ValueError:
-                            pass
-                        except TypeError:
-                            pass
-                        except ZeroDivisionError:
-                            pass
-                        except:
-                            print(f"{k}: {template}")
-                            raise
-
-                        data.append(template)
-
-                    convert_type = True
-                    for tmpl, rendered in zip(templates, data):
-                        v_str = v_str.replace(tmpl, rendered)
-                        if "string" in tmpl:
-                            convert_type = False
-
-                    if convert_type:
-                        v_str = str_to_type(v_str, return_string=2)
-
-                    if isinstance(v, ET.Element):
-                        print('Replacing ET text with', v_str)
-                        v.text = v_str
-                    elif isinstance(yaml_dict[k], list):
-                        yaml_dict[k][v_idx] = v_str
-                    else:
-                        # Put the full template line back together as it was,
-                        # filled or not
-                        yaml_dict[k] = v_str
+                rendered = _render_value(k, v, context)
+                if rendered is v:
+                    continue
+                if isinstance(yaml_dict[k], list):
+                    yaml_dict[k][v_idx] = rendered
+                else:
+                    # Put the full template line back together as it was,
+                    # filled or not
+                    yaml_dict[k] = rendered
+
+
+def _is_template(v):
+    v_str = str(v.text) if isinstance(v, ET.Element) else str(v)
+    return "{{" in v_str or "{%" in v_str
+
+
+@functools.lru_cache(maxsize=4096)
+def _template_refs(source):
+    """
+    Returns the references that a template string makes to config values, as
+    tuples of names and keys, e.g., ``("workflow", "EXPTDIR")`` for
+    ``{{ workflow.EXPTDIR }}``. A reference with a computed key, or to a
+    method, stops at the last constant key.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import jinja2.meta
+    from jinja2 import nodes
+
+    ast = _jinja_env().parse(source)
+    free = jinja2.meta.find_undeclared_variables(ast)
+    refs = set()
+
+    def visit(node):
+        if isinstance(node, (nodes.Getattr, nodes.Getitem)):
+            keys = []
+            while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+                if isinstance(node, nodes.Getattr):
+                    keys.append(node.attr)
+                elif isinstance(node.arg, nodes.Const):
+                    keys.append(node.arg.value)
+                else:
+                    keys = []
+                    visit(node.arg)
+                node = node.node
+            if isinstance(node, nodes.Name):
+                if node.name in free:
+                    refs.add((node.name, *reversed(keys)))
+                return
+        elif isinstance(node, nodes.Name):
+            if node.name in free:
+                refs.add((node.name,))
+            return
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    visit(ast)
+    return tuple(sorted(refs, key=str))
+
+
+def _value_refs(v):
+    from jinja2.exceptions import TemplateSyntaxError  # pylint: disable=import-outside-toplevel
+
+    v_str = str(v.text) if isinstance(v, ET.Element) else str(v)
+    templates = [v_str] if "{%" in v_str else _TEMPLATE_RE.findall(v_str)
+    refs = set()
+    for template in templates:
+        try:
+            refs.update(_template_refs(template))
+        except TemplateSyntaxError:
+            # Reported when the value is rendered
+            pass
+    return refs
+
+
+def _path_str(path):
+    return ".".join(str(key) for key in path)
+
+
+@timed
+def resolve_config(cfg):
+    """
+    Updates ``cfg`` in place by rendering all of its Jinja2 templates in a
+    single pass, in dependency order.
+
+    Every templated value is parsed once to find the config values it
+    references, and the references form a dependency graph. Values are
+    rendered after everything they depend on, with the same context and
+    conversions as ``extend_yaml``, so that one pass gives the same result as
+    repeating ``extend_yaml`` until nothing changes. Values in a reference
+    cycle are rendered in the order they appear.
+
+    Args:
+        cfg (dict): The config to render
+    Returns:
+        A dict mapping the dotted path of each value that still contains
+        templates to the reason it could not be filled
+    """
+
+    # Find the templated values, with the dict they live in, that dict's
+    # path, and its render context
+    values = []
+    contexts = {}
+
+    def walk(yaml_dict, path, parent):
+        if id(yaml_dict) not in contexts:
+            contexts[id(yaml_dict)] = _render_context(yaml_dict, cfg, parent)
+        for k, val in yaml_dict.items():
+            if isinstance(val, dict):
+                walk(val, path + (k,), yaml_dict)
+            elif isinstance(val, list):
+                for v_idx, v in enumerate(val):
+                    if _is_template(v):
+                        values.append((path + (k, v_idx), yaml_dict, k, v_idx))
+            elif _is_template(val):
+                values.append((path + (k,), yaml_dict, k, None))
+
+    if not isinstance(cfg, dict):
+        return {}
+    walk(cfg, (), None)
+
+    # Index the templated values by every prefix of their paths, so that a
+    # reference to a section depends on all templated values in it
+    by_prefix = {}
+    for n_value, (path, *_) in enumerate(values):
+        for depth in range(1, len(path) + 1):
+            by_prefix.setdefault(path[:depth], []).append(n_value)
+
+    def target(path, ref):
+        # Resolves a reference made from the dict at path to the path of the
+        # config value it names, as far as the config allows
+        name, keys = ref[0], ref[1:]
+        if name == "parent":
+            if not path:
+                return None
+            base = path[:-1]
+        elif name in _lookup(cfg, path):
+            base = path + (name,)
+        elif name in cfg:
+            base = (name,)
+        else:
+            return None
+        node = _lookup(cfg, base)
+        for key in keys:
+            if isinstance(node, dict) and key in node:
+                node = node[key]
+            elif isinstance(node, list) and isinstance(key, int) and -len(node) <= key < len(node):
+                node = node[key]
+            else:
+                break
+            base = base + (key,)
+        return base
+
+    deps = []
+    undefined = {}
+    for path, yaml_dict, k, v_idx in values:
+        v = yaml_dict[k] if v_idx is None else yaml_dict[k][v_idx]
+        dict_path = path[:-1] if v_idx is None else path[:-2]
+        value_deps = set()
+        for ref in _value_refs(v):
+            ref_path = target(dict_path, ref)
+            if ref_path is None:
+                if ref[0] not in _jinja_env().globals:
+                    undefined.setdefault(path, []).append(_path_str(ref))
+                continue
+            value_deps.update(by_prefix.get(ref_path, []))
+            # A reference into a templated value
+            for depth in range(1, len(ref_path)):
+                value_deps.update(
+                    n_value
+                    for n_value in by_prefix.get(ref_path[:depth], [])
+                    if values[n_value][0] == ref_path[:depth]
+                )
+        deps.append(sorted(value_deps))
+
+    # Order the values with Tarjan's algorithm, which gives the strongly
+    # connected components (reference cycles) with dependencies first
+    order = []
+    cycles = []
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+
+    def strongconnect(n_value):
+        index[n_value] = lowlink[n_value] = len(index)
+        stack.append(n_value)
+        on_stack.add(n_value)
+        for dep in deps[n_value]:
+            if dep not in index:
+                strongconnect(dep)
+                lowlink[n_value] = min(lowlink[n_value], lowlink[dep])
+            elif dep in on_stack:
+                lowlink[n_value] = min(lowlink[n_value], index[dep])
+        if lowlink[n_value] == index[n_value]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == n_value:
+                    break
+            component.sort()
+            if len(component) > 1:
+                cycles.append(component)
+            order.extend(component)
+
+    for n_value in range(len(values)):
+        if n_value not in index:
+            strongconnect(n_value)
+
+    # Render in order. A value that renders to another template is rendered
+    # again, as a later pass of extend_yaml would.
+    for n_value in order:
+        _, yaml_dict, k, v_idx = values[n_value]
+        context = contexts[id(yaml_dict)]
+        for _ in range(10):
+            v = yaml_dict[k] if v_idx is None else yaml_dict[k][v_idx]
+            rendered = _render_value(k, v, context)
+            if rendered is v:
+                break
+            if v_idx is None:
+                yaml_dict[k] = rendered
+            else:
+                yaml_dict[k][v_idx] = rendered
+            if rendered == v or not _is_template(rendered):
+                break
+
+    # Report what is left
+    unresolved = {}
+    in_cycle = {}
+    for component in cycles:
+        for n_value in component:
+            in_cycle[n_value] = " -> ".join(
+                _path_str(values[member][0]) for member in component + component[:1]
+            )
+    for n_value, (path, yaml_dict, k, v_idx) in enumerate(values):
+        v = yaml_dict[k] if v_idx is None else yaml_dict[k][v_idx]
+        if not _is_template(v):
+            continue
+        if contexts[id(yaml_dict)] is None:
+            reason = "templates at this level are not rendered"
+        elif n_value in in_cycle:
+            reason = f"circular reference: {in_cycle[n_value]}"
+        elif path in undefined:
+            reason = f"undefined: {', '.join(sorted(undefined[path]))}"
+        else:
+            pending = [
+                _path_str(values[dep][0])
+                for dep in deps[n_value]
+                if _is_template(_lookup(cfg, values[dep][0]))
+            ]
+            if pending:
+                reason = f"depends on unresolved: {', '.join(pending)}"
+            else:
+                reason = "could not be rendered"
+        unresolved[_path_str(path)] = reason
+    return unresolved
+
+
+def _lookup(cfg, path):
+    node = cfg
+    for key in path:
+        node = node[key]
+    return node
 
 
 ##########
@@ -302,29 +766,80 @@ def cfg_to_json_str(cfg):
 ##########
 # SHELL
 ##########
+# The section header and option patterns of configparser, which structured
+# shell config files were originally parsed with
+_SECTION_RE = re.compile(r"\[(?P<header>.+)\]")
+_OPTION_RE = re.compile(r"(?P<option>.*?)\s*(?P<vi>=|:)\s*(?P<value>.*)$")
+_NONSPACE_RE = re.compile(r"\S")
+
+
+def _parse_structured_shell(contents, return_string=1):
+    """Parses the contents of a structured shell config file in memory
+
+    The file is read the way configparser (with its default settings) reads
+    it once the ``# [section]`` comments are made section headers and the
+    line continuations of arrays are joined.
+
+    Raises:
+        ValueError: If the contents are not a structured shell config, e.g.
+                    there are variables before the first section
+    """
+    contents = contents.replace("# [", "[").replace("\\\n", " ")
+
+    sections = {}
+    defaults = {}
+    added = set()
+    section = None
+    option = None
+    indent_level = 0
+    for lineno, line in enumerate(contents.split("\n"), start=1):
+        value = line.strip()
+        if not value or value[0] in "#;":
+            # Blank lines are kept in multiline values; comments are not
+            if not value and section is not None and option:
+                section[option].append("")
+            continue
+        indent = _NONSPACE_RE.search(line).start()
+        if section is not None and option and indent > indent_level:
+            section[option].append(value)
+            continue
+        indent_level = indent
+        match = _SECTION_RE.match(value)
+        if match:
+            name = match.group("header")
+            if name == "DEFAULT":
+                section = defaults
+            elif name in sections:
+                raise ValueError(f"Line {lineno}: duplicate section {name}")
+            else:
+                section = sections[name] = {}
+            option = None
+            continue
+        match = _OPTION_RE.match(value) if section is not None else None
+        if not match or not match.group("option"):
+            raise ValueError(f"Line {lineno}: expected a section or a variable: {line}")
+        option = match.group("option").rstrip()
+        if (id(section), option) in added:
+            raise ValueError(f"Line {lineno}: duplicate variable {option}")
+        added.add((id(section), option))
+        section[option] = [match.group("value").strip()]
+
+    return {
+        name: {
+            k: str_to_list("\n".join(v).rstrip(), return_string)
+            for k, v in {**defaults, **options}.items()
+        }
+        for name, options in sections.items()
+    }
+
+
 def load_shell_as_ini_config(file_name, return_string=1):
     """
     Loads shell config file with embedded structure in comments
     """
 
-    # read contents and replace comments as sections
     with open(file_name, "r") as file:
-        cfg = file.read()
-        cfg = cfg.replace("# [", "[")
-        cfg = cfg.replace("\\\n", " ")
-
-    # write content to temp file and load it as ini
-    temp_file = os.path.join(os.getcwd(), "_temp." + str(os.getpid()) + ".ini")
-    with open(temp_file, "w") as file:
-        file.write(cfg)
-
-    # load it as a structured ini file
-    try:
-        cfg = load_ini_config(temp_file, return_string)
-    finally:
-        os.remove(temp_file)
-
-    return cfg
+        return _parse_structured_shell(file.read(), return_string)
 
 
 def load_shell_config(config_file, return_string=0):
@@ -515,6 +1030,8 @@ def cfg_to_xml_str(cfg):
     Gets contents of config file as a XML string
     """
 
+    from xml.dom import minidom  # pylint: disable=import-outside-toplevel
+
     root = dict_to_xml(cfg, "root")
     r = ET.tostring(root, encoding="unicode")
     r = minidom.parseString(r)
@@ -643,6 +1160,7 @@ def filter_dict(dict_o, keys_regex):
 ##################
 # CONFIG loader
 ##################
+@timed
 def load_config_file(file_name, return_string=0):
     """
     Loads config file based on file name extension
@@ -2,11 +2,18 @@
 
 import os
 import inspect
+import re
 import shlex
 from datetime import datetime, date
 from types import ModuleType
 
 
+# Double-quoted words separated by whitespace, without backslashes, as
+# written by list_to_str; splitting them needs no shell-like parsing
+_QUOTED_WORDS = re.compile(r'[ \t\r\n]*(?:"[^"\\]*"(?=[ \t\r\n]|\Z)[ \t\r\n]*)*\Z')
+_QUOTED_WORD = re.compile(r'"([^"]*)"')
+
+
 def str_to_date(s):
     """Gets Python datetime object from string.
 
@@ -150,7 +157,11 @@ def str_to_list(v, return_string=0):
     if (v[0] == "(" and v[-1] == ")") or (v[0] == "[" and v[-1] == "]"):
         v = v[1:-1]
         v = v.replace(",", " ")
-        tokens = shlex.split(v)
+        # Arrays written by list_to_str need no shell parsing
+        if _QUOTED_WORDS.match(v):
+            tokens = _QUOTED_WORD.findall(v)
+        else:
+            tokens = shlex.split(v)
         lst = []
         for itm in tokens:
             itm = itm.strip()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""
+Lightweight timers for the phases of experiment generation.
+
+Timing is off unless ``start_timing`` has been called, in which case every
+``span`` and ``phase`` entered until ``write_timing_report`` is recorded,
+nested under the span or phase that was open at the time. When timing is
+off, spans cost a function call.
+"""
+
+import contextlib
+import datetime
+import functools
+import json
+import os
+import time
+
+from .print_msg import log_info
+
+TIMING_FN = "timing.generate_FV3LAM_wflow.json"
+PROFILE_FN = "profile.generate_FV3LAM_wflow.pstats"
+
+_state = {
+    "enabled": False,
+    "started": None,
+    "profiler": None,
+    "root": None,
+    # Paths of the open spans, and the open phase (if any) of each
+    "stack": [],
+    "phases": [],
+    # Recorded spans by path, in the order they were first entered
+    "records": {},
+}
+
+
+def start_timing(name, enabled=True, profile=False):
+    """Starts recording spans under a root span, discarding anything recorded
+    (or a profile left running) by an earlier run in this process
+
+    Args:
+        name     (str): Name of the root span, which ends when the report is written
+        enabled (bool): Record spans; if ``False``, timing is only reset
+        profile (bool): Also run the cProfile profiler until the report is written
+    Returns:
+        None
+    """
+    if _state["profiler"] is not None:
+        _state["profiler"].disable()
+    _state.update(enabled=False, profiler=None, stack=[], phases=[], records={})
+    if not enabled:
+        return
+    _state.update(enabled=True, started=time.perf_counter())
+    _state["root"] = _enter(name)
+    if profile:
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        _state["profiler"] = cProfile.Profile()
+        _state["profiler"].enable()
+
+
+def timing_enabled():
+    """Returns ``True`` if spans are being recorded"""
+    return _state["enabled"]
+
+
+def _enter(name):
+    # Spans entered during a phase are nested under it
+    parent = ()
+    if _state["stack"]:
+        parent = _state["phases"][-1][0] if _state["phases"][-1] else _state["stack"][-1]
+    path = parent + (name,)
+    _state["records"].setdefault(path, {"calls": 0, "seconds": 0.0})
+    _state["stack"].append(path)
+    _state["phases"].append(None)
+    return path, time.perf_counter()
+
+
+def _exit(path, start):
+    _end_phase()
+    _state["stack"].pop()
+    _state["phases"].pop()
+    _record(path, start)
+
+
+def _record(path, start):
+    record = _state["records"][path]
+    record["calls"] += 1
+    record["seconds"] += time.perf_counter() - start
+
+
+def _end_phase():
+    if _state["phases"] and _state["phases"][-1] is not None:
+        _record(*_state["phases"][-1])
+        _state["phases"][-1] = None
+
+
+@contextlib.contextmanager
+def span(name):
+    """Times the enclosed block as a span called ``name``
+
+    A span entered while the innermost open span has the same name (e.g. in
+    a recursive call) is counted as part of that span.
+
+    Args:
+        name (str): Name of the span
+    """
+    stack = _state["stack"]
+    if not _state["enabled"] or (stack and stack[-1][-1] == name):
+        yield
+        return
+    path, start = _enter(name)
+    try:
+        yield
+    finally:
+        _exit(path, start)
+
+
+def timed(func):
+    """Decorator that times each call of a function as a span"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def phase(name):
+    """Starts a phase of the innermost open span, ending its previous phase
+
+    Phases split a long function into consecutive, timed steps without
+    re-indenting it. The last phase ends with the span.
+
+    Args:
+        name (str): Name of the phase
+    Returns:
+        None
+    """
+    if not _state["enabled"] or not _state["stack"]:
+        return
+    _end_phase()
+    path = _state["stack"][-1] + (name,)
+    _state["records"].setdefault(path, {"calls": 0, "seconds": 0.0})
+    _state["phases"][-1] = (path, time.perf_counter())
+
+
+def write_timing_report(exptdir):
+    """Writes the recorded spans, and the profile if one was started, to the
+    experiment directory and stops recording
+
+    The report lists each span under its full path (e.g.
+    ``generate_FV3LAM_wflow/setup/forecast``) with its number of calls and
+    total time in seconds. The profile can be read with ``pstats``.
+
+    Args:
+        exptdir (str): Path to the experiment directory
+    Returns:
+        Path to the timing report, or ``None`` if timing was not started
+    """
+    if not _state["enabled"]:
+        return None
+    profiler = _state["profiler"]
+    if profiler is not None:
+        profiler.disable()
+    # The report is written from the root span, which ends here
+    del _state["stack"][1:], _state["phases"][1:]
+    _exit(*_state["root"])
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "total_seconds": round(time.perf_counter() - _state["started"], 6),
+        "spans": [
+            {
+                "path": "/".join(path),
+                "depth": len(path) - 1,
+                "calls": record["calls"],
+                "seconds": round(record["seconds"], 6),
+            }
+            for path, record in _state["records"].items()
+        ],
+    }
+    timing_fp = os.path.join(exptdir, TIMING_FN)
+    with open(timing_fp, "w", encoding="utf-8") as timing_file:
+        json.dump(report, timing_file, indent=2)
+    log_info(f"Wrote timing report to:\n  {timing_fp}")
+
+    if profiler is not None:
+        profile_fp = os.path.join(exptdir, PROFILE_FN)
+        profiler.dump_stats(profile_fp)
+        log_info(f"Wrote profile to:\n  {profile_fp}")
+
+    _state.update(enabled=False, profiler=None, root=None, stack=[], phases=[])
+    return timing_fp
@@ -18,16 +18,28 @@ To see usage for this script:
 
 import argparse
 import datetime as dt
+import fcntl
+import functools
 import glob
+import hashlib
+import http.client
+import json
 import logging
 import os
+import random
 import shutil
+import socket
+import string
 import subprocess
 import sys
 import glob
+import threading
 from textwrap import dedent
 import time
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
 
 import yaml
@@ -78,16 +90,84 @@ def clean_up_output_dir(expected_subdir, local_archive, output_path, source_path
     return unavailable
 
 
+# Linux ioctl request for a copy-on-write clone of a whole file (FICLONE)
+FICLONE = 0x40049409
+
+
+def fast_copy(source, dest):
+
+    """
+    Copies the contents of a file in-process, using the fastest mechanism that the file systems 
+    support. In order of preference, that is a copy-on-write clone (reflink, ``FICLONE``), 
+    ``copy_file_range``, ``sendfile``, and finally a buffered copy with ``shutil``. The first 
+    three copy the data inside the kernel.
+
+    Args:
+        source (str): Path to the file to copy
+        dest   (str): Path of the new file
+
+    Returns:
+        The name of the mechanism that was used
+    """
+
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        size = os.fstat(src_fd).st_size
+
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return "reflink"
+        except OSError:
+            pass
+
+        kernel_copies = []
+        if hasattr(os, "copy_file_range"):
+            kernel_copies.append((
+                "copy_file_range",
+                lambda offset, count: os.copy_file_range(src_fd, dst_fd, count, offset),
+            ))
+        if hasattr(os, "sendfile"):
+            kernel_copies.append((
+                "sendfile",
+                lambda offset, count: os.sendfile(dst_fd, src_fd, offset, count),
+            ))
+
+        for name, copy_range in kernel_copies:
+            copied = 0
+            try:
+                while copied < size:
+                    sent = copy_range(copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                pass
+            if copied == size:
+                return name
+            dst.seek(0)
+            dst.truncate()
+
+        src.seek(0)
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        return "shutil"
+
+
 def copy_file(source, destination, copy_cmd):
 
     """
     Copies a file from a source and places it in the destination location.
     Assumes destination exists.
 
+    The transfer is done in-process rather than with a subprocess: ``ln -sf`` creates a symbolic 
+    link, ``ln`` creates a hard link (copying when that is not possible, e.g., across file 
+    systems), and ``cp`` copies the file with ``fast_copy()``. A source in a ``FileCache`` is 
+    hard linked or copied even for ``ln -sf``, since the entry may be evicted. An existing 
+    destination file is replaced rather than overwritten in place.
+
     Args: 
         source      (str): Directory where file currently resides
         destination (str): Directory that the file should be moved to
-        copy_cmd    (str): Copy command (e.g., ``cp``, ``ln -sf``)
+        copy_cmd    (str): Copy command (``cp``, ``ln``, or ``ln -sf``)
 
     Returns: 
         A boolean value reflecting whether the copy was successful (True) or unsuccessful (False)
@@ -97,21 +177,57 @@ def copy_file(source, destination, copy_cmd):
         logging.info(f"File does not exist on disk \n {source} \n try using: --input_file_path <your_path>")
         return False
 
-    # Using subprocess here because system copy is much faster than
-    # python copy options.
-    cmd = f"{copy_cmd} {source} {destination}"
-    logging.info(f"Running command: \n {cmd}")
+    dest = destination
+    if os.path.isdir(destination):
+        dest = os.path.join(destination, os.path.basename(source))
+
     try:
-        subprocess.run(
-            cmd,
-            check=True,
-            shell=True,
-        )
-    except subprocess.CalledProcessError as err:
+        if os.path.exists(dest) and os.path.samefile(source, dest):
+            logging.info(f"{source} is already in place")
+            return True
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+        if copy_cmd == "ln -sf" and not FileCache.is_entry(source):
+            os.symlink(source, dest)
+            method = "symlink"
+        elif copy_cmd in ("ln", "ln -sf"):
+            # Cache entries can be evicted at any time, so they are never symlinked
+            try:
+                os.link(source, dest)
+                method = "hard link"
+            except OSError:
+                method = fast_copy(source, dest)
+        else:
+            method = fast_copy(source, dest)
+    except OSError as err:
         logging.info(err)
         return False
+
+    logging.info(f"Staged {source} to {dest} ({method})")
     return True
 
+
+def copy_files(requests, copy_cmd, num_workers=1):
+
+    """
+    Stages a batch of files from disk on a pool of worker threads with ``copy_file()``.
+
+    Args:
+        requests   (list): A list of (source, destination) tuples
+        copy_cmd    (str): Copy command (``cp``, ``ln``, or ``ln -sf``)
+        num_workers (int): Size of the worker thread pool
+
+    Returns:
+        A dict mapping each (source, destination) tuple to a retrieval status
+    """
+
+    requests = list(dict.fromkeys(requests))
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        statuses = pool.map(lambda req: copy_file(*req, copy_cmd), requests)
+        return dict(zip(requests, statuses))
+
+
 def check_file(url):
 
     """
@@ -160,6 +276,763 @@ def download_file(url):
     return True
 
 
+def file_checksum(path):
+
+    """Returns the SHA-256 checksum of a file as a hex string."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TransferJournal:
+
+    """
+    A journal of the files downloaded into a directory, kept in a hidden file in that directory. 
+    For each file, it records the source URL, the server's ``ETag`` and ``Last-Modified`` 
+    validators, the expected size, and, once the file is complete, its SHA-256 checksum.
+
+    Reruns use the journal to skip files that are complete and verified, to resume partial files 
+    (when the server's validators show the source hasn't changed), and to re-fetch files that 
+    are corrupt or truncated. The journal is append-only, with one JSON record per line, so that 
+    a killed job can't leave it unreadable; the last record for a file wins.
+
+    Args:
+        directory (str): Directory that files are downloaded into
+    """
+
+    FILE_NAME = ".retrieve_data_journal"
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A record cut short when a job was killed
+                        continue
+                    self._entries[entry["file"]] = entry
+
+    def get(self, file_name):
+
+        """Returns the latest journal entry for a file name, or an empty dict."""
+
+        with self._lock:
+            return dict(self._entries.get(file_name, {}))
+
+    def record(self, file_name, **entry):
+
+        """Appends a journal entry for a file name.
+
+        Args:
+            file_name (str): Name of the file in the journal's directory
+
+        Keyword Args:
+            url           (str): Source URL
+            etag          (str): Value of the ``ETag`` header of the response
+            last_modified (str): Value of the ``Last-Modified`` header of the response
+            size          (int): Expected size of the file in bytes, if known
+            sha256        (str): Checksum of the complete file
+            subset       (dict): GRIB2 ``variables`` and ``levels`` retrieved, if not the whole file
+            complete     (bool): Whether the file is complete
+        """
+
+        entry["file"] = file_name
+        with self._lock:
+            self._entries[file_name] = entry
+            with open(self.path, "a", encoding="utf-8") as journal:
+                journal.write(json.dumps(entry) + "\n")
+
+    def complete(self, file_name, url, subset=None, **validators):
+
+        """Records a complete file, with its size and checksum."""
+
+        path = os.path.join(os.path.dirname(self.path), file_name)
+        self.record(
+            file_name,
+            url=url,
+            size=os.path.getsize(path),
+            sha256=file_checksum(path),
+            subset=subset,
+            complete=True,
+            **validators,
+        )
+
+    def verified(self, file_name, url, subset=None):
+
+        """
+        Checks whether a file is complete and intact: the journal must have a complete entry for 
+        the same URL (and GRIB2 subset), and the file on disk must match the recorded size and 
+        checksum. A file that fails the check is removed so that it is fetched from scratch.
+
+        Returns:
+            Boolean value reflecting whether the file can be used as is
+        """
+
+        entry = self.get(file_name)
+        path = os.path.join(os.path.dirname(self.path), file_name)
+        if not entry.get("complete") or entry.get("url") != url:
+            return False
+        if entry.get("subset") != subset:
+            return False
+        if (
+            os.path.exists(path)
+            and os.path.getsize(path) == entry.get("size")
+            and file_checksum(path) == entry.get("sha256")
+        ):
+            return True
+        if os.path.exists(path):
+            logging.warning(f"{path} does not match its journal entry; fetching it again")
+            os.remove(path)
+        return False
+
+
+class HostThrottle:
+
+    """
+    Limits the number of simultaneous transfers to a single host, and keeps track of an adaptive
+    backoff delay for that host. The delay is zero until the host responds with a throttle or
+    timeout, grows exponentially with each further throttle, and decays again with each success.
+
+    Args:
+        max_concurrent (int): Maximum number of simultaneous transfers allowed for the host
+        max_delay    (float): Upper bound on the backoff delay in seconds
+    """
+
+    def __init__(self, max_concurrent, max_delay=60.0):
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def throttled(self):
+        """Doubles the backoff delay after a throttle or timeout response."""
+        with self._lock:
+            self.delay = min(max(2 * self.delay, 1.0), self.max_delay)
+
+    def succeeded(self):
+        """Relaxes the backoff delay after a successful response."""
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > 0.5 else 0.0
+
+    def wait(self):
+        """Sleeps for the current backoff delay (with jitter), if there is one."""
+        delay = self.delay
+        if delay:
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+class HTTPTransfer:
+
+    """
+    Retrieves files over HTTP(S) with a bounded pool of worker threads. Each worker keeps one
+    persistent connection per host so that consecutive files from the same data store reuse the
+    connection, and no host receives more than ``max_per_host`` simultaneous requests.
+
+    Args:
+        num_workers  (int): Size of the worker thread pool
+        max_per_host (int): Maximum number of simultaneous transfers from a single host
+        timeout    (float): Socket timeout in seconds
+        tries        (int): Number of attempts for each file before giving up
+        subset      (dict): Optional ``variables`` and ``levels`` lists. When provided, only the
+                            matching GRIB2 records are fetched, using the file's ``.idx``
+                            inventory and HTTP Range requests.
+    """
+
+    # Responses that mean "try again later" rather than "the file is not there"
+    THROTTLE_CODES = (429, 500, 502, 503, 504)
+
+    class Throttled(Exception):
+        """Raised when the host responds with one of the ``THROTTLE_CODES``."""
+
+    def __init__(self, num_workers=4, max_per_host=4, timeout=15, tries=3, subset=None):
+        self.num_workers = max(1, num_workers)
+        self.max_per_host = max(1, max_per_host)
+        self.timeout = timeout
+        self.tries = tries
+        self.subset = subset
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self._local = threading.local()
+        self._journals = {}
+
+    def _host(self, netloc):
+        with self._hosts_lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = HostThrottle(self.max_per_host)
+            return self._hosts[netloc]
+
+    def _journal(self, target_path):
+        with self._hosts_lock:
+            if target_path not in self._journals:
+                self._journals[target_path] = TransferJournal(target_path)
+            return self._journals[target_path]
+
+    def _connection(self, scheme, netloc):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            conn_class = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            conn = conns[(scheme, netloc)] = conn_class(netloc, timeout=self.timeout)
+        return conn
+
+    def _drop_connection(self, scheme, netloc):
+        conn = getattr(self._local, "conns", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def request(self, url, method="GET", headers=None, max_redirects=5):
+
+        """
+        Issues a single request on this thread's persistent connection to the URL's host,
+        following redirects. The caller must read the response fully before issuing another
+        request on the same thread.
+
+        Args:
+            url           (str): URL to request
+            method        (str): HTTP method, e.g., ``GET`` or ``HEAD``
+            headers      (dict): Additional request headers
+            max_redirects (int): Maximum number of redirects to follow
+
+        Returns:
+            An ``http.client.HTTPResponse`` object
+        """
+
+        for _ in range(max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The server may have closed an idle keep-alive connection.
+                # Reconnect once before letting the error propagate.
+                self._drop_connection(parts.scheme, parts.netloc)
+                conn = self._connection(parts.scheme, parts.netloc)
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            return response
+        raise http.client.HTTPException(f"Too many redirects for {url}")
+
+    def _checked_response(self, url, method="GET", headers=None, ok=(200,)):
+
+        """
+        Issues a request and returns the response if its status is in ``ok``. Otherwise, the
+        response is drained so the connection can be reused, and ``None`` is returned.
+
+        Raises:
+            HTTPTransfer.Throttled: If the host responds with one of the ``THROTTLE_CODES``
+        """
+
+        response = self.request(url, method=method, headers=headers)
+        if response.status in ok:
+            return response
+        response.read()
+        if response.status in self.THROTTLE_CODES:
+            raise self.Throttled(f"{url} returned HTTP status {response.status}")
+        logging.info(f"{url} returned HTTP status {response.status}")
+        return None
+
+    def _grib2_ranges(self, url):
+
+        """
+        Reads the ``.idx`` inventory that accompanies a GRIB2 file and returns the byte ranges
+        of the records selected by ``self.subset``, or ``None`` if there is no inventory.
+        """
+
+        response = self._checked_response(f"{url}.idx")
+        if response is None:
+            logging.info(f"No GRIB2 index for {url}; retrieving the whole file")
+            return None
+        return grib2_byte_ranges(
+            response.read().decode("utf-8", errors="replace"),
+            variables=self.subset.get("variables"),
+            levels=self.subset.get("levels"),
+        )
+
+    def _write_ranges(self, url, ranges, out_file):
+
+        """
+        Writes the requested byte ranges of ``url`` to ``out_file``, one Range request per
+        range. Falls back to writing the whole file if the server ignores Range requests.
+
+        Returns:
+            Boolean value reflecting whether the ranges were retrieved
+        """
+
+        for start, end in ranges:
+            byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+            response = self._checked_response(url, headers={"Range": byte_range}, ok=(200, 206))
+            if response is None:
+                return False
+            if response.status == 200:
+                logging.info(f"{url} does not support Range requests; keeping the whole file")
+                out_file.seek(0)
+                out_file.truncate()
+                shutil.copyfileobj(response, out_file, 1024 * 1024)
+                return True
+            shutil.copyfileobj(response, out_file, 1024 * 1024)
+        return True
+
+    def _attempt(self, url, target_path, check_only):
+
+        """
+        Makes a single attempt to retrieve (or just check) a file.
+
+        Returns:
+            ``True`` on success, ``False`` if the file is not available, or ``None`` if the host
+            throttled the request or timed out and the attempt should be retried.
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        try:
+            if check_only:
+                response = self._checked_response(url, method="HEAD")
+                if response is not None:
+                    response.read()
+                return response is not None
+
+            file_name = os.path.basename(parts.path)
+            dest = os.path.join(target_path, file_name)
+            journal = self._journal(target_path)
+            if journal.verified(file_name, url, self.subset):
+                logging.info(f"{url} was already retrieved and verified")
+                return True
+
+            if self.subset:
+                return self._attempt_subset(url, dest, journal)
+            return self._attempt_resumable(url, dest, journal)
+
+        except self.Throttled as err:
+            logging.info(f"Throttled: {err}")
+            return None
+        except (socket.timeout, TimeoutError, ConnectionError, http.client.IncompleteRead) as err:
+            logging.info(f"Timeout or connection error for {url}: {err}")
+            self._drop_connection(parts.scheme, parts.netloc)
+            return None
+        except (http.client.HTTPException, OSError) as err:
+            logging.info(f"Error retrieving {url}: {err}")
+            self._drop_connection(parts.scheme, parts.netloc)
+            return False
+
+    def _attempt_subset(self, url, dest, journal):
+
+        """
+        Retrieves the GRIB2 records selected by ``self.subset`` into ``dest``. Subsets are not 
+        resumed; an interrupted subset is fetched again from the start.
+        """
+
+        ranges = self._grib2_ranges(url)
+        if ranges is not None and not ranges:
+            logging.warning(f"No GRIB2 records in {url} match {self.subset}")
+            return False
+
+        response = None
+        if ranges is None:
+            response = self._checked_response(url)
+            if response is None:
+                return False
+
+        partial = f"{dest}.part"
+        try:
+            with open(partial, "wb") as out_file:
+                if response is not None:
+                    shutil.copyfileobj(response, out_file, 1024 * 1024)
+                elif not self._write_ranges(url, ranges, out_file):
+                    return False
+            os.replace(partial, dest)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        journal.complete(os.path.basename(dest), url, subset=self.subset)
+        return True
+
+    def _attempt_resumable(self, url, dest, journal):
+
+        """
+        Retrieves a whole file into ``dest``, resuming a partial file left by an earlier attempt 
+        when the journal shows it came from the same, unchanged source. The partial file is kept 
+        if the transfer is interrupted, and the file is only moved into place once its size 
+        matches the size announced by the server. A partial file that already has the journaled 
+        size is moved into place without retrieving anything more.
+        """
+
+        file_name = os.path.basename(dest)
+        partial = f"{dest}.part"
+        entry = journal.get(file_name)
+        validator = entry.get("etag") or entry.get("last_modified")
+
+        headers = {}
+        offset = 0
+        if (
+            os.path.exists(partial)
+            and entry.get("url") == url
+            and not entry.get("complete")
+            and validator
+        ):
+            offset = os.path.getsize(partial)
+            headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+            logging.info(f"Resuming {url} from byte {offset}")
+
+        ok = (200, 206, 416) if offset else (200, 206)
+        response = self._checked_response(url, headers=headers, ok=ok)
+        if response is not None and response.status == 416:
+            response.read()
+            # The range starts past the end of the file: the partial file is either already
+            # complete, if the last attempt was stopped just before moving it into place, or it
+            # doesn't match the file on the server, which is then retrieved from the start.
+            if entry.get("size") == offset:
+                logging.info(f"{partial} is already complete")
+                os.replace(partial, dest)
+                journal.complete(
+                    file_name,
+                    url,
+                    etag=entry.get("etag"),
+                    last_modified=entry.get("last_modified"),
+                )
+                return True
+            logging.info(f"Can't resume {url} from byte {offset}; retrieving the whole file")
+            offset = 0
+            response = self._checked_response(url)
+        if response is None:
+            if os.path.exists(partial):
+                os.remove(partial)
+            return False
+
+        size = response.getheader("Content-Length")
+        size = int(size) if size is not None else None
+        if response.status == 206:
+            # Content-Range: bytes <start>-<end>/<total>
+            total = response.getheader("Content-Range", "").rpartition("/")[2]
+            size = int(total) if total.isdigit() else None
+        else:
+            offset = 0
+
+        validators = {
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+        }
+        journal.record(file_name, url=url, size=size, complete=False, **validators)
+
+        with open(partial, "ab" if offset else "wb") as out_file:
+            shutil.copyfileobj(response, out_file, 1024 * 1024)
+
+        if size is not None and os.path.getsize(partial) != size:
+            logging.info(f"{url} was truncated; will resume")
+            return None
+
+        os.replace(partial, dest)
+        journal.complete(file_name, url, **validators)
+        return True
+
+    def fetch(self, url, target_path, check_only=False):
+
+        """
+        Retrieves a single file into ``target_path``, honoring the per-host concurrency limit and
+        backing off only when the host throttles or times out.
+
+        Args:
+            url          (str): URL for file to be downloaded
+            target_path  (str): Existing directory that the file will be placed in
+            check_only  (bool): Only check that the file exists (``HEAD`` request)
+
+        Returns:
+            Boolean value reflecting whether the file was retrieved (True) or not (False)
+        """
+
+        host = self._host(urllib.parse.urlsplit(url).netloc)
+        for attempt in range(self.tries):
+            host.wait()
+            with host.slots:
+                logging.debug(f"Requesting {url} (attempt {attempt + 1})")
+                retrieved = self._attempt(url, target_path, check_only)
+            if retrieved is None:
+                host.throttled()
+                continue
+            host.succeeded()
+            return retrieved
+        logging.info(f"Giving up on {url} after {self.tries} attempts")
+        return False
+
+    def fetch_all(self, requests, check_only=False):
+
+        """
+        Retrieves a batch of files concurrently.
+
+        Args:
+            requests   (list): A list of (url, target_path) tuples
+            check_only (bool): Only check that the files exist
+
+        Returns:
+            A dict mapping each (url, target_path) tuple to a retrieval status
+        """
+
+        requests = list(dict.fromkeys(requests))
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            statuses = pool.map(
+                lambda req: self.fetch(*req, check_only=check_only), requests
+            )
+            return dict(zip(requests, statuses))
+
+
+def grib2_byte_ranges(index, variables=None, levels=None):
+
+    """
+    Finds the byte ranges of the selected records in a GRIB2 file, given the contents of its 
+    ``.idx`` inventory (as written by ``wgrib2 -s``). Each inventory line looks like::
+
+        15:1048576:d=2022062509:TMP:2 m above ground:3 hour fcst:
+
+    A record runs from its offset to the byte before the next record's offset. Sub-messages 
+    sharing an offset (e.g., ``12.1`` and ``12.2``) belong to the same record. Adjacent selected 
+    records are merged into a single range.
+
+    Args:
+        index      (str): Contents of the ``.idx`` file
+        variables (list): Variable names to keep (e.g., ``UGRD``). All variables if ``None``.
+        levels    (list): Level descriptions to keep (e.g., ``10 m above ground``). All levels 
+                          if ``None``.
+
+    Returns:
+        A list of (start, end) tuples of inclusive byte offsets. ``end`` is ``None`` for a range 
+        that extends to the end of the file.
+    """
+
+    records = []
+    for line in index.splitlines():
+        fields = line.split(":")
+        if len(fields) < 5 or not fields[1].isdigit():
+            continue
+        records.append((int(fields[1]), fields[3], fields[4]))
+
+    offsets = sorted({offset for offset, _, _ in records})
+    next_offset = dict(zip(offsets, offsets[1:] + [None]))
+
+    selected = sorted({
+        offset
+        for offset, variable, level in records
+        if (variables is None or variable in variables)
+        and (levels is None or level in levels)
+    })
+
+    ranges = []
+    for offset in selected:
+        end = next_offset[offset] - 1 if next_offset[offset] is not None else None
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] + 1 == offset:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((offset, end))
+    return ranges
+
+
+class FileCache:
+
+    """
+    A shared on-disk cache of retrieved files that can be used by many experiments and jobs at
+    once. Entries are keyed by a hash of where a file came from (data type, data store, and the
+    resolved path, URL, or archive member, plus the size and modification time of files on disk),
+    and a cache hit is staged into the output directory as a hard link (or a copy across file
+    systems) instead of a new download, copy, or archive extraction. Staged files never refer to
+    the cache entry by name, so evicting it doesn't affect them. Only files that retrieve_data
+    wrote itself are linked into the cache; anything else, such as a file staged from disk, is
+    copied, so that no entry shares its inode with source data.
+
+    New entries are written to a temporary name and renamed into place, and every change to the
+    cache is made while holding an exclusive ``flock`` on ``<cache_dir>/.lock``, so concurrent
+    jobs never see partial files. Each hit refreshes the entry's modification time, and
+    ``evict()`` removes the least recently used entries until the cache fits in its size limit.
+
+    Args:
+        cache_dir     (str): Path to the cache directory. It is created if needed.
+        max_size_gb (float): Size limit of the cache in GB
+    """
+
+    def __init__(self, cache_dir, max_size_gb=100):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_gb * 1024**3)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_path = os.path.join(cache_dir, ".lock")
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Returns the cache key for a file, given the parts that identify where it came from."""
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+    @staticmethod
+    def source_key(data_type, data_store, path, subset, on_disk=False):
+        """
+        Returns the cache key for a file retrieved from a data store. The key of a file on disk
+        also includes its size and modification time, so that a file regenerated at the same path
+        doesn't hit the old entry. Returns ``None`` for a file on disk that doesn't exist.
+        """
+        if not on_disk:
+            return FileCache.key(data_type, data_store, path, subset)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return FileCache.key(data_type, data_store, path, subset, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def cacheable(path):
+        """Returns whether a path names a single file (i.e., is not a glob pattern)."""
+        return not any(char in path for char in "*?[")
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def is_entry(path):
+        """Returns whether a path (after resolving symbolic links) is an entry of a cache."""
+        path = os.path.realpath(path)
+        name = os.path.basename(path)
+        return (
+            len(name) == 64
+            and all(char in "0123456789abcdef" for char in name)
+            and os.path.basename(os.path.dirname(path)) == name[:2]
+        )
+
+    def __contains__(self, key):
+        return os.path.exists(self._entry(key))
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, key, dest):
+
+        """
+        Stages a cached file at ``dest``, replacing anything already there.
+
+        Args:
+            key  (str): Cache key from ``FileCache.key()``
+            dest (str): Full path of the file to create
+
+        Returns:
+            Boolean value reflecting whether the file was in the cache
+        """
+
+        entry = self._entry(key)
+        with self._locked():
+            if not os.path.exists(entry):
+                self.misses += 1
+                return False
+            os.utime(entry)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            try:
+                os.link(entry, dest)
+            except OSError:
+                # A symbolic link would dangle once the entry is evicted, so copy instead
+                fast_copy(entry, dest)
+            self.hits += 1
+        logging.info(f"Found {os.path.basename(dest)} in cache: {entry}")
+        return True
+
+    def insert(self, key, source, link=False):
+
+        """
+        Adds a retrieved file to the cache, by copying it or, if allowed, linking it.
+
+        Args:
+            key    (str): Cache key from ``FileCache.key()``
+            source (str): Path to the retrieved file
+            link  (bool): Whether retrieve_data wrote the file itself, so that the entry may be a
+                          hard link to it. Otherwise the file may be, or link to, source data
+                          whose modification time must not be touched, and it is copied.
+        """
+
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if link and not os.path.islink(source):
+                try:
+                    os.link(source, tmp)
+                except OSError:
+                    shutil.copyfile(source, tmp)
+            else:
+                shutil.copyfile(source, tmp)
+            with self._locked():
+                os.replace(tmp, entry)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+
+        """Removes the least recently used entries until the cache fits in its size limit."""
+
+        with self._locked():
+            entries = []
+            for root, _, files in os.walk(self.cache_dir):
+                for file_name in files:
+                    path = os.path.join(root, file_name)
+                    if path == self._lock_path or file_name.endswith(".tmp"):
+                        continue
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                logging.debug(f"Evicting {path} from cache")
+                os.remove(path)
+                total -= size
+
+
+def cached_retrieval(cache, key, dest, retrieve, link=False):
+
+    """
+    Stages a file from the cache if it is there. Otherwise, retrieves it and adds it to the cache.
+
+    Args:
+        cache (FileCache): The cache, or ``None`` to always retrieve
+        key         (str): Cache key, or ``None`` if the file should not be cached
+        dest        (str): Full path of the file being retrieved
+        retrieve   (func): Function that retrieves the file and returns whether it succeeded
+        link       (bool): Whether ``retrieve`` writes the file itself (see ``FileCache.insert()``)
+
+    Returns:
+        Boolean value reflecting whether the file was staged or retrieved
+    """
+
+    if cache is None or key is None:
+        return retrieve()
+    if cache.fetch(key, dest):
+        return True
+    retrieved = retrieve()
+    if retrieved and os.path.isfile(dest):
+        cache.insert(key, dest, link=link)
+    return retrieved
+
+
 def arg_list_to_range(args):
 
     """
@@ -192,11 +1065,89 @@ def arg_list_to_range(args):
     return args
 
 
+def _bin6(cycle_date):
+    # One strategy for binning data files at NCEP is to put them into 6
+    # cycle bins. The archive file names include the low and high end of the
+    # range. Set the range as would be indicated in the archive file
+    # here. Integer division is intentional here.
+    low_end = cycle_date.hour // 6 * 6
+    return f"{low_end:02d}-{low_end+5:02d}"
+
+
+def _hh_even(cycle_date):
+    # Another strategy is to bundle odd cycle hours with their next
+    # lowest even cycle hour. Files are named only with the even hour.
+    # Integer division is intentional here.
+    return f"{cycle_date.hour // 2 * 2:02d}"
+
+
+# Template fields that are filled from the cycle date, and how to compute them
+DATE_FIELDS = {
+    "bin6": _bin6,
+    "dd": lambda cycle_date: cycle_date.strftime("%d"),
+    "hh": lambda cycle_date: cycle_date.strftime("%H"),
+    "hh_even": _hh_even,
+    "jjj": lambda cycle_date: cycle_date.strftime("%j"),
+    "min": lambda cycle_date: cycle_date.strftime("%M"),
+    "mm": lambda cycle_date: cycle_date.strftime("%m"),
+    "yy": lambda cycle_date: cycle_date.strftime("%y"),
+    "yyyy": lambda cycle_date: cycle_date.strftime("%Y"),
+    "yyyymm": lambda cycle_date: cycle_date.strftime("%Y%m"),
+    "yyyymmdd": lambda cycle_date: cycle_date.strftime("%Y%m%d"),
+    "yyyymmddhh": lambda cycle_date: cycle_date.strftime("%Y%m%d%H"),
+}
+
+# All template fields, in the order they are documented by fill_template()
+TEMPLATE_FIELDS = (
+    "bin6", "ens_group", "fcst_hr", "dd", "hh", "hh_even", "jjj", "mem", "min", "mm", "yy",
+    "yyyy", "yyyymm", "yyyymmdd", "yyyymmddhh",
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(template_str):
+
+    """Parses a template string once, and returns the fields it references.
+
+    Args:
+      template_str (str): A string containing Python templates
+
+    Returns:
+      A tuple of the names of the date fields (keys of ``DATE_FIELDS``) referenced in the 
+      template, including any nested in format specifications
+    """
+
+    fields = set()
+    pending = [template_str]
+    while pending:
+        for _, field_name, format_spec, _ in string.Formatter().parse(pending.pop()):
+            if field_name is None:
+                continue
+            fields.add(field_name.split(".")[0].split("[")[0])
+            if format_spec:
+                pending.append(format_spec)
+    return tuple(sorted(fields & DATE_FIELDS.keys()))
+
+
+@functools.lru_cache(maxsize=4096)
+def template_date_values(template_str, cycle_date):
+
+    """Returns the values of only the date fields referenced in a template, for a given cycle. 
+    Results are cached, so the date fields are computed once per template and cycle."""
+
+    return {name: DATE_FIELDS[name](cycle_date) for name in compile_template(template_str)}
+
+
 def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
 
     """Fills in the provided template string with date time information, and returns the 
     resulting string.
 
+    Templates are parsed once (see ``compile_template()``), and only the date fields that a 
+    template references are computed, once per cycle. This function is called for every 
+    member, forecast hour and file, so it avoids formatting the full set of date fields on 
+    each call.
+
     Args:
       template_str         : A string containing Python templates
       cycle_date           : A datetime object that will be used to fill in date and time 
@@ -214,49 +1165,17 @@ def fill_template(template_str, cycle_date, templates_only=False, **kwargs):
     Returns:
       Filled template string
     """
- 
-    # Parse keyword args
-    ens_group = kwargs.get("ens_group")
-    fcst_hr = kwargs.get("fcst_hr", 0)
-    mem = kwargs.get("mem", "")
-    # -----
 
-    cycle_hour = cycle_date.strftime("%H")
-
-    # One strategy for binning data files at NCEP is to put them into 6
-    # cycle bins. The archive file names include the low and high end of the
-    # range. Set the range as would be indicated in the archive file
-    # here. Integer division is intentional here.
-    low_end = int(cycle_hour) // 6 * 6
-    bin6 = f"{low_end:02d}-{low_end+5:02d}"
-
-    # Another strategy is to bundle odd cycle hours with their next
-    # lowest even cycle hour. Files are named only with the even hour.
-    # Integer division is intentional here.
-    hh_even = f"{int(cycle_hour) // 2 * 2:02d}"
+    if templates_only:
+        return ",".join(TEMPLATE_FIELDS)
 
-    format_values = dict(
-        bin6=bin6,
-        ens_group=ens_group,
-        fcst_hr=fcst_hr,
-        dd=cycle_date.strftime("%d"),
-        hh=cycle_hour,
-        hh_even=hh_even,
-        jjj=cycle_date.strftime("%j"),
-        mem=mem,
-        min=cycle_date.strftime("%M"),
-        mm=cycle_date.strftime("%m"),
-        yy=cycle_date.strftime("%y"),
-        yyyy=cycle_date.strftime("%Y"),
-        yyyymm=cycle_date.strftime("%Y%m"),
-        yyyymmdd=cycle_date.strftime("%Y%m%d"),
-        yyyymmddhh=cycle_date.strftime("%Y%m%d%H"),
+    return template_str.format(
+        ens_group=kwargs.get("ens_group"),
+        fcst_hr=kwargs.get("fcst_hr", 0),
+        mem=kwargs.get("mem", ""),
+        **template_date_values(template_str, cycle_date),
     )
 
-    if templates_only:
-        return f'{",".join((format_values.keys()))}'
-    return template_str.format(**format_values)
-
 
 def create_target_path(target_path):
 
@@ -274,12 +1193,46 @@ def create_target_path(target_path):
     return target_path
 
 
+def archive_candidates(paths, file_names, cycle_date, ens_group):
+
+    """Given an equal-length set of archive paths and archive file names, return the filled-in 
+    HPSS paths of every candidate archive, grouped by the item in the set of paths.
+
+    Args:
+        paths       (list): Archive paths
+        file_names  (list): Archive file names. Each item may be a list of file names.
+        cycle_date   (int): Cycle date (YYYYMMDDHH or YYYYMMDDHHmm format)
+        ens_group    (int): A number associated with a bin where ensemble members are stored 
+                            in archive files
+
+    Returns:
+        A list with one list of HPSS paths for each item in ``paths``
+    """
+
+    candidates = []
+    for archive_path, archive_file_names in zip(paths, file_names):
+        if not isinstance(archive_file_names, list):
+            archive_file_names = [archive_file_names]
+        candidates.append([
+            fill_template(
+                os.path.join(archive_path, archive_file_name),
+                cycle_date,
+                ens_group=ens_group,
+            )
+            for archive_file_name in archive_file_names
+        ])
+    return candidates
+
+
 def find_archive_files(paths, file_names, cycle_date, ens_group):
 
     """Given an equal-length set of archive paths and archive file
     names, and a cycle date, check HPSS via hsi to make sure at least
     one set exists. Return a dict of the paths of the existing archive, along with
     the item in set of paths that was found.
+
+    All candidates are checked with a single ``hsi`` session (see ``hsi_probe()``), and 
+    results already known from earlier probes in this run are reused.
     
     Args:
         paths       (list): Archive paths
@@ -292,26 +1245,17 @@ def find_archive_files(paths, file_names, cycle_date, ens_group):
         A tuple containing (existing_archives, list_item) or ("", 0)
     """
 
-    zipped_archive_file_paths = zip(paths, file_names)
+    candidates = archive_candidates(paths, file_names, cycle_date, ens_group)
+    found = hsi_probe([file_path for item in candidates for file_path in item])
 
     # Narrow down which HPSS files are available for this date
-    for list_item, (archive_path, archive_file_names) in enumerate(
-        zipped_archive_file_paths
-    ):
+    for list_item, file_paths in enumerate(candidates):
 
-        existing_archives = {}
-        if not isinstance(archive_file_names, list):
-            archive_file_names = [archive_file_names]
-
-        for n_fp, archive_file_name in enumerate(archive_file_names):
-            # Only test the first item in the list, it will tell us if this
-            # set exists at this date.
-            file_path = os.path.join(archive_path, archive_file_name)
-            file_path = fill_template(file_path, cycle_date, ens_group=ens_group)
-            file_path = hsi_single_file(file_path)
-
-            if file_path:
-                existing_archives[n_fp] = file_path
+        existing_archives = {
+            n_fp: file_path
+            for n_fp, file_path in enumerate(file_paths)
+            if file_path in found
+        }
 
         if existing_archives:
             for existing_archive in existing_archives.values():
@@ -362,6 +1306,28 @@ def get_file_templates(cla, known_data_info, data_store, use_cla_tmpl=False):
     return file_templates
 
 
+def get_grib2_subset(cla, store_specs):
+
+    """Returns the GRIB2 record filter for a data store, if it has one. The filter is set with 
+    the optional ``variables`` and ``levels`` entries of a data store in the ``--config`` file, 
+    and only applies to GRIB2 files.
+
+    Args:
+       cla         (str) : Command line arguments (Namespace object)
+       store_specs (dict): Data-store specifications from the ``--config`` file
+
+    Returns:
+       A dict with ``variables`` and ``levels`` keys (either may be ``None``), or ``None`` if 
+       whole files should be retrieved
+    """
+
+    variables = store_specs.get("variables")
+    levels = store_specs.get("levels")
+    if (variables is None and levels is None) or cla.file_fmt not in (None, "grib2"):
+        return None
+    return {"variables": variables, "levels": levels}
+
+
 def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs):
 
     # pylint: disable=too-many-locals
@@ -382,6 +1348,9 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
     Keyword Args:
       members     (list): A list of integers corresponding to the ensemble members
       check_all   (bool): Flag that indicates whether all URLs should be checked for all files
+      subset      (dict): GRIB2 ``variables`` and ``levels`` to retrieve instead of whole files
+      cache  (FileCache): Shared cache of retrieved files
+      data_store   (str): Name of the data store, used in cache keys
 
     Returns:
       unavailable (list): A list of locations/files that were unretrievable
@@ -391,6 +1360,13 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
     members = cla.members if isinstance(cla.members, list) else [members]
 
     check_all = kwargs.get("check_all", False)
+    subset = kwargs.get("subset")
+    data_store = kwargs.get("data_store", method)
+
+    # Symlinks and existence checks are already cheap, and don't produce files to cache
+    cache = kwargs.get("cache")
+    if cla.check_file or (method == "disk" and cla.symlink):
+        cache = None
 
     logging.info(f"Getting files named like {file_templates}")
 
@@ -402,10 +1378,21 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
 
     input_locs = input_locs if isinstance(input_locs, list) else [input_locs]
 
+    locs_files = pair_locs_with_files(input_locs, file_templates, check_all)
+    if cla.num_workers > 1 or subset:
+        return fetch_requested_files(
+            cla,
+            locs_files,
+            members,
+            method=method,
+            subset=subset,
+            cache=cache,
+            data_store=data_store,
+        )
+
     orig_path = os.getcwd()
     unavailable = []
 
-    locs_files = pair_locs_with_files(input_locs, file_templates, check_all)
     for mem in members:
         target_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
         target_path = create_target_path(target_path)
@@ -435,23 +1422,42 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
                     )
                     logging.info(f"Getting file: {input_loc}")
                     logging.debug(f"Target path: {target_path}")
-                    if method == "disk":
-                        if cla.symlink:
-                            retrieved = copy_file(input_loc, target_path, "ln -sf")
-                        else:
-                            retrieved = copy_file(input_loc, target_path, "cp")
 
-                    elif method == "download":
+                    cache_key = None
+                    if cache is not None and FileCache.cacheable(input_loc):
+                        cache_key = cache.source_key(
+                            cla.data_type, data_store, input_loc, subset, on_disk=method == "disk"
+                        )
+
+                    def retrieve(input_loc=input_loc, target_path=target_path):
+                        if method == "disk":
+                            return copy_file(input_loc, target_path, disk_copy_cmd(cla))
 
                         if cla.check_file:
                             retrieved = check_file(input_loc)
 
                         else:
+                            journal = TransferJournal(target_path)
+                            file_name = os.path.basename(input_loc)
+                            if journal.verified(file_name, input_loc):
+                                logging.info(f"{input_loc} was already retrieved and verified")
+                                return True
                             retrieved = download_file(input_loc)
+                            if retrieved and os.path.isfile(file_name):
+                                journal.complete(file_name, input_loc)
                         # Wait a bit before trying the next download.
                         # Seems to reduce the occurrence of timeouts
                         # when downloading from AWS
                         time.sleep(5)
+                        return retrieved
+
+                    retrieved = cached_retrieval(
+                        cache,
+                        cache_key,
+                        os.path.join(target_path, os.path.basename(input_loc)),
+                        retrieve,
+                        link=method != "disk",
+                    )
 
                     logging.debug(f"Retrieved status: {retrieved}")
                     if not retrieved:
@@ -469,6 +1475,177 @@ def get_requested_files(cla, file_templates, input_locs, method="disk", **kwargs
     return unavailable
 
 
+def disk_copy_cmd(cla):
+
+    """Returns the ``copy_file()`` command for staging files from disk, given the command line 
+    arguments (Namespace object)."""
+
+    if cla.symlink:
+        return "ln -sf"
+    if cla.hardlink:
+        return "ln"
+    return "cp"
+
+
+def fetch_requested_files(cla, locs_files, members, method="download", **kwargs):
+
+    """Retrieves the requested files for all ensemble members and forecast hours concurrently, 
+    using a pool of ``--num_workers`` threads. Files are downloaded (or checked, with 
+    ``--check_file``) with ``HTTPTransfer`` for the ``download`` method, and staged in-process 
+    with ``copy_files()`` for the ``disk`` method.
+
+    Each (member, forecast hour) pair moves through the location/template combinations in 
+    priority order, just as in ``get_requested_files()``: the first combination that provides all 
+    of its files wins, and the remaining pairs are retried together at the next combination.
+
+    Args:
+      cla        (str) : Command line arguments (Namespace object)
+      locs_files (list): Locations paired with file templates from ``pair_locs_with_files()``
+      members    (list): A list of integers corresponding to the ensemble members
+      method     (str) : Choice of ``"disk"`` or ``"download"`` to indicate protocol for 
+                         retrieval
+
+    Keyword Args:
+      subset     (dict): GRIB2 ``variables`` and ``levels`` to retrieve instead of whole files
+      cache (FileCache): Shared cache of retrieved files
+      data_store  (str): Name of the data store, used in cache keys
+
+    Returns:
+      unavailable (list): A list of locations/files that were unretrievable
+    """
+
+    subset = kwargs.get("subset")
+    cache = kwargs.get("cache")
+    data_store = kwargs.get("data_store", method)
+
+    if method == "download":
+        transfer = HTTPTransfer(
+            num_workers=cla.num_workers,
+            max_per_host=cla.max_per_host,
+            subset=subset,
+        )
+
+        def fetch_all(jobs):
+            return transfer.fetch_all(jobs, check_only=cla.check_file)
+
+    else:
+
+        def fetch_all(jobs):
+            return copy_files(jobs, disk_copy_cmd(cla), cla.num_workers)
+
+    target_paths = {}
+    for mem in members:
+        target_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
+        target_paths[mem] = create_target_path(target_path)
+        logging.info(f"Retrieved files will be placed here: \n {target_paths[mem]}")
+
+    unavailable = []
+    pending = [(mem, fcst_hr) for mem in members for fcst_hr in cla.fcst_hrs]
+    for loc, templates in locs_files:
+        if not pending:
+            break
+
+        templates = templates if isinstance(templates, list) else [templates]
+        logging.debug(f"Looking for files like {templates}")
+        logging.debug(f"They should be here: {loc}")
+
+        requests = {}
+        for mem, fcst_hr in pending:
+            requests[(mem, fcst_hr)] = []
+            template_loc = loc
+            for tmpl_num, template in enumerate(templates):
+                if isinstance(loc, list) and len(loc) == len(templates):
+                    template_loc = loc[tmpl_num]
+                input_loc = fill_template(
+                    os.path.join(template_loc, template),
+                    cla.cycle_date,
+                    fcst_hr=fcst_hr,
+                    mem=mem,
+                )
+                logging.info(f"Getting file: {input_loc}")
+                requests[(mem, fcst_hr)].append((input_loc, target_paths[mem]))
+
+        jobs = [req for reqs in requests.values() for req in reqs]
+        retrieved = {}
+        cache_keys = {}
+        if cache is not None:
+            for url, target_path in jobs:
+                if FileCache.cacheable(url):
+                    cache_keys[url] = cache.source_key(
+                        cla.data_type, data_store, url, subset, on_disk=method == "disk"
+                    )
+                dest = os.path.join(target_path, os.path.basename(url))
+                if cache_keys.get(url) and cache.fetch(cache_keys[url], dest):
+                    retrieved[(url, target_path)] = True
+
+        fetched = fetch_all([job for job in jobs if job not in retrieved])
+        for (url, target_path), status in fetched.items():
+            dest = os.path.join(target_path, os.path.basename(url))
+            if status and cache_keys.get(url) and os.path.isfile(dest):
+                cache.insert(cache_keys[url], dest, link=method != "disk")
+        retrieved.update(fetched)
+
+        pending = []
+        for key, reqs in requests.items():
+            missing = [url for url, target_path in reqs if not retrieved[(url, target_path)]]
+            if missing:
+                unavailable.extend(missing)
+                pending.append(key)
+
+        if pending:
+            logging.debug(f"Some files were not retrieved: {unavailable}")
+            logging.debug("Will check other locations for missing files")
+
+    return unavailable
+
+
+# Results of hsi_probe() for this run, keyed by HPSS path
+HPSS_LISTING = {}
+
+
+def hsi_probe(file_paths):
+
+    """Checks which of the given HPSS paths exist, using a single ``hsi`` session for all paths 
+    that have not been checked earlier in this run. Results are memoized in ``HPSS_LISTING``.
+
+    ``hsi ls -1`` lists each existing path on its own line (on stdout or stderr, depending on 
+    the ``hsi`` version) and exits with a non-zero status if any path is missing.
+
+    Args:
+        file_paths (list): File paths on HPSS
+
+    Returns:
+        A set of the paths that exist
+    """
+
+    unknown = [path for path in dict.fromkeys(file_paths) if path not in HPSS_LISTING]
+    if unknown:
+        cmd = f'hsi -q "ls -1 {" ".join(unknown)}"'
+        logging.info(f"Running command \n {cmd}")
+        result = subprocess.run(
+            cmd,
+            check=False,
+            shell=True,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0:
+            found = set(unknown)
+        else:
+            listed = {line.strip() for line in (result.stdout + result.stderr).splitlines()}
+            found = {
+                path
+                for path in unknown
+                if path in listed or os.path.basename(path) in listed
+            }
+        for path in unknown:
+            HPSS_LISTING[path] = path in found
+            if path not in found:
+                logging.warning(f"{path} is not available!")
+
+    return {path for path in file_paths if HPSS_LISTING[path]}
+
+
 def hsi_single_file(file_path, mode="ls"):
 
     """Calls ``hsi`` as a subprocess for Python and returns information about whether the 
@@ -495,7 +1672,37 @@ def hsi_single_file(file_path, mode="ls"):
     return file_path
 
 
-def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1):
+def get_archive_locations(cla, store_specs):
+
+    """Returns the archive paths and archive file names of an ``htar`` data store for the 
+    requested file format and file set.
+
+    Args:
+        cla          (str): Command line arguments (Namespace object)
+        store_specs (dict): Data-store specifications (specs) file
+
+    Returns:
+        A tuple of equal-length lists (archive_paths, archive_file_names). Items of 
+        ``archive_file_names`` may themselves be lists.
+    """
+
+    archive_paths = store_specs["archive_path"]
+    archive_paths = (
+        archive_paths if isinstance(archive_paths, list) else [archive_paths]
+    )
+
+    # Could be a list of lists
+    archive_file_names = store_specs.get("archive_file_names", {})
+    if cla.file_fmt is not None:
+        archive_file_names = archive_file_names[cla.file_fmt]
+
+    if isinstance(archive_file_names, dict):
+        archive_file_names = archive_file_names[cla.file_set]
+
+    return archive_paths, archive_file_names
+
+
+def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1, cache=None):
 
     # pylint: disable=too-many-locals
 
@@ -504,6 +1711,10 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
     or ``tar``), it will either pull the entire file and unzip it or attempt to pull individual 
     files from a tar file.
 
+    The files needed for all members and archive internal directories are gathered first, so 
+    that each archive is fetched and extracted only once. The extracted files are then moved (or 
+    copied, when more than one member needs the same file) to each member's output path.
+
     It cleans up the local disk after files are deemed available in order to remove any empty 
     subdirectories that may still be present.
 
@@ -516,6 +1727,7 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
         members     (list): A list of integers corresponding to the ensemble members
         ens_group    (int): A number associated with a bin where ensemble members are stored in 
                             archive files
+        cache  (FileCache): Shared cache of retrieved files. Cached files are not extracted again.
 
     Returns:
         A Python set of unavailable files
@@ -525,18 +1737,7 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
     """
     members = [-1] if members == -1 else members
 
-    archive_paths = store_specs["archive_path"]
-    archive_paths = (
-        archive_paths if isinstance(archive_paths, list) else [archive_paths]
-    )
-
-    # Could be a list of lists
-    archive_file_names = store_specs.get("archive_file_names", {})
-    if cla.file_fmt is not None:
-        archive_file_names = archive_file_names[cla.file_fmt]
-
-    if isinstance(archive_file_names, dict):
-        archive_file_names = archive_file_names[cla.file_set]
+    archive_paths, archive_file_names = get_archive_locations(cla, store_specs)
 
     unavailable = {}
     existing_archives = {}
@@ -570,6 +1771,11 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
     # archive_internal_dir
     logging.debug(f"Checking archive number {which_archive} in list.")
 
+    # Plan the extraction: collect the files needed from the archive for
+    # every internal directory and member, so that each archive is only
+    # extracted once.
+    plan = []
+    cache_keys = {}
     for archive_internal_dir_tmpl in archive_internal_dirs:
         for mem in members:
             archive_internal_dir = fill_template(
@@ -579,17 +1785,9 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
             )
 
             output_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
-            logging.info(f"Will place files in {os.path.abspath(output_path)}")
-            logging.debug(f"CWD: {os.getcwd()}")
-
             if mem != -1:
-                archive_internal_dir = fill_template(
-                    archive_internal_dir_tmpl,
-                    cla.cycle_date,
-                    mem=mem,
-                )
                 output_path = create_target_path(output_path)
-                logging.info(f"Will place files in {os.path.abspath(output_path)}")
+            logging.info(f"Will place files in {os.path.abspath(output_path)}")
 
             source_paths = []
             for fcst_hr in cla.fcst_hrs:
@@ -604,56 +1802,121 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
                         )
                     )
 
-            expected = set(source_paths)
-            unavailable = {}
-            for existing_archive in existing_archives.values():
-                if store_specs.get("archive_format", "tar") == "zip":
+            # Stage any files that are already in the cache, and only extract
+            # the rest.
+            if cache is not None:
+                for source_path in source_paths:
+                    if FileCache.cacheable(source_path):
+                        cache_keys[source_path] = cache.key(
+                            cla.data_type,
+                            "hpss",
+                            sorted(existing_archives.values()),
+                            source_path,
+                        )
+                source_paths = [
+                    source_path
+                    for source_path in source_paths
+                    if source_path not in cache_keys
+                    or not cache.fetch(
+                        cache_keys[source_path],
+                        os.path.join(output_path, os.path.basename(source_path)),
+                    )
+                ]
 
-                    # Get the entire file from HPSS
-                    existing_archive = hsi_single_file(existing_archive, mode="get")
+            if source_paths:
+                plan.append((archive_internal_dir, output_path, source_paths))
 
-                    # Grab only the necessary files from the archive
-                    cmd = f'unzip -o {os.path.basename(existing_archive)} {" ".join(source_paths)}'
+    if not plan:
+        logging.info("All requested files were found in the cache")
+        return {}
 
-                else:
-                    cmd = f'htar -xvf {existing_archive} {" ".join(source_paths)}'
+    all_source_paths = list(
+        dict.fromkeys(path for _, _, source_paths in plan for path in source_paths)
+    )
+    logging.debug(f"CWD: {os.getcwd()}")
 
-                logging.info(f"Running command \n {cmd}")
+    expected = set(all_source_paths)
+    unavailable = {}
+    for existing_archive in existing_archives.values():
+        if store_specs.get("archive_format", "tar") == "zip":
 
-                try:
-                    r = subprocess.run(
-                        cmd,
-                        check=False,
-                        shell=True,
-                    )
-                except:
-                    if r.returncode == 11:
-                        # Continue if files missing from archive; we will check later if this is
-                        # an acceptable condition
-                        logging.warning("One or more files not found in zip archive")
-                        pass
-                    else:
-                        raise Exception("Error running archive extraction command")
-
-                # Check that files exist and Remove any data transfer artifacts.
-                # Returns {'hpss': []}, turn that into a new dict of
-                # sets.
-                unavailable[existing_archive] = set(
-                    clean_up_output_dir(
-                        expected_subdir=archive_internal_dir,
-                        local_archive=os.path.basename(existing_archive),
-                        output_path=output_path,
-                        source_paths=source_paths,
-                    ).get("hpss", [])
-                )
+            # Get the entire file from HPSS
+            existing_archive = hsi_single_file(existing_archive, mode="get")
+
+            # Grab only the necessary files from the archive
+            cmd = f'unzip -o {os.path.basename(existing_archive)} {" ".join(all_source_paths)}'
+
+        else:
+            cmd = f'htar -xvf {existing_archive} {" ".join(all_source_paths)}'
+
+        logging.info(f"Running command \n {cmd}")
+
+        try:
+            r = subprocess.run(
+                cmd,
+                check=False,
+                shell=True,
+            )
+        except:
+            if r.returncode == 11:
+                # Continue if files missing from archive; we will check later if this is
+                # an acceptable condition
+                logging.warning("One or more files not found in zip archive")
+                pass
+            else:
+                raise Exception("Error running archive extraction command")
+
+        # Fan the extracted files out to each member's output path. A file
+        # needed by more than one member is copied for all but the last of
+        # them. Check that files exist and remove any data transfer
+        # artifacts. Returns {'hpss': []}, turn that into a new dict of
+        # sets.
+        unavailable[existing_archive] = set()
+        for n_entry, (_, output_path, source_paths) in enumerate(plan):
+            needed_later = {
+                path for _, _, later_paths in plan[n_entry + 1:] for path in later_paths
+            }
+            for source_path in source_paths:
+                if source_path not in needed_later:
+                    continue
+                for local_file in glob.glob(source_path.lstrip("/")):
+                    dest = os.path.join(output_path, os.path.basename(local_file))
+                    if os.path.abspath(local_file) != dest:
+                        shutil.copy(local_file, dest)
+
+            unavailable[existing_archive] |= set(
+                clean_up_output_dir(
+                    expected_subdir="./",
+                    local_archive="",
+                    output_path=output_path,
+                    source_paths=[p for p in source_paths if p not in needed_later],
+                ).get("hpss", [])
+            )
+
+        # Remove the directories from inside the archive (innermost first)
+        # and the local copy of the archive, if there is one.
+        archive_internal_dirs = sorted({entry[0] for entry in plan}, key=len, reverse=True)
+        for archive_internal_dir in archive_internal_dirs:
+            clean_up_output_dir(
+                expected_subdir=archive_internal_dir,
+                local_archive=os.path.basename(existing_archive),
+                output_path=cla.output_path,
+                source_paths=[],
+            )
+
+    # Once we go through all the archives, the union of all
+    # "unavailable" files should equal the "expected" list of
+    # files since clean_up_output_dir only reports on those that
+    # are missing from one of the files attempted. If any
+    # additional files are reported as unavailable, then
+    # something has gone wrong.
+    unavailable = set.union(*unavailable.values())
 
-            # Once we go through all the archives, the union of all
-            # "unavailable" files should equal the "expected" list of
-            # files since clean_up_output_dir only reports on those that
-            # are missing from one of the files attempted. If any
-            # additional files are reported as unavailable, then
-            # something has gone wrong.
-            unavailable = set.union(*unavailable.values())
+    for _, output_path, source_paths in plan:
+        for source_path in source_paths:
+            dest = os.path.join(output_path, os.path.basename(source_path))
+            if source_path in cache_keys and os.path.isfile(dest):
+                cache.insert(cache_keys[source_path], dest, link=True)
 
     # Break loop if unexpected files were found or if files were found
     # A successful file found does not equal the expected file list and 
@@ -665,6 +1928,263 @@ def hpss_requested_files(cla, file_names, store_specs, members=-1, ens_group=-1)
     return {}
 
 
+def plan_locs_files(cla, locs_files, members):
+
+    """Renders the source of every file for every location/template combination, ensemble 
+    member, and forecast hour, in the same priority order used by ``get_requested_files()``.
+
+    Args:
+      cla        (str) : Command line arguments (Namespace object)
+      locs_files (list): Locations paired with file templates from ``pair_locs_with_files()``
+      members    (list): A list of integers corresponding to the ensemble members
+
+    Returns:
+      A list of dicts with the ``priority`` (index of the location/template combination), 
+      ``member``, ``fcst_hr``, ``source``, and ``destination`` of each file
+    """
+
+    files = []
+    for priority, (loc, templates) in enumerate(locs_files):
+        templates = templates if isinstance(templates, list) else [templates]
+        for mem in members:
+            target_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
+            for fcst_hr in cla.fcst_hrs:
+                template_loc = loc
+                for tmpl_num, template in enumerate(templates):
+                    if isinstance(loc, list) and len(loc) == len(templates):
+                        template_loc = loc[tmpl_num]
+                    source = fill_template(
+                        os.path.join(template_loc, template),
+                        cla.cycle_date,
+                        fcst_hr=fcst_hr,
+                        mem=mem,
+                    )
+                    files.append({
+                        "priority": priority,
+                        "member": mem,
+                        "fcst_hr": fcst_hr,
+                        "source": source,
+                        "destination": os.path.join(target_path, os.path.basename(source)),
+                    })
+    return files
+
+
+def plan_archives(cla, file_names, store_specs):
+
+    """Renders the candidate archives of an ``htar`` data store for every ensemble group, along 
+    with the files expected inside them for every member and forecast hour.
+
+    Args:
+        cla          (str): Command line arguments (Namespace object)
+        file_names  (list): List of file names
+        store_specs (dict): Data-store specifications (specs) file
+
+    Returns:
+        A list of dicts, one for each ensemble group, with the ``ens_group``, the 
+        ``candidates`` (lists of HPSS paths, in priority order), and the ``members`` (files 
+        expected inside the archive)
+    """
+
+    archive_paths, archive_file_names = get_archive_locations(cla, store_specs)
+    archive_internal_dirs = store_specs.get("archive_internal_dir", [""])
+    if isinstance(archive_internal_dirs, dict):
+        archive_internal_dirs = archive_internal_dirs.get(cla.file_set, [""])
+
+    archives = []
+    for ens_group, members in get_ens_groups(cla.members).items():
+        membership = []
+        for archive_internal_dir_tmpl in archive_internal_dirs:
+            for mem in members:
+                archive_internal_dir = fill_template(
+                    archive_internal_dir_tmpl, cla.cycle_date, mem=mem
+                )
+                output_path = fill_template(cla.output_path, cla.cycle_date, mem=mem)
+                for fcst_hr in cla.fcst_hrs:
+                    for file_name in file_names:
+                        source = fill_template(
+                            os.path.join(archive_internal_dir, file_name),
+                            cla.cycle_date,
+                            fcst_hr=fcst_hr,
+                            mem=mem,
+                            ens_group=ens_group,
+                        )
+                        membership.append({
+                            "member": mem,
+                            "fcst_hr": fcst_hr,
+                            "source": source,
+                            "destination": os.path.join(
+                                output_path, os.path.basename(source)
+                            ),
+                        })
+        archives.append({
+            "ens_group": ens_group,
+            "candidates": archive_candidates(
+                archive_paths, archive_file_names, cla.cycle_date, ens_group
+            ),
+            "members": membership,
+        })
+    return archives
+
+
+def plan_data_store(cla, known_data_info, data_store):
+
+    """Renders the retrieval plan of a single data store for the cycle in ``cla.cycle_date``, 
+    without checking for or retrieving any files.
+
+    Args:
+        cla              (str) : Command line arguments (Namespace object)
+        known_data_info  (dict): Dictionary from ``data_locations.yml`` file
+        data_store       (str) : Name of the data store
+
+    Returns:
+        A dict describing the data store, with ``files`` for the ``disk`` and ``download`` 
+        protocols, or ``archives`` for the ``htar`` protocol
+    """
+
+    check_all = known_data_info.get("check_all", False)
+    if data_store == "disk":
+        file_templates = get_file_templates(
+            cla, known_data_info, data_store="hpss", use_cla_tmpl=True
+        )
+        protocol = "disk"
+        input_locs = cla.input_file_path
+    else:
+        store_specs = known_data_info.get(data_store, {})
+        if not store_specs:
+            raise KeyError(f"No information is available for {data_store}.")
+        file_templates = get_file_templates(cla, known_data_info, data_store=data_store)
+        protocol = store_specs.get("protocol")
+        input_locs = store_specs.get("url")
+
+    plan = {"data_store": data_store, "protocol": protocol}
+    if protocol == "htar":
+        plan["archive_format"] = store_specs.get("archive_format", "tar")
+        plan["archives"] = plan_archives(cla, file_templates, store_specs)
+        return plan
+
+    file_templates = file_templates if isinstance(file_templates, list) else [file_templates]
+    input_locs = input_locs if isinstance(input_locs, list) else [input_locs]
+    members = cla.members if isinstance(cla.members, list) else [""]
+    plan["files"] = plan_locs_files(
+        cla, pair_locs_with_files(input_locs, file_templates, check_all), members
+    )
+    return plan
+
+
+def check_plan(cla, cycles):
+
+    """Checks the existence of every file and archive in a retrieval plan, and records the 
+    results in place. All checks for all cycles are batched: URLs are checked concurrently with 
+    ``HEAD`` requests, HPSS archives with a single ``hsi`` session, and disk paths directly.
+
+    A data store is ``available`` for a cycle when, for every member and forecast hour, some 
+    location/template combination provides all of its files (or, for ``htar``, when an archive 
+    exists for every ensemble group). Availability is ``None`` when it can't be checked, e.g., 
+    when ``hsi`` is not on the ``PATH``.
+
+    Args:
+        cla     (str): Command line arguments (Namespace object)
+        cycles (list): Cycle plans, each with a list of ``data_stores`` plans
+    """
+
+    plans = [plan for cycle in cycles for plan in cycle["data_stores"]]
+
+    urls = [
+        file["source"]
+        for plan in plans
+        if plan["protocol"] == "download"
+        for file in plan["files"]
+    ]
+    transfer = HTTPTransfer(num_workers=max(cla.num_workers, 16), max_per_host=cla.max_per_host)
+    found_urls = transfer.fetch_all([(url, "") for url in urls], check_only=True)
+
+    archives = [
+        file_path
+        for plan in plans
+        if plan["protocol"] == "htar"
+        for archive in plan["archives"]
+        for item in archive["candidates"]
+        for file_path in item
+    ]
+    found_archives = None
+    if archives and shutil.which("hsi"):
+        found_archives = hsi_probe(archives)
+
+    for plan in plans:
+        if plan["protocol"] == "htar":
+            plan["available"] = None if found_archives is None else True
+            for archive in plan["archives"]:
+                archive["archive"] = None
+                if found_archives is None:
+                    continue
+                for item in archive["candidates"]:
+                    existing = [path for path in item if path in found_archives]
+                    if existing:
+                        archive["archive"] = existing
+                        break
+                else:
+                    plan["available"] = False
+            continue
+
+        by_pair = {}
+        for file in plan["files"]:
+            if plan["protocol"] == "download":
+                file["exists"] = found_urls[(file["source"], "")]
+            else:
+                file["exists"] = bool(glob.glob(file["source"]))
+            combos = by_pair.setdefault((file["member"], file["fcst_hr"]), {})
+            combos[file["priority"]] = combos.get(file["priority"], True) and file["exists"]
+        plan["available"] = all(any(combos.values()) for combos in by_pair.values())
+
+    for cycle in cycles:
+        cycle["data_store"] = next(
+            (plan["data_store"] for plan in cycle["data_stores"] if plan["available"]),
+            None,
+        )
+
+
+def plan_retrieval(cla, known_data_info):
+
+    """Renders the retrieval plan for every requested data store and cycle, and checks the 
+    existence of all files in it.
+
+    Cycles run from ``--cycle_date`` through ``--plan_end_date`` (if given) every 
+    ``--plan_interval`` hours.
+
+    Args:
+        cla              (str) : Command line arguments (Namespace object)
+        known_data_info  (dict): Dictionary from ``data_locations.yml`` file
+
+    Returns:
+        A JSON-serializable dict describing the plan
+    """
+
+    cycle_date = cla.cycle_date
+    last_date = cla.plan_end_date or cla.cycle_date
+    cycles = []
+    while cycle_date <= last_date:
+        cycle_cla = argparse.Namespace(**{**vars(cla), "cycle_date": cycle_date})
+        cycles.append({
+            "cycle_date": cycle_date.strftime("%Y%m%d%H%M"),
+            "data_stores": [
+                plan_data_store(cycle_cla, known_data_info, data_store)
+                for data_store in cla.data_stores
+            ],
+        })
+        cycle_date += dt.timedelta(hours=cla.plan_interval)
+
+    check_plan(cla, cycles)
+
+    return {
+        "data_type": cla.data_type,
+        "file_set": cla.file_set,
+        "ics_or_lbcs": cla.ics_or_lbcs,
+        "file_fmt": cla.file_fmt,
+        "output_path": cla.output_path,
+        "cycles": cycles,
+    }
+
+
 def load_str(arg):
 
     """Loads a dictionary string safely using YAML.
@@ -789,10 +2309,11 @@ def _setup_logging(debug=False):
         logging.info("Logging level set to DEBUG")
 
 
-def _write_summary_file(cla, data_store, file_templates) -> None:
+def _write_summary_file(cla, data_store, file_templates, cache=None) -> None:
 
     """Given the command line arguments and the data store from which the data was retrieved, 
-    write a bash summary file that is needed by the workflow elements downstream.
+    write a bash summary file that is needed by the workflow elements downstream. When a cache 
+    was used, its hit and miss counts are included.
     """
 
     members =  cla.members if isinstance(cla.members, list) else [-1]
@@ -816,6 +2337,13 @@ def _write_summary_file(cla, data_store, file_templates) -> None:
             EXTRN_MDL_FHRS=( {' '.join([str(i) for i in cla.fcst_hrs])} )
             """
         )
+        if cache is not None:
+            file_contents += dedent(
+                f"""\
+                EXTRN_MDL_CACHE_HITS={cache.hits}
+                EXTRN_MDL_CACHE_MISSES={cache.misses}
+                """
+            )
         logging.info(f"Contents: {file_contents}")
         with open(summary_fp, "w") as summary:
             summary.write(file_contents)
@@ -879,7 +2407,7 @@ def main(argv):
                 )
             )
 
-    if "hpss" in cla.data_stores:
+    if "hpss" in cla.data_stores and not cla.plan:
         # Make sure hpss module is loaded
         try:
             subprocess.run(
@@ -904,6 +2432,25 @@ def main(argv):
         logging.info(msg)
         logging.info(f"Checking provided disk location {cla.input_file_path}")
 
+    if cla.plan:
+        manifest = plan_retrieval(cla, known_data_info)
+        with open(cla.plan, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        logging.info(f"Wrote retrieval plan to {cla.plan}")
+        missing = [
+            cycle["cycle_date"]
+            for cycle in manifest["cycles"]
+            if cycle["data_store"] is None
+        ]
+        if missing:
+            logging.error(f"Requested files are not available for cycles: {missing}")
+            sys.exit(1)
+        return
+
+    cache = None
+    if cla.cache_dir:
+        cache = FileCache(cla.cache_dir, cla.cache_size_gb)
+
     unavailable = {}
     for data_store in cla.data_stores:
         logging.info(f"Checking {data_store} for {cla.data_type}")
@@ -924,6 +2471,7 @@ def main(argv):
                 file_templates=file_templates,
                 input_locs=cla.input_file_path,
                 method="disk",
+                cache=cache,
             )
 
         elif not store_specs:
@@ -946,10 +2494,28 @@ def main(argv):
                     input_locs=store_specs["url"],
                     method="download",
                     members=cla.members,
+                    subset=get_grib2_subset(cla, store_specs),
+                    cache=cache,
+                    data_store=data_store,
                 )
 
             if store_specs.get("protocol") == "htar":
                 ens_groups = get_ens_groups(cla.members)
+
+                # Check for the candidate archives of all ensemble groups at
+                # once, so that hpss_requested_files doesn't need hsi again.
+                archive_paths, archive_file_names = get_archive_locations(
+                    cla, store_specs
+                )
+                hsi_probe([
+                    file_path
+                    for ens_group in ens_groups
+                    for item in archive_candidates(
+                        archive_paths, archive_file_names, cla.cycle_date, ens_group
+                    )
+                    for file_path in item
+                ])
+
                 for ens_group, members in ens_groups.items():
                     unavailable = hpss_requested_files(
                         cla,
@@ -957,18 +2523,23 @@ def main(argv):
                         store_specs,
                         members=members,
                         ens_group=ens_group,
+                        cache=cache,
                     )
 
         if not unavailable:
             # All files are found. Stop looking!
             # Write a variable definitions file for the data, if requested
             if cla.summary_file and not cla.check_file:
-                _write_summary_file(cla, data_store, file_templates)
+                _write_summary_file(cla, data_store, file_templates, cache)
             break
 
         logging.debug(f"Some unavailable files: {unavailable}")
         logging.warning(f"Requested files are unavailable from {data_store}")
 
+    if cache is not None:
+        logging.info(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+        cache.evict()
+
     if unavailable:
         logging.error("Could not find any of the requested files.")
         sys.exit(1)
@@ -1095,6 +2666,12 @@ def parse_args(argv):
         action="store_true",
         help="Symlink data files when source is disk",
     )
+    parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help="Hard link data files when source is disk, copying them when \
+        a hard link is not possible",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -1141,6 +2718,58 @@ def parse_args(argv):
          but don't try to download them. Works with download protocol \
          only",
     )
+    parser.add_argument(
+        "--num_workers",
+        help="Number of files to retrieve concurrently. Values greater than \
+        1 use a pool of worker threads: downloads use persistent HTTP \
+        connections instead of calling wget for one file at a time, and \
+        files on disk are staged in parallel. default=1",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--max_per_host",
+        help="Maximum number of concurrent downloads from a single host \
+        when --num_workers is greater than 1. default=4",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Path to a shared cache of retrieved files. Files found in the \
+        cache are linked into the output path instead of being retrieved \
+        again, and newly retrieved files are added to it.",
+    )
+    parser.add_argument(
+        "--cache_size_gb",
+        help="Size limit of the cache in GB. The least recently used files \
+        are removed when the limit is exceeded. default=100",
+        default=100,
+        type=float,
+    )
+
+    parser.add_argument(
+        "--plan",
+        help="Path to a JSON manifest. Instead of retrieving files, write \
+        the sources, destinations and protocols of all requested files \
+        (and the archives expected to contain them) for every data \
+        store, and check which of them exist. Exits with an error if any \
+        cycle has no data store with all of its files.",
+        type=os.path.abspath,
+    )
+    parser.add_argument(
+        "--plan_end_date",
+        help="Last cycle date to include in the --plan manifest, in \
+        YYYYMMDDHH or YYYYMMDDHHmm format. default=--cycle_date",
+        type=to_datetime,
+    )
+    parser.add_argument(
+        "--plan_interval",
+        help="Interval in hours between the cycles in the --plan \
+        manifest. default=24",
+        default=24,
+        type=int,
+    )
 
     # Make modifications/checks for given values
 
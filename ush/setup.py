@@ -13,12 +13,15 @@ import yaml
 from uwtools.api.config import get_yaml_config
 
 from python_utils import (
+    ArtifactManifest,
     log_info,
     cd_vrfy,
     date_to_str,
     mkdir_vrfy,
     rm_vrfy,
     check_var_valid_value,
+    check_valid_values,
+    load_valid_values,
     lowercase,
     uppercase,
     list_to_str,
@@ -34,9 +37,11 @@ from python_utils import (
     load_ini_config,
     get_ini_value,
     str_to_list,
-    extend_yaml,
+    resolve_config,
     has_tag_with_value,
     load_xml_file,
+    phase,
+    timed,
 )
 
 from set_cycle_dates import set_cycle_dates
@@ -45,6 +50,7 @@ from set_gridparams_ESGgrid import set_gridparams_ESGgrid
 from set_gridparams_GFDLgrid import set_gridparams_GFDLgrid
 from link_fix import link_fix
 
+@timed
 def load_config_for_setup(ushdir, default_config, user_config):
     """Updates a Python dictionary in place with experiment configuration settings from the 
     default, machine, and user configuration files. 
@@ -165,9 +171,9 @@ def load_config_for_setup(ushdir, default_config, user_config):
     if taskgroups:
         cfg_wflow['rocoto']['tasks']['taskgroups'] = taskgroups
 
-    # Extend yaml here on just the rocoto section to include the
+    # Render templates here on just the rocoto section to include the
     # appropriate groups of tasks
-    extend_yaml(cfg_wflow)
+    resolve_config(cfg_wflow)
 
 
     # Put the entries expanded under taskgroups in tasks
@@ -237,7 +243,9 @@ def load_config_for_setup(ushdir, default_config, user_config):
         pass
     cfg_d["workflow"]["EXPT_BASEDIR"] = os.path.abspath(expt_basedir)
 
-    extend_yaml(cfg_d)
+    unresolved = resolve_config(cfg_d)
+    for path, reason in unresolved.items():
+        logging.debug(f"Template in {path} left unfilled ({reason})")
 
     # Do any conversions of data types
     for sect, settings in cfg_d.items():
@@ -354,7 +362,8 @@ def set_srw_paths(ushdir, expt_config):
     )
 
 
-def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
+@timed
+def setup(USHdir, user_config_fn="config.yaml", debug: bool = False, manifest=None):
     """Validates user-provided configuration settings and derives
     a secondary set of parameters needed to configure a Rocoto-based SRW App
     workflow. The secondary parameters are derived from a set of required
@@ -371,6 +380,9 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
         user_config_fn  (str): The name of a user-provided configuration YAML (usually 
                                ``config.yaml``)
         debug          (bool): Enable extra output for debugging
+        manifest       (ArtifactManifest): Records the inputs of the generated files. If it
+                               is in update mode, an existing ``EXPTDIR`` is kept and only
+                               files whose inputs changed are rewritten
 
     Returns:
         None
@@ -406,6 +418,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # Set up some paths relative to the SRW clone
     expt_config["user"].update(set_srw_paths(USHdir, expt_config))
 
+    phase("workflow")
     #
     # -----------------------------------------------------------------------
     #
@@ -444,6 +457,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
         )
 
 
+    phase("exptdir")
     #
     # -----------------------------------------------------------------------
     #
@@ -457,10 +471,14 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     exptdir = workflow_config.get("EXPTDIR")
 
     # Update some paths that include EXPTDIR and EXPT_BASEDIR
-    extend_yaml(expt_config)
+    resolve_config(expt_config)
+    if manifest is None:
+        manifest = ArtifactManifest()
     preexisting_dir_method = workflow_config.get("PREEXISTING_DIR_METHOD", "")
     try:
-        check_for_preexist_dir_file(exptdir, preexisting_dir_method)
+        # An update regenerates an existing experiment in place
+        if not manifest.update:
+            check_for_preexist_dir_file(exptdir, preexisting_dir_method)
     except ValueError:
         logger.exception(
             f"""
@@ -482,7 +500,9 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
             """
         )
         raise FileExistsError(errmsg) from None
+    manifest.load(exptdir)
 
+    phase("crontab")
     #
     # -----------------------------------------------------------------------
     #
@@ -499,6 +519,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
             f"""*/{intvl_mnts} * * * * cd {exptdir} && """
             f"""./{launch_script_fn} called_from_cron="TRUE" >> ./{launch_log_fn} 2>&1"""
         )
+    phase("platform")
     #
     # -----------------------------------------------------------------------
     #
@@ -565,6 +586,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
         post_meta = rocoto_tasks.get("metatask_run_ens_post", {})
         post_meta.pop("metatask_run_sub_hourly_post", None)
         post_meta.pop("metatask_sub_hourly_last_hour_post", None)
+    phase("vx_tasks")
     #
     # -----------------------------------------------------------------------
     #
@@ -625,6 +647,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
                     ))
                     rocoto_config['tasks'].pop(metatask)
 
+    phase("ics_lbcs")
     #
     # -----------------------------------------------------------------------
     #
@@ -708,6 +731,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
              """
          )
 
+    phase("forecast")
     #
     # -----------------------------------------------------------------------
     #
@@ -849,6 +873,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
                   LBC_SPEC_INTVL_HRS = {lbc_spec_intvl_hrs}"""
                 )
 
+    phase("grid")
     #
     # -----------------------------------------------------------------------
     #
@@ -910,6 +935,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
         if not fcst_config.get(val):
             raise Exception(f"\nMandatory variable '{val}' has not been set\n")
 
+    phase("stochastic_physics")
     #
     # -----------------------------------------------------------------------
     #
@@ -1040,6 +1066,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
               rem = FCST_LEN_HRS%%LBC_SPEC_INTVL_HRS = {rem}"""
         )
 
+    phase("post")
     #
     # -----------------------------------------------------------------------
     #
@@ -1180,6 +1207,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # Write updated value of POST_OUTPUT_DOMAIN_NAME back to dictionary
     post_config["POST_OUTPUT_DOMAIN_NAME"] = post_output_domain_name 
 
+    phase("output_dirs")
     #
     # -----------------------------------------------------------------------
     #
@@ -1199,6 +1227,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # create experiment dir
     mkdir_vrfy(f' -p "{exptdir}"')
 
+    phase("input_files")
     # -----------------------------------------------------------------------
     #
     # The FV3 forecast model needs the following input files in the run
@@ -1256,6 +1285,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
               FIELD_DICT_IN_UWM_FP = '{field_dict_in_uwm_fp}'"""
         )
 
+    phase("task_checks")
     #
     # -----------------------------------------------------------------------
     #
@@ -1294,6 +1324,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
               workflow.""")])
         raise Exception(msg)
 
+    phase("fix_links")
     #
     # -----------------------------------------------------------------------
     # NOTE: currently this is executed no matter what, should it be dependent on the logic described below??
@@ -1378,7 +1409,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
 
             # Link the fix files and check that their resolution is
             # consistent
-            res_in_fns = link_fix(
+            link_fix_args = dict(
                 verbose=verbose,
                 file_group=prep_task.lower(),
                 source_dir=task_dir,
@@ -1390,6 +1421,11 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
                 run_task=False,
                 sfc_climo_fields=fixed_files["SFC_CLIMO_FIELDS"],
             )
+            artifact = f"fix_{prep_task.lower()}_links"
+            if manifest.changed(artifact, inputs=link_fix_args,
+                                outputs=[workflow_config["FIXlam"]]):
+                manifest.set_result(artifact, link_fix(**link_fix_args))
+            res_in_fns = manifest.result(artifact)
             if not res_in_fixlam_filenames:
                 res_in_fixlam_filenames = res_in_fns
             else:
@@ -1448,6 +1484,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
                 SUB_HOURLY_POST is NOT available with Inline Post yet."""
             )
 
+    phase("ccpp_suite")
     #
     # -----------------------------------------------------------------------
     #
@@ -1488,6 +1525,7 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
         logging.debug(f'New fix file mapping:\n{fixed_files["CYCLEDIR_LINKS_TO_FIXam_FILES_MAPPING"]=}')
 
 
+    phase("var_defns")
     #
     # -----------------------------------------------------------------------
     #
@@ -1497,11 +1535,12 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # -----------------------------------------------------------------------
     #
 
-    extend_yaml(expt_config)
+    # Templates are rendered in dependency order, so a single pass fills
+    # in everything that can be filled before the type conversions
+    resolve_config(expt_config)
     for sect, sect_keys in expt_config.items():
         for k, v in sect_keys.items():
             expt_config[sect][k] = str_to_list(v)
-    extend_yaml(expt_config)
 
     # print content of var_defns if DEBUG=True
     all_lines = cfg_to_yaml_str(expt_config)
@@ -1522,9 +1561,11 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     clean_rocoto_dict(expt_config["rocoto"]["tasks"])
 
     rocoto_yaml_fp = workflow_config["ROCOTO_YAML_FP"]
-    with open(rocoto_yaml_fp, 'w') as f:
-        yaml.Dumper.ignore_aliases = lambda *args : True
-        yaml.dump(expt_config.get("rocoto"), f, sort_keys=False)
+    if manifest.changed("rocoto_yaml", inputs=expt_config.get("rocoto"),
+                        outputs=[rocoto_yaml_fp]):
+        with open(rocoto_yaml_fp, 'w') as f:
+            yaml.Dumper.ignore_aliases = lambda *args : True
+            yaml.dump(expt_config.get("rocoto"), f, sort_keys=False)
 
     var_defns_cfg = get_yaml_config(config=expt_config)
     del var_defns_cfg["rocoto"]
@@ -1532,9 +1573,12 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # Fixup a couple of data types:
     for dates in ("DATE_FIRST_CYCL", "DATE_LAST_CYCL"):
         var_defns_cfg["workflow"][dates] = date_to_str(var_defns_cfg["workflow"][dates])
-    var_defns_cfg.dump(global_var_defns_fp)
+    if manifest.changed("var_defns", inputs=dict(var_defns_cfg),
+                        outputs=[global_var_defns_fp]):
+        var_defns_cfg.dump(global_var_defns_fp)
 
 
+    phase("validation")
     #
     # -----------------------------------------------------------------------
     #
@@ -1543,31 +1587,16 @@ def setup(USHdir, user_config_fn="config.yaml", debug: bool = False):
     # -----------------------------------------------------------------------
     #
 
-    # loop through the flattened expt_config and check validity of params
-    cfg_v = load_config_file(os.path.join(USHdir, "valid_param_vals.yaml"))
-    for k, v in flatten_dict(expt_config).items():
-        if v is None or v == "":
-            continue
-        vkey = "valid_vals_" + k
-        if (vkey in cfg_v):
-            if (type(v) == list):
-                if not(all(ele in cfg_v[vkey] for ele in v)):
-                    raise Exception(
-                        dedent(f"""
-                        The variable
-                            {k} = {v}
-                        in the user's configuration has at least one invalid value.  Possible values are:
-                            {k} = {cfg_v[vkey]}"""
-                    ))
-            else:
-                if not (v in cfg_v[vkey]):
-                    raise Exception(
-                        dedent(f"""
-                        The variable
-                            {k} = {v}
-                        in the user's configuration does not have a valid value.  Possible values are:
-                            {k} = {cfg_v[vkey]}"""
-                    ))
+    # Check every variable that has a list of valid values, and report all
+    # of the invalid ones at once
+    valid_values = load_valid_values(
+        os.path.join(USHdir, "valid_param_vals.yaml"),
+        os.path.join(USHdir, "config_defaults.yaml"),
+        os.path.join(USHdir, "constants.yaml"),
+    )
+    errors = check_valid_values(expt_config, valid_values)
+    if errors:
+        raise Exception("\n".join(errors))
 
     return expt_config
 